@@ -0,0 +1,287 @@
+# batch_codegen.py
+"""
+Batch code generation for support tickets.
+
+Reads a JSONL file of tickets (one JSON object per line) and asks the chat model for a
+code fix and a Pytest test per ticket (llm_utils.build_codegen_messages), at most
+--concurrency at a time and spaced to stay under --requests-per-minute and
+--tokens-per-minute. Throttled and failed requests are retried with backoff
+(ingestion_engine.call_with_retry). Every code/test pair is written to the output JSONL
+as soon as it is extracted.
+
+Results are cached by (prompt template version, description hash, language), so a re-run
+only calls the model for tickets that failed or changed; finished ones are written from
+the cache. Changing the prompt template (CODEGEN_PROMPT_TEMPLATE_VERSION) starts afresh.
+
+Run with:  python batch_codegen.py tickets.jsonl generated.jsonl --concurrency 8 --requests-per-minute 120
+Tickets are read from the "description" field, identified by the "id" field (or their line
+number) and generated in the language of the "language" field (or --language). To try it
+without Azure, point AZURE_OPENAI_ENDPOINT at `python fake_azure_server.py`.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+from dotenv import load_dotenv
+
+from llm_utils import (get_llm_client, build_codegen_messages, extract_code_and_test, AZURE_OPENAI_DEPLOYMENT_NAME,
+                       CODEGEN_PROMPT_TEMPLATE_VERSION, CODEGEN_TEMPERATURE, CODEGEN_MAX_TOKENS)
+from ingestion_engine import call_with_retry
+from embedding_cache import normalize_text
+from token_utils import count_tokens
+import telemetry
+
+load_dotenv()
+
+CODEGEN_CONCURRENCY = int(os.getenv("CODEGEN_CONCURRENCY", "8"))
+# Request and token rate limits of the chat deployment (0 = no limit). Tokens are counted as
+# Azure does for its quota: the prompt plus max_tokens of the completion.
+CODEGEN_REQUESTS_PER_MINUTE = float(os.getenv("CODEGEN_REQUESTS_PER_MINUTE", "60"))
+CODEGEN_TOKENS_PER_MINUTE = float(os.getenv("CODEGEN_TOKENS_PER_MINUTE", "0"))
+CODEGEN_MAX_RETRIES = int(os.getenv("CODEGEN_MAX_RETRIES", "6"))
+CODEGEN_CACHE_ENABLED = os.getenv("CODEGEN_CACHE_ENABLED", "true").lower() != "false"
+CODEGEN_CACHE_PATH = os.getenv("CODEGEN_CACHE_PATH", "./codegen_cache.sqlite3")
+DEFAULT_LANGUAGE = "python"
+
+class RateLimiter:
+    """
+    Spaces out request starts so that at most requests_per_minute requests and
+    tokens_per_minute tokens are sent per minute (0 disables a limit). Requests are spread
+    evenly rather than sent in bursts, which per-minute quotas enforced over short windows
+    (as Azure OpenAI does) would throttle.
+    """
+    def __init__(self, requests_per_minute=CODEGEN_REQUESTS_PER_MINUTE, tokens_per_minute=CODEGEN_TOKENS_PER_MINUTE):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._next_request = 0.0
+        self._next_tokens = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=0):
+        """Blocks until a request of the given number of tokens may start; returns the seconds waited."""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_request, self._next_tokens)
+            if self.requests_per_minute > 0:
+                self._next_request = start + 60.0 / self.requests_per_minute
+            if self.tokens_per_minute > 0:
+                self._next_tokens = start + tokens * 60.0 / self.tokens_per_minute
+        delay = start - now
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+def make_codegen_cache_key(description, language, template_version=CODEGEN_PROMPT_TEMPLATE_VERSION):
+    """Cache key of a ticket: the prompt template version, the hash of its normalized description and the language."""
+    description_hash = hashlib.sha256(normalize_text(description).encode('utf-8', errors='ignore')).hexdigest()
+    return hashlib.sha256(f"{template_version}\x00{description_hash}\x00{language}".encode('utf-8')).hexdigest()
+
+class CodegenCache:
+    """SQLite cache of generated (code, test) pairs keyed by make_codegen_cache_key."""
+    def __init__(self, path=CODEGEN_CACHE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, template_version INTEGER NOT NULL, language TEXT NOT NULL, "
+            "code TEXT NOT NULL, test TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def get(self, key):
+        """Returns the cached (code, test), or None."""
+        with self._lock:
+            row = self._db.execute("SELECT code, test FROM results WHERE key = ?", (key,)).fetchone()
+        return tuple(row) if row else None
+
+    def put(self, key, language, code, test, template_version=CODEGEN_PROMPT_TEMPLATE_VERSION):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                             (key, template_version, language, code, test, time.time()))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+def iter_tickets(input_path, description_field="description", id_field="id", language_field="language"):
+    """Streams the input JSONL and yields {"id", "description", "language"} (language may be None)."""
+    with open(input_path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                print(f"Skipping line {line_number} of '{input_path}': {e}")
+                continue
+            description = str(record.get(description_field) or "").strip()
+            if not description:
+                print(f"Skipping line {line_number} of '{input_path}': no '{description_field}'.")
+                continue
+            yield {"id": str(record.get(id_field, f"line-{line_number}")), "description": description,
+                   "language": record.get(language_field) or None}
+
+def generate_for_ticket(client, limiter, description, language, max_retries=CODEGEN_MAX_RETRIES):
+    """
+    Generates the code and test for one ticket, waiting for the rate limiter before every
+    attempt. Returns {"code", "test", "retries", "prompt_tokens", "completion_tokens"};
+    raises the last error once retries are exhausted or the error is not retryable.
+    """
+    messages = build_codegen_messages(description, language)
+    tokens = count_tokens(messages[0]["content"]) + count_tokens(messages[1]["content"]) + CODEGEN_MAX_TOKENS
+    stats = {"retries": 0}
+
+    def request():
+        limiter.acquire(tokens)
+        return client.chat.completions.create(
+            model=AZURE_OPENAI_DEPLOYMENT_NAME,
+            messages=messages,
+            temperature=CODEGEN_TEMPERATURE,
+            max_tokens=CODEGEN_MAX_TOKENS
+        )
+
+    with telemetry.span("codegen", language=language) as span:
+        response = call_with_retry(request, max_retries=max_retries, stats=stats)
+        usage = response.usage
+        span.set(retries=stats["retries"], completion_tokens=usage.completion_tokens if usage else None)
+    code, test = extract_code_and_test(response.choices[0].message.content or "", language)
+    return {"code": code, "test": test, "retries": stats["retries"],
+            "prompt_tokens": usage.prompt_tokens if usage else 0,
+            "completion_tokens": usage.completion_tokens if usage else 0}
+
+def run_batch_codegen(tickets, output_path, language=DEFAULT_LANGUAGE, concurrency=CODEGEN_CONCURRENCY,
+                      requests_per_minute=CODEGEN_REQUESTS_PER_MINUTE, tokens_per_minute=CODEGEN_TOKENS_PER_MINUTE,
+                      max_retries=CODEGEN_MAX_RETRIES, cache=None, client=None):
+    """
+    Generates code and tests for every ticket and writes one JSON line per ticket to
+    output_path (overwritten) as soon as it completes. tickets is an iterable of description
+    strings or {"id", "description", "language"} dicts and is consumed lazily. cache is a
+    CodegenCache (default: one at CODEGEN_CACHE_PATH if CODEGEN_CACHE_ENABLED; False disables
+    caching); only complete code/test pairs are cached. Returns a summary dict with counts, throughput and failure rate.
+    """
+    client = client or get_llm_client()
+    if client is None:
+        print("Failed to initialize the Azure OpenAI client. Exiting.")
+        return None
+    # Retries happen in call_with_retry, which counts them and honours Retry-After
+    client = client.with_options(max_retries=0)
+    owned_cache = CodegenCache() if cache is None and CODEGEN_CACHE_ENABLED else None
+    cache = owned_cache or cache or None # cache=False disables caching
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    summary = {"tickets": 0, "generated": 0, "cached": 0, "failed": 0, "retries": 0,
+               "prompt_tokens": 0, "completion_tokens": 0}
+    latencies = []
+    pending = {} # future -> (ticket, cache key, start time)
+    start_time = time.perf_counter()
+
+    def write(out, ticket, outcome, code="", test="", **extra):
+        record = dict(ticket, code=code, test=test, cached=outcome == "cached", **extra)
+        summary[outcome] += 1
+        telemetry.incr("rag_codegen_tickets_total", outcome=outcome)
+        # Records are written from this thread only, one whole line at a time
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out.flush()
+
+    def finish(out, future):
+        ticket, key, ticket_start = pending.pop(future)
+        latency = time.perf_counter() - ticket_start
+        try:
+            result = future.result()
+        except Exception as e:
+            write(out, ticket, "failed", error=f"{e.__class__.__name__}: {e}", latency=latency)
+            return
+        summary["retries"] += result["retries"]
+        summary["prompt_tokens"] += result["prompt_tokens"]
+        summary["completion_tokens"] += result["completion_tokens"]
+        if not (result["code"] and result["test"]):
+            write(out, ticket, "failed", result["code"], result["test"], retries=result["retries"], latency=latency,
+                  error="The response did not contain both a code block and a test block.")
+            return
+        if cache is not None:
+            cache.put(key, ticket["language"], result["code"], result["test"])
+        latencies.append(latency)
+        write(out, ticket, "generated", result["code"], result["test"], retries=result["retries"], latency=latency)
+
+    try:
+        with open(output_path, 'w', encoding='utf-8') as out, \
+                ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="codegen") as executor:
+            for number, ticket in enumerate(tickets, start=1):
+                if isinstance(ticket, str):
+                    ticket = {"id": f"ticket-{number}", "description": ticket}
+                ticket = {"id": ticket.get("id", f"ticket-{number}"), "description": ticket["description"],
+                          "language": ticket.get("language") or language}
+                summary["tickets"] += 1
+                key = make_codegen_cache_key(ticket["description"], ticket["language"])
+                cached = cache.get(key) if cache is not None else None
+                if cached is not None:
+                    write(out, ticket, "cached", *cached)
+                    continue
+                # Read ahead only while the workers keep up, so memory stays bounded
+                while len(pending) >= 2 * concurrency:
+                    done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finish(out, future)
+                future = executor.submit(generate_for_ticket, client, limiter, ticket["description"],
+                                         ticket["language"], max_retries)
+                pending[future] = (ticket, key, time.perf_counter())
+            while pending:
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                for future in done:
+                    finish(out, future)
+    finally:
+        if owned_cache is not None:
+            owned_cache.close()
+
+    summary["elapsed"] = time.perf_counter() - start_time
+    summary["tickets_per_second"] = summary["tickets"] / summary["elapsed"] if summary["elapsed"] else 0.0
+    summary["failure_rate"] = summary["failed"] / summary["tickets"] if summary["tickets"] else 0.0
+    summary["latency_p50_seconds"] = float(np.percentile(latencies, 50)) if latencies else None
+    summary["latency_p95_seconds"] = float(np.percentile(latencies, 95)) if latencies else None
+    print(f"Processed {summary['tickets']} tickets in {summary['elapsed']:.1f}s "
+          f"({summary['tickets_per_second']:.2f} tickets/s): {summary['generated']} generated, "
+          f"{summary['cached']} from the cache, {summary['failed']} failed "
+          f"(failure rate {summary['failure_rate']:.1%}, {summary['retries']} retries).")
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate code fixes and tests for a JSONL file of tickets.")
+    parser.add_argument("input", help="JSONL file with one ticket object per line.")
+    parser.add_argument("output", help="JSONL file the code/test pairs are written to.")
+    parser.add_argument("--language", default=DEFAULT_LANGUAGE, help="Language of tickets without a language field.")
+    parser.add_argument("--concurrency", type=int, default=CODEGEN_CONCURRENCY, help="Maximum concurrent LLM calls.")
+    parser.add_argument("--requests-per-minute", type=float, default=CODEGEN_REQUESTS_PER_MINUTE, help="0 = no limit.")
+    parser.add_argument("--tokens-per-minute", type=float, default=CODEGEN_TOKENS_PER_MINUTE, help="0 = no limit.")
+    parser.add_argument("--max-retries", type=int, default=CODEGEN_MAX_RETRIES)
+    parser.add_argument("--cache-path", default=CODEGEN_CACHE_PATH)
+    parser.add_argument("--no-cache", action="store_true", help="Neither read nor write the result cache.")
+    parser.add_argument("--description-field", default="description")
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--language-field", default="language")
+    args = parser.parse_args()
+
+    codegen_cache = False if args.no_cache or not CODEGEN_CACHE_ENABLED else CodegenCache(args.cache_path)
+    try:
+        run_batch_codegen(
+            iter_tickets(args.input, args.description_field, args.id_field, args.language_field),
+            args.output,
+            language=args.language,
+            concurrency=args.concurrency,
+            requests_per_minute=args.requests_per_minute,
+            tokens_per_minute=args.tokens_per_minute,
+            max_retries=args.max_retries,
+            cache=codegen_cache
+        )
+    finally:
+        if codegen_cache:
+            codegen_cache.close()
@@ -0,0 +1,196 @@
+# batch_qa.py
+"""
+Batch question answering over the indexed knowledge base.
+
+Reads a JSONL file of questions (one JSON object per line), retrieves context for a whole
+batch of questions with one embedding call and one ChromaDB query, and runs the chat
+completions concurrently (at most --parallelism at a time). Every answer is appended to
+the output JSONL, with its sources and timings, as soon as it finishes.
+
+Every question gets one record; one that failed (in retrieval or in the chat completion)
+has "answer": null and an "error". Re-running with the same output file resumes:
+questions that already have an answer there are skipped, and the records of failed ones
+are removed from the file before they are asked again, so every id keeps a single record.
+
+Run with:  python batch_qa.py questions.jsonl answers.jsonl --parallelism 8
+Questions are read from the "question" field and identified by the "id" field (or their
+line number); use --question-field / --id-field for other layouts, e.g.
+--question-field body --id-field request_id.
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from openai_utils import get_async_openai_client, get_chat_completion_async
+from chromadb_utils import get_chroma_collection, query_chroma_batch
+from rag_prompts import build_rag_messages
+from context_packer import pack_context_batch, CONTEXT_PACKING_ENABLED, CONTEXT_CANDIDATES
+
+BATCH_QA_PARALLELISM = int(os.getenv("BATCH_QA_PARALLELISM", "8"))
+BATCH_QA_BATCH_SIZE = int(os.getenv("BATCH_QA_BATCH_SIZE", "64"))
+DEFAULT_N_RESULTS = 3
+
+def load_answered_ids(output_path):
+    """
+    Returns the IDs that already have an answer in output_path, and compacts the file to one
+    answered record per ID: records of failed questions, which are about to be asked again,
+    are dropped, as is a line torn by a crash mid-write.
+    """
+    answered = {}
+    if not os.path.exists(output_path):
+        return set()
+    with open(output_path, 'rb') as f:
+        data = f.read()
+    lines = data.splitlines(keepends=True)
+    for line in lines:
+        if not line.endswith(b"\n"):
+            continue # Torn by a crash mid-write
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if record.get("answer") is not None:
+            answered[record["id"]] = line
+    kept = b"".join(answered.values())
+    if kept != data:
+        tmp_path = output_path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(kept)
+        os.replace(tmp_path, output_path)
+    return set(answered)
+
+def iter_question_batches(input_path, batch_size, question_field="question", id_field="id", skip_ids=()):
+    """Streams the input JSONL and yields lists of {"id", "question"} of at most batch_size."""
+    batch = []
+    with open(input_path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                print(f"Skipping line {line_number} of '{input_path}': {e}")
+                continue
+            question = str(record.get(question_field) or "").strip()
+            if not question:
+                print(f"Skipping line {line_number} of '{input_path}': no '{question_field}'.")
+                continue
+            question_id = str(record.get(id_field, f"line-{line_number}"))
+            if question_id in skip_ids:
+                continue
+            batch.append({"id": question_id, "question": question})
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+def retrieve_batch(collection, questions, n_results):
+    """Retrieves for all questions with one embedding call and one ChromaDB query; returns [(documents, ids)]."""
+    if CONTEXT_PACKING_ENABLED:
+        results = pack_context_batch(collection, questions, candidates=max(n_results, CONTEXT_CANDIDATES))
+    else:
+        results = query_chroma_batch(collection, questions, n_results)
+    return [(result["documents"], result["ids"]) for result in results]
+
+async def run_batch_qa(input_path, output_path, parallelism=BATCH_QA_PARALLELISM, batch_size=BATCH_QA_BATCH_SIZE,
+                       n_results=DEFAULT_N_RESULTS, question_field="question", id_field="id"):
+    """Answers every not yet answered question of input_path; returns a summary dict."""
+    openai_client = get_async_openai_client()
+    collection = get_chroma_collection()
+    if not all([openai_client, collection]):
+        print("Failed to initialize all necessary clients. Exiting.")
+        return None
+
+    answered_ids = load_answered_ids(output_path)
+    if answered_ids:
+        print(f"Resuming: {len(answered_ids)} questions in '{output_path}' are already answered.")
+
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(parallelism)
+    summary = {"answered": 0, "failed": 0, "resumed": len(answered_ids)}
+    pending = set()
+    start_time = time.perf_counter()
+
+    async def answer(item, documents, ids, retrieval_time, batch_start):
+        async with semaphore:
+            llm_start = time.perf_counter()
+            response = await get_chat_completion_async(openai_client, build_rag_messages(item["question"], documents))
+            llm_time = time.perf_counter() - llm_start
+        record = dict(item, answer=response, sources=ids, timings={
+            "retrieval": retrieval_time,
+            "queue": llm_start - batch_start - retrieval_time,
+            "llm": llm_time,
+            "total": time.perf_counter() - batch_start,
+        })
+        if response is None:
+            record["error"] = "The language model did not return an answer."
+            summary["failed"] += 1
+        else:
+            summary["answered"] += 1
+        write(record)
+
+    def write(record):
+        # Records are written from the event loop thread only, one whole line at a time
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out.flush()
+
+    with open(output_path, 'a', encoding='utf-8') as out, \
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="batch-qa-retrieval") as executor:
+        for batch in iter_question_batches(input_path, batch_size, question_field, id_field, answered_ids):
+            # Keep reading ahead only while the LLM calls keep up, so memory stays bounded
+            while len(pending) >= parallelism:
+                await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            batch_start = time.perf_counter()
+            try:
+                results = await loop.run_in_executor(
+                    executor, retrieve_batch, collection, [item["question"] for item in batch], n_results
+                )
+            except Exception as e:
+                print(f"Error retrieving context for a batch of {len(batch)} questions: {e}")
+                retrieval_time = time.perf_counter() - batch_start
+                for item in batch:
+                    write(dict(item, answer=None, sources=[], timings={"retrieval": retrieval_time},
+                               error=f"Retrieving context failed: {e}"))
+                summary["failed"] += len(batch)
+                continue
+            retrieval_time = time.perf_counter() - batch_start
+            for item, (documents, ids) in zip(batch, results):
+                task = asyncio.create_task(answer(item, documents, ids, retrieval_time, batch_start))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.gather(*pending)
+    await openai_client.close()
+
+    summary["elapsed"] = time.perf_counter() - start_time
+    summary["questions_per_second"] = (summary["answered"] + summary["failed"]) / summary["elapsed"] if summary["elapsed"] else 0.0
+    print(f"Answered {summary['answered']} questions ({summary['failed']} failed, {summary['resumed']} already done) "
+          f"in {summary['elapsed']:.1f}s ({summary['questions_per_second']:.2f} questions/s).")
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions with the RAG pipeline.")
+    parser.add_argument("input", help="JSONL file with one question object per line.")
+    parser.add_argument("output", help="JSONL file the answers are appended to (also used to resume; "
+                                           "records of failed questions are replaced).")
+    parser.add_argument("--parallelism", type=int, default=BATCH_QA_PARALLELISM, help="Maximum concurrent LLM calls.")
+    parser.add_argument("--batch-size", type=int, default=BATCH_QA_BATCH_SIZE, help="Questions embedded and retrieved per call.")
+    parser.add_argument("--n-results", type=int, default=DEFAULT_N_RESULTS,
+                        help="Chunks retrieved per question (minimum candidates with context packing).")
+    parser.add_argument("--question-field", default="question")
+    parser.add_argument("--id-field", default="id")
+    args = parser.parse_args()
+
+    asyncio.run(run_batch_qa(
+        args.input, args.output,
+        parallelism=args.parallelism,
+        batch_size=args.batch_size,
+        n_results=args.n_results,
+        question_field=args.question_field,
+        id_field=args.id_field
+    ))
@@ -0,0 +1,10 @@
+# benchmarks/__init__.py
+"""
+Reproducible benchmarks of the ingest and question paths against fake_azure_server.py.
+
+    python -m benchmarks.run_benchmarks --sizes small,medium --output report.json
+    python -m benchmarks.compare baseline.json report.json
+
+corpus.py generates synthetic txt/pdf/docx documents, harness.py times calls and
+summarizes them (throughput, p50/p95/p99 latency, peak RSS) into a JSON report.
+"""
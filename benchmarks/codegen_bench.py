@@ -0,0 +1,113 @@
+# benchmarks/codegen_bench.py
+"""
+Measures batch code generation (batch_codegen.py) against a fake Azure OpenAI server whose
+chat endpoint answers code-generation prompts with a code block and a test block:
+
+    python -m benchmarks.codegen_bench --tickets 200 --latency 0.2 --concurrency 8 --output codegen_report.json
+
+Runs, each on a fresh result cache unless noted:
+  * sequential: one ticket at a time, as a loop over llm_utils.generate_code_and_tests does;
+  * concurrent: --concurrency tickets at a time;
+  * concurrent, re-run: the same tickets again, served from the cache of the previous run;
+  * concurrent, throttled: every --throttle-every-th request gets a 429 and is retried;
+  * rate limited: --requests-per-minute caps the request rate.
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+
+from fake_azure_server import run_fake_server
+from benchmarks.harness import summarize, quiet, write_report, print_results
+from benchmarks.run_benchmarks import configure_environment
+
+_FUNCTIONS = ["calculate_discount", "parse_invoice", "merge_accounts", "send_reminder", "export_report"]
+
+def make_tickets(count):
+    return [{"id": f"TICKET-{i}",
+             "description": f"The '{_FUNCTIONS[i % len(_FUNCTIONS)]}' function fails for input {i}: "
+                            f"it raises a KeyError when the customer record has no region. It should default to 'EU'."}
+            for i in range(count)]
+
+def run(name, tickets, output_path, cache_path, **options):
+    """Runs batch code generation and returns its benchmark record, with the summary's counts."""
+    from batch_codegen import run_batch_codegen, CodegenCache
+    cache = CodegenCache(cache_path)
+    try:
+        with quiet():
+            summary = run_batch_codegen(tickets, output_path, cache=cache, **options)
+    finally:
+        cache.close()
+    with open(output_path, 'r', encoding='utf-8') as f:
+        written = sum(1 for _ in f)
+    latencies = [summary["elapsed"]] # One batch; throughput is tickets over its wall-clock time
+    return summarize(name, latencies, summary["tickets"], "tickets", written=written,
+                     **{key: summary[key] for key in ("generated", "cached", "failed", "retries", "failure_rate",
+                                                      "latency_p50_seconds", "latency_p95_seconds")})
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batch code generation against a fake Azure OpenAI server.")
+    parser.add_argument("--tickets", type=int, default=200)
+    parser.add_argument("--sequential-tickets", type=int, default=40, help="Tickets of the (slow) sequential run.")
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds the fake server takes per request.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--throttle-every", type=int, default=10)
+    parser.add_argument("--requests-per-minute", type=float, default=600)
+    parser.add_argument("--workdir", help="Scratch directory (default: a temporary directory, removed afterwards).")
+    parser.add_argument("--output", default="codegen_report.json")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="rag-codegen-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    server, state = run_fake_server(latency=args.latency, retry_after=0)
+    configure_environment(server, workdir, embedding_cache=False)
+    tickets = make_tickets(args.tickets)
+    try:
+        def path(name):
+            return os.path.join(workdir, name)
+
+        print(f"Generating code for {args.sequential_tickets} tickets sequentially...")
+        results = [run("codegen[sequential]", tickets[:args.sequential_tickets], path("sequential.jsonl"),
+                       path("sequential.sqlite3"), concurrency=1, requests_per_minute=0)]
+        print(f"Generating code for {args.tickets} tickets, {args.concurrency} at a time...")
+        results.append(run(f"codegen[concurrency={args.concurrency}]", tickets, path("concurrent.jsonl"),
+                           path("concurrent.sqlite3"), concurrency=args.concurrency, requests_per_minute=0))
+        results.append(run(f"codegen[concurrency={args.concurrency},rerun]", tickets, path("rerun.jsonl"),
+                           path("concurrent.sqlite3"), concurrency=args.concurrency, requests_per_minute=0))
+
+        print(f"Generating with every {args.throttle_every}th request throttled...")
+        state.throttle_every = args.throttle_every
+        throttled_before = state.snapshot()["throttled"]
+        results.append(run(f"codegen[concurrency={args.concurrency},throttled]", tickets, path("throttled.jsonl"),
+                           path("throttled.sqlite3"), concurrency=args.concurrency, requests_per_minute=0))
+        results[-1]["server_throttled"] = state.snapshot()["throttled"] - throttled_before
+        state.throttle_every = 0
+
+        rate_limited_tickets = tickets[:max(1, int(args.requests_per_minute / 60 * 5))] # About five seconds of requests
+        print(f"Generating {len(rate_limited_tickets)} tickets at {args.requests_per_minute:.0f} requests/minute...")
+        results.append(run(f"codegen[rpm={args.requests_per_minute:.0f}]", rate_limited_tickets, path("limited.jsonl"),
+                           path("limited.sqlite3"), concurrency=args.concurrency,
+                           requests_per_minute=args.requests_per_minute))
+        results[-1]["requests_per_minute_achieved"] = (results[-1]["units"] - 1) / results[-1]["total_seconds"] * 60
+
+        with open(path("concurrent.jsonl"), 'r', encoding='utf-8') as f:
+            sample = json.loads(f.readline())
+        write_report(args.output, results, dict(vars(args), fake_server=state.snapshot()), sample_record=sample)
+        print()
+        print_results(results)
+        print()
+        for result in results:
+            print(f"{result['name']:<36} {result['throughput']:8.1f} tickets/s  {result['generated']} generated, "
+                  f"{result['cached']} cached, {result['failed']} failed ({result['failure_rate']:.1%}), "
+                  f"{result['retries']} retries")
+        print(f"Report written to '{args.output}'.")
+    finally:
+        server.shutdown()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
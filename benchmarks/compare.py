@@ -0,0 +1,54 @@
+# benchmarks/compare.py
+"""
+Compares two benchmark reports and flags regressions.
+
+    python -m benchmarks.compare baseline.json current.json --threshold 0.10
+
+Exits with status 1 if any benchmark got slower (p50/p95) or its throughput dropped by
+more than the threshold, so it can gate CI.
+"""
+import sys
+import json
+import argparse
+
+# (metric, True if larger is better)
+COMPARED_METRICS = (("throughput", True), ("p50_ms", False), ("p95_ms", False), ("peak_rss_mb", False))
+
+def load_results(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        report = json.load(f)
+    return report.get("commit"), {result["name"]: result for result in report["results"]}
+
+def compare_reports(baseline_path, current_path, threshold=0.10):
+    """Prints the relative change of every metric; returns the list of regressions."""
+    baseline_commit, baseline = load_results(baseline_path)
+    current_commit, current = load_results(current_path)
+    print(f"Baseline {baseline_commit or baseline_path} vs current {current_commit or current_path}")
+    regressions = []
+    for name, result in current.items():
+        previous = baseline.get(name)
+        if previous is None:
+            print(f"{name:<40} (new)")
+            continue
+        changes = []
+        for metric, higher_is_better in COMPARED_METRICS:
+            old, new = previous.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            changes.append(f"{metric} {change:+.1%}")
+            # Peak RSS is process-wide and order dependent, so it is reported but never gates
+            if metric != "peak_rss_mb" and (-change if higher_is_better else change) > threshold:
+                regressions.append((name, metric, change))
+        print(f"{name:<40} {', '.join(changes)}")
+    for name, metric, change in regressions:
+        print(f"REGRESSION: {name} {metric} {change:+.1%}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports.")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change that counts as a regression.")
+    args = parser.parse_args()
+    sys.exit(1 if compare_reports(args.baseline, args.current, args.threshold) else 0)
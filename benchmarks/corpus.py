@@ -0,0 +1,166 @@
+# benchmarks/corpus.py
+"""
+Deterministic synthetic corpus: pseudo-English paragraphs with headings and ID-like
+tokens (e.g. "ERR-1042"), written as .txt, .pdf and .docx files. The PDF and DOCX
+writers are minimal and hand-written, so generating a corpus needs no extra packages.
+"""
+import os
+import random
+import zipfile
+from xml.sax.saxutils import escape
+
+# Approximate number of characters of text per document size
+CORPUS_SIZES = {
+    "small": 20_000,
+    "medium": 200_000,
+    "large": 2_000_000,
+}
+CORPUS_FORMATS = ("txt", "pdf", "docx")
+
+_SYLLABLES = ["ka", "lo", "mi", "ra", "ten", "vo", "shi", "del", "an", "por", "qu", "zen", "bi", "tor", "ex", "ul"]
+_COMMON_WORDS = ["the", "a", "of", "to", "and", "is", "in", "for", "with", "on", "by", "must", "should", "when"]
+
+def make_vocabulary(rng, size=2000):
+    """Pseudo-words of two to four syllables."""
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+def generate_paragraphs(num_chars, seed=0):
+    """Returns paragraphs (some of them headings) totalling roughly num_chars characters."""
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(rng)
+    paragraphs = []
+    total = 0
+    section = 1
+    while total < num_chars:
+        if rng.random() < 0.1:
+            paragraph = f"{section}. {' '.join(rng.choice(vocabulary) for _ in range(3)).title()}"
+            section += 1
+        else:
+            sentences = []
+            for _ in range(rng.randint(3, 7)):
+                words = [rng.choice(vocabulary) if rng.random() < 0.7 else rng.choice(_COMMON_WORDS)
+                         for _ in range(rng.randint(8, 20))]
+                if rng.random() < 0.15:
+                    words.insert(rng.randrange(len(words)), f"ERR-{rng.randint(1000, 9999)}")
+                sentence = " ".join(words)
+                sentences.append(sentence[0].upper() + sentence[1:] + ".")
+            paragraph = " ".join(sentences)
+        paragraphs.append(paragraph)
+        total += len(paragraph) + 2
+    return paragraphs
+
+def sample_questions(paragraphs, count, seed=0):
+    """Questions built from phrases of the corpus, so that they have relevant answers."""
+    rng = random.Random(seed + 1)
+    sentences = [sentence.split() for paragraph in paragraphs for sentence in paragraph.split(". ")
+                 if len(sentence.split()) > 8]
+    questions = []
+    for _ in range(count):
+        words = [word.rstrip(".") for word in rng.choice(sentences)]
+        start = rng.randrange(len(words) - 6)
+        questions.append(f"What does the document say about {' '.join(words[start:start + rng.randint(3, 6)])}?")
+    return questions
+
+def write_txt(path, paragraphs):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("\n\n".join(paragraphs))
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def _wrap(paragraphs, width):
+    lines = []
+    for paragraph in paragraphs:
+        line = ""
+        for word in paragraph.split():
+            if line and len(line) + 1 + len(word) > width:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}" if line else word
+        lines.extend([line, ""])
+    return lines
+
+def write_pdf(path, paragraphs, lines_per_page=60, chars_per_line=95):
+    """Writes a minimal PDF 1.4 file: one Helvetica text stream per page, plain ASCII text."""
+    lines = _wrap(paragraphs, chars_per_line)
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+    num_pages = len(pages)
+    # Object numbers: 1 catalog, 2 page tree, 3 font, then (page, content) pairs
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        ("<< /Type /Pages /Kids [%s] /Count %d >>" % (
+            " ".join(f"{4 + 2 * i} 0 R" for i in range(num_pages)), num_pages)).encode('ascii'),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, page_lines in enumerate(pages):
+        text = " T*\n".join(f"({_pdf_escape(line)}) Tj" for line in page_lines)
+        stream = f"BT /F1 10 Tf 12 TL 40 800 Td\n{text}\nET".encode('latin-1', errors='replace')
+        objects.append(("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                        f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>").encode('ascii'))
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+
+    data = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_offset = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        data += b"%010d 00000 n \n" % offset
+    data += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+_DOCX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+_DOCX_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/>'
+    '</Relationships>'
+)
+
+def write_docx(path, paragraphs):
+    """Writes a minimal .docx package with one plain paragraph per paragraph."""
+    body = "".join(f'<w:p><w:r><w:t xml:space="preserve">{escape(paragraph)}</w:t></w:r></w:p>'
+                   for paragraph in paragraphs)
+    document = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                f'<w:body>{body}</w:body></w:document>')
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as package:
+        package.writestr("[Content_Types].xml", _DOCX_CONTENT_TYPES)
+        package.writestr("_rels/.rels", _DOCX_RELS)
+        package.writestr("word/document.xml", document)
+
+WRITERS = {"txt": write_txt, "pdf": write_pdf, "docx": write_docx}
+
+def generate_corpus(directory, sizes=("small", "medium"), formats=CORPUS_FORMATS, seed=0):
+    """
+    Writes one document per (size, format) into directory and returns a list of
+    {"path", "size", "format", "chars"}; documents of the same size share their text.
+    """
+    os.makedirs(directory, exist_ok=True)
+    documents = []
+    for size in sizes:
+        # Seeded per size name, so a size always has the same text whichever sizes are generated
+        paragraphs = generate_paragraphs(CORPUS_SIZES[size], seed=seed + list(CORPUS_SIZES).index(size))
+        chars = sum(len(p) for p in paragraphs)
+        for fmt in formats:
+            path = os.path.join(directory, f"{size}_{seed}.{fmt}")
+            WRITERS[fmt](path, paragraphs)
+            documents.append({"path": path, "size": size, "format": fmt, "chars": chars})
+    return documents
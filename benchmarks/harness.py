@@ -0,0 +1,107 @@
+# benchmarks/harness.py
+import os
+import sys
+import json
+import time
+import platform
+import datetime
+import contextlib
+import subprocess
+
+import numpy as np
+
+try:
+    import resource # Unix only
+except ImportError:
+    resource = None
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MiB (None where unsupported)."""
+    # ru_maxrss survives exec on Linux, so a subprocess would report its parent's peak; VmHWM does not
+    try:
+        with open("/proc/self/status", 'r') as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+@contextlib.contextmanager
+def quiet():
+    """Silences the progress output of the pipeline functions while they are timed."""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+def summarize(name, latencies, units, unit, **extra):
+    """
+    Builds a result record from per-call latencies (seconds) and the number of units
+    (documents, characters, queries, ...) processed by all calls together.
+    peak_rss_mb is the process-wide peak so far, so run memory-heavy benchmarks last.
+    """
+    latencies = np.asarray(latencies, dtype=np.float64)
+    total = float(latencies.sum())
+    result = {
+        "name": name,
+        "calls": int(len(latencies)),
+        "units": units,
+        "unit": unit,
+        "total_seconds": total,
+        "throughput": units / total if total else None,
+        "p50_ms": float(np.percentile(latencies, 50) * 1000) if len(latencies) else None,
+        "p95_ms": float(np.percentile(latencies, 95) * 1000) if len(latencies) else None,
+        "p99_ms": float(np.percentile(latencies, 99) * 1000) if len(latencies) else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    result.update(extra)
+    return result
+
+def time_calls(fn, args_list, repeat=1):
+    """Calls fn(*args) for every args tuple, repeat times, with output silenced; returns (latencies, results)."""
+    latencies, results = [], []
+    with quiet():
+        for _ in range(repeat):
+            for args in args_list:
+                start = time.perf_counter()
+                results.append(fn(*args))
+                latencies.append(time.perf_counter() - start)
+    return latencies, results
+
+def git_commit():
+    """The current git commit of the working tree, or None outside a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return None
+
+def write_report(path, results, config, **sections):
+    """
+    Writes the benchmark results with enough context (commit, machine, config) to compare
+    runs; extra sections (e.g. telemetry) are added as top-level keys.
+    """
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": config,
+        "results": results,
+    }
+    report.update(sections)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+def print_results(results):
+    """Prints a one-line summary per benchmark."""
+    for result in results:
+        throughput = f"{result['throughput']:.1f} {result['unit']}/s" if result["throughput"] else "n/a"
+        p50, p95, p99 = (f"{result[key]:.1f}" if result[key] is not None else "n/a" for key in ("p50_ms", "p95_ms", "p99_ms"))
+        print(f"{result['name']:<40} {throughput:>22}  p50 {p50:>8} ms  p95 {p95:>8} ms  p99 {p99:>8} ms"
+              f"  rss {result['peak_rss_mb'] or 0:.0f} MiB")
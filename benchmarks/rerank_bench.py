@@ -0,0 +1,184 @@
+# benchmarks/rerank_bench.py
+"""
+Compares plain top-k retrieval with two-stage retrieval (over-retrieve, re-rank, keep the
+best few) on answer hit rate, prompt context tokens and latency:
+
+    python -m benchmarks.rerank_bench --queries 200 --mode vector --output rerank_report.json
+
+Every question asks about a phrase of the corpus; a retrieval is a hit when one of the
+chunks that reach the prompt contains that phrase. The report also gives the smallest
+plain top-k that matches the hit rate of the re-ranked top-k, and the context tokens the
+re-ranked prompt saves against it. A final run with a tiny latency budget exercises the
+fallback to the first-stage order.
+"""
+import os
+import re
+import sys
+import shutil
+import argparse
+import tempfile
+
+from fake_azure_server import run_fake_server
+from benchmarks.corpus import generate_corpus, generate_paragraphs, sample_questions, CORPUS_SIZES
+from benchmarks.harness import summarize, time_calls, quiet, write_report, print_results
+from benchmarks.run_benchmarks import configure_environment
+
+_PHRASE_RE = re.compile(r"^What does the document say about (.*)\?$")
+
+def normalize(text):
+    return " ".join(text.split()).lower()
+
+def question_phrase(question):
+    return normalize(_PHRASE_RE.match(question).group(1))
+
+def hit_stats(questions, contexts):
+    """Hit rate and mean reciprocal rank of the first chunk (or passage) containing each question's phrase."""
+    hits, reciprocal_ranks = 0, 0.0
+    for question, documents in zip(questions, contexts):
+        phrase = question_phrase(question)
+        rank = next((rank for rank, document in enumerate(documents, start=1) if phrase in normalize(document)), None)
+        if rank is not None:
+            hits += 1
+            reciprocal_ranks += 1.0 / rank
+    return hits / len(questions), reciprocal_ranks / len(questions)
+
+def bench_top_k(collection, questions, k, rerank, mode, label, **rerank_options):
+    """Retrieves the top k chunks per question, one question at a time, as the CLI does."""
+    import chromadb_utils
+    from rag_prompts import format_context
+    from token_utils import count_tokens
+
+    def retrieve(question):
+        return chromadb_utils.query_chroma_batch(collection, [question], k, mode=mode, rerank=rerank)[0]
+
+    latencies, results = time_calls(retrieve, [(q,) for q in questions])
+    contexts = [result["documents"] for result in results]
+    hit_rate, mrr = hit_stats(questions, contexts)
+    tokens = [count_tokens(format_context(documents)) for documents in contexts]
+    return summarize(f"{label}[top{k}]", latencies, len(questions), "queries", k=k, hit_rate=hit_rate, mrr=mrr,
+                     context_tokens_mean=sum(tokens) / len(tokens),
+                     fallbacks=sum(result.get("rerank") == "fallback" for result in results), **rerank_options)
+
+def bench_packing(collection, questions, token_budget, rerank, mode):
+    """Packs a token-budgeted context per question (context_packer) with and without re-ranking."""
+    import chromadb_utils
+    from context_packer import pack_result, CONTEXT_CANDIDATES
+
+    def retrieve(question):
+        result = chromadb_utils.query_chroma_batch(collection, [question], CONTEXT_CANDIDATES, mode=mode,
+                                                   include_embeddings=True, rerank=rerank)[0]
+        return pack_result(result, token_budget)
+
+    latencies, packed = time_calls(retrieve, [(q,) for q in questions])
+    hit_rate, mrr = hit_stats(questions, [context["documents"] for context in packed])
+    return summarize(f"{'rerank' if rerank else 'vector'}_packed[{token_budget}]", latencies, len(questions), "queries",
+                     token_budget=token_budget, hit_rate=hit_rate, mrr=mrr,
+                     context_tokens_mean=sum(context["tokens"] for context in packed) / len(packed))
+
+def token_savings(results, rerank_k):
+    """Compares the re-ranked top rerank_k with the smallest plain top-k reaching at least its hit rate."""
+    reranked = next(result for result in results if result["name"] == f"rerank[top{rerank_k}]")
+    plain = sorted((result for result in results if result["name"].startswith("vector[")), key=lambda result: result["k"])
+    matching = next((result for result in plain if result["hit_rate"] >= reranked["hit_rate"]), None)
+    if matching is None:
+        return {"rerank_k": rerank_k, "rerank_hit_rate": reranked["hit_rate"], "matching_vector_k": None,
+                "note": f"no plain top-k up to {plain[-1]['k']} reaches the re-ranked hit rate"}
+    return {
+        "rerank_k": rerank_k,
+        "rerank_hit_rate": reranked["hit_rate"],
+        "rerank_context_tokens": reranked["context_tokens_mean"],
+        "matching_vector_k": matching["k"],
+        "vector_hit_rate": matching["hit_rate"],
+        "vector_context_tokens": matching["context_tokens_mean"],
+        "context_tokens_saved": 1.0 - reranked["context_tokens_mean"] / matching["context_tokens_mean"],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark two-stage retrieval against a fake Azure OpenAI server.")
+    parser.add_argument("--sizes", default="small,medium", help="Comma-separated document sizes of the corpus.")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--mode", default="vector", choices=["vector", "hybrid", "auto"], help="First-stage retrieval mode.")
+    parser.add_argument("--reranker", default="lexical", help="Re-ranker to benchmark (see reranker.RERANKERS).")
+    parser.add_argument("--candidates", type=int, default=50, help="Candidates retrieved by the first stage.")
+    parser.add_argument("--vector-k", default="1,3,5,10,20,50", help="Comma-separated plain top-k values.")
+    parser.add_argument("--rerank-k", default="1,3,5", help="Comma-separated re-ranked top-k values.")
+    parser.add_argument("--budgets", default="500,1000,1500", help="Comma-separated context token budgets for packing.")
+    parser.add_argument("--workdir", help="Scratch directory (default: a temporary directory, removed afterwards).")
+    parser.add_argument("--output", default="rerank_report.json")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="rag-rerank-bench-")
+    server, state = run_fake_server()
+    configure_environment(server, workdir, embedding_cache=True)
+    os.environ.update(RERANKER=args.reranker, RERANK_CANDIDATES=str(args.candidates))
+
+    import chromadb_utils
+    chromadb_utils.CHROMA_DB_PERSIST_DIR = os.path.join(workdir, "chroma_db_data")
+    chromadb_utils.BM25_INDEX_DIR = os.path.join(workdir, "chroma_db_data", "bm25")
+    chromadb_utils.QUANTIZED_STORE_DIR = os.path.join(workdir, "chroma_db_data", "quantized")
+    import reranker
+    from indexer import prepare_and_index_documents
+    try:
+        print("Indexing the corpus...")
+        sizes = [size for size in args.sizes.split(",") if size]
+        generate_corpus(os.path.join(workdir, "documents"), sizes, ["txt"])
+        paragraphs = [paragraph for i, size in enumerate(CORPUS_SIZES) if size in sizes
+                      for paragraph in generate_paragraphs(CORPUS_SIZES[size], seed=i)]
+        questions = sample_questions(paragraphs, args.queries)
+        with quiet():
+            collection = chromadb_utils.get_chroma_collection("rerank_bench")
+            prepare_and_index_documents(collection, os.path.join(workdir, "documents"),
+                                        os.path.join(workdir, "chroma_db_data", "manifest.json"))
+            if reranker.get_reranker(args.reranker) is None:
+                print(f"Re-ranker '{args.reranker}' is not available.", file=sys.stderr)
+                return 1
+            # Warm the embedding cache, so that both variants time retrieval rather than the first embedding call
+            chromadb_utils.query_chroma_batch(collection, questions, 1, mode=args.mode, rerank=False)
+
+        print(f"Retrieving for {len(questions)} questions ({args.mode} first stage, {args.reranker} re-ranker)...")
+        results = []
+        for k in [int(k) for k in args.vector_k.split(",") if k]:
+            results.append(bench_top_k(collection, questions, k, False, args.mode, "vector"))
+        rerank_ks = [int(k) for k in args.rerank_k.split(",") if k]
+        for k in rerank_ks:
+            results.append(bench_top_k(collection, questions, k, True, args.mode, "rerank", candidates=args.candidates))
+        for budget in [int(budget) for budget in args.budgets.split(",") if budget]:
+            for rerank in (False, True):
+                results.append(bench_packing(collection, questions, budget, rerank, args.mode))
+
+        # Nothing can be scored within a microsecond, so every query falls back to the first-stage order
+        budget_ms = reranker.RERANK_BUDGET_MS
+        reranker.RERANK_BUDGET_MS = 0.001
+        try:
+            results.append(bench_top_k(collection, questions, rerank_ks[0], True, args.mode, "rerank_no_budget",
+                                       budget_ms=reranker.RERANK_BUDGET_MS))
+        finally:
+            reranker.RERANK_BUDGET_MS = budget_ms
+
+        savings = [token_savings(results, k) for k in rerank_ks]
+        write_report(args.output, results, dict(vars(args), fake_server=state.snapshot()), token_savings=savings)
+        print()
+        print_results(results)
+        print()
+        for result in results:
+            print(f"{result['name']:<28} hit rate {result['hit_rate']:6.1%}  MRR {result['mrr']:.3f}  "
+                  f"context {result['context_tokens_mean']:7.1f} tokens"
+                  + (f"  ({result['fallbacks']} fallbacks)" if result.get("fallbacks") else ""))
+        print()
+        for saving in savings:
+            if saving["matching_vector_k"] is None:
+                print(f"Re-ranked top-{saving['rerank_k']} ({saving['rerank_hit_rate']:.1%} hit rate): {saving['note']}.")
+            else:
+                print(f"Re-ranked top-{saving['rerank_k']} ({saving['rerank_hit_rate']:.1%} hit rate) matches plain "
+                      f"top-{saving['matching_vector_k']} ({saving['vector_hit_rate']:.1%}) with "
+                      f"{saving['context_tokens_saved']:.0%} fewer context tokens "
+                      f"({saving['rerank_context_tokens']:.0f} vs {saving['vector_context_tokens']:.0f}).")
+        print(f"Report written to '{args.output}'.")
+    finally:
+        server.shutdown()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,220 @@
+# benchmarks/run_benchmarks.py
+"""
+Runs the benchmark suite against a local fake Azure OpenAI server and writes a JSON report.
+
+    python -m benchmarks.run_benchmarks --sizes small,medium --queries 50 --output report.json
+
+Covers the document readers, chunking, add_documents_to_chroma, a full incremental
+ingest (cold and unchanged), query_chroma in every retrieval mode and the full question
+path (retrieval, prompt and chat completion, blocking and streamed). Everything runs in
+a temporary directory; the real ChromaDB data and embedding cache are never touched.
+"""
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+
+from fake_azure_server import run_fake_server
+from benchmarks.corpus import generate_corpus, generate_paragraphs, sample_questions, CORPUS_SIZES, CORPUS_FORMATS
+from benchmarks.harness import summarize, time_calls, quiet, write_report, print_results
+
+def configure_environment(server, workdir, embedding_cache):
+    """Points the pipeline at the fake server and the scratch directory; must run before importing it."""
+    os.environ.update(
+        AZURE_OPENAI_API_KEY="benchmark",
+        AZURE_OPENAI_ENDPOINT=f"http://127.0.0.1:{server.server_port}",
+        AZURE_OPENAI_API_VERSION="2024-06-01",
+        AZURE_OPENAI_DEPLOYMENT_NAME="bench-chat",
+        AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME="bench-embeddings",
+        EMBEDDING_BACKEND="azure",
+        EMBEDDING_CACHE_DIR=os.path.join(workdir, "embedding_cache"),
+        EMBEDDING_CACHE_ENABLED="true" if embedding_cache else "false",
+        SEMANTIC_CACHE_ENABLED="false",
+    )
+
+def bench_readers(documents, repeat):
+    import document_processor
+    readers = {
+        "txt": document_processor.read_text_file,
+        "pdf": document_processor.read_pdf_file,
+        "docx": document_processor.read_docx_file,
+    }
+    results = []
+    for document in documents:
+        latencies, _ = time_calls(readers[document["format"]], [(document["path"],)], repeat)
+        results.append(summarize(f"read_{document['format']}_file[{document['size']}]",
+                                 latencies, document["chars"] * repeat, "chars"))
+    return results
+
+def bench_chunking(documents, repeat):
+    from document_processor import read_text_file, chunk_text
+    from chunker import get_chunker
+    results = []
+    for document in documents:
+        if document["format"] != "txt":
+            continue
+        text = read_text_file(document["path"])
+        latencies, chunks = time_calls(chunk_text, [(text,)], repeat)
+        results.append(summarize(f"chunk_text[{document['size']}]", latencies, len(text) * repeat, "chars",
+                                 chunks=len(chunks[0])))
+        latencies, chunks = time_calls(lambda t: list(get_chunker()([(None, t)])), [(text,)], repeat)
+        results.append(summarize(f"token_chunker[{document['size']}]", latencies, len(text) * repeat, "chars",
+                                 chunks=len(chunks[0])))
+        # One segment per line ending in a single newline, as from readers without blank lines between paragraphs
+        lines = [(None, " ".join(paragraph.split()) + "\n") for paragraph in text.split("\n\n")]
+        latencies, chunks = time_calls(lambda segments: list(get_chunker()(segments)), [(lines,)], repeat)
+        results.append(summarize(f"token_chunker_lines[{document['size']}]", latencies,
+                                 sum(len(line) for _, line in lines) * repeat, "chars", chunks=len(chunks[0])))
+    return results
+
+def bench_add_documents(state, size):
+    import chromadb_utils
+    from chunker import get_chunker
+    from indexer import INDEX_FLUSH_CHUNKS
+    text = "\n\n".join(generate_paragraphs(CORPUS_SIZES[size], seed=99))
+    chunks = [chunk for chunk, _ in get_chunker()([(None, text)])]
+    with quiet():
+        collection = chromadb_utils.get_chroma_collection("bench_add")
+    # One call per group of INDEX_FLUSH_CHUNKS chunks, as the indexer makes them
+    groups = []
+    for start in range(0, len(chunks), INDEX_FLUSH_CHUNKS):
+        group = chunks[start:start + INDEX_FLUSH_CHUNKS]
+        indices = range(start, start + len(group))
+        groups.append((collection, group, [{"source": "bench-add", "chunk_idx": i} for i in indices],
+                       [f"bench-add:{i}" for i in indices]))
+    before = state.snapshot()
+    latencies, _ = time_calls(chromadb_utils.add_documents_to_chroma, groups)
+    after = state.snapshot()
+    result = summarize(f"add_documents_to_chroma[{size}]", latencies, len(chunks), "chunks",
+                       embedding_requests=after["requests"] - before["requests"],
+                       throttled=after["throttled"] - before["throttled"])
+    # Leave nothing behind that the retrieval benchmarks could see
+    with quiet():
+        chromadb_utils.clear_chroma_collection("bench_add")
+    return [result]
+
+def bench_ingest(corpus_dir, workdir):
+    import chromadb_utils
+    from indexer import prepare_and_index_documents
+    with quiet():
+        collection = chromadb_utils.get_chroma_collection("bench")
+    manifest_path = os.path.join(workdir, "chroma_db_data", "bench_manifest.json")
+    files = len(os.listdir(corpus_dir))
+    results = []
+    for name in ("ingest[cold]", "ingest[unchanged]"):
+        latencies, chunks = time_calls(prepare_and_index_documents, [(collection, corpus_dir, manifest_path)])
+        results.append(summarize(name, latencies, files, "files", chunks=chunks[0]))
+    return results, collection
+
+def bench_queries(collection, questions):
+    from chromadb_utils import query_chroma
+    results = []
+    for mode in ("vector", "hybrid", "auto"):
+        latencies, _ = time_calls(lambda q: query_chroma(collection, [q], 3, mode=mode), [(q,) for q in questions])
+        results.append(summarize(f"query_chroma[{mode}]", latencies, len(questions), "queries"))
+    return results
+
+def bench_question_path(collection, questions):
+    from openai_utils import get_openai_client, get_chat_completion, stream_chat_completion
+    from chromadb_utils import query_chroma
+    from context_packer import pack_context, CONTEXT_PACKING_ENABLED
+    from rag_prompts import build_rag_messages
+    with quiet():
+        client = get_openai_client()
+
+    def retrieve(question):
+        if CONTEXT_PACKING_ENABLED:
+            return pack_context(collection, question)[0]
+        return query_chroma(collection, [question], 3)
+
+    def ask_blocking(question):
+        return get_chat_completion(client, build_rag_messages(question, retrieve(question)))
+
+    ttfts = []
+    def ask_streaming(question):
+        stats = {}
+        answer = "".join(stream_chat_completion(client, build_rag_messages(question, retrieve(question)), stats=stats))
+        ttfts.append(stats["ttft"])
+        return answer
+
+    results = []
+    latencies, _ = time_calls(ask_blocking, [(q,) for q in questions])
+    results.append(summarize("question_path[blocking]", latencies, len(questions), "questions"))
+    latencies, _ = time_calls(ask_streaming, [(q,) for q in questions])
+    ttft = summarize("ttft", ttfts, len(ttfts), "questions")
+    results.append(summarize("question_path[stream]", latencies, len(questions), "questions",
+                             ttft_p50_ms=ttft["p50_ms"], ttft_p95_ms=ttft["p95_ms"]))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingest and query paths against a fake Azure OpenAI server.")
+    parser.add_argument("--sizes", default="small,medium", help=f"Comma-separated document sizes ({', '.join(CORPUS_SIZES)}).")
+    parser.add_argument("--formats", default=",".join(CORPUS_FORMATS), help="Comma-separated document formats.")
+    parser.add_argument("--queries", type=int, default=50, help="Questions per retrieval/question benchmark.")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions of the reader/chunker benchmarks.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Fake server latency per request (seconds).")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Fake server delay between streamed chunks.")
+    parser.add_argument("--throttle-every", type=int, default=0, help="Fake server answers every Nth request with 429.")
+    parser.add_argument("--max-concurrent", type=int, default=0, help="Fake server throttles beyond this many in-flight requests.")
+    parser.add_argument("--retry-after", type=int, default=0, help="Retry-After seconds sent with 429s.")
+    parser.add_argument("--embedding-cache", action="store_true", help="Keep the embedding cache enabled.")
+    parser.add_argument("--telemetry", action="store_true",
+                        help="Enable telemetry and add its per-stage metrics to the report (adds a little overhead).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="Scratch directory (default: a temporary directory, removed afterwards).")
+    parser.add_argument("--output", default="benchmark_report.json")
+    args = parser.parse_args()
+
+    sizes = [size for size in args.sizes.split(",") if size]
+    formats = [fmt for fmt in args.formats.split(",") if fmt]
+    workdir = args.workdir or tempfile.mkdtemp(prefix="rag-bench-")
+    server, state = run_fake_server(
+        latency=args.latency, token_latency=args.token_latency, throttle_every=args.throttle_every,
+        max_concurrent=args.max_concurrent, retry_after=args.retry_after
+    )
+    configure_environment(server, workdir, args.embedding_cache)
+
+    import telemetry
+    telemetry.configure(enabled=args.telemetry)
+
+    import chromadb_utils
+    # Keep the vector store and BM25 index of the benchmark out of the real data directory
+    chromadb_utils.CHROMA_DB_PERSIST_DIR = os.path.join(workdir, "chroma_db_data")
+    chromadb_utils.BM25_INDEX_DIR = os.path.join(workdir, "chroma_db_data", "bm25")
+    chromadb_utils.QUANTIZED_STORE_DIR = os.path.join(workdir, "chroma_db_data", "quantized")
+
+    try:
+        corpus_dir = os.path.join(workdir, "corpus")
+        print(f"Generating corpus ({', '.join(sizes)} x {', '.join(formats)}) in '{corpus_dir}'...")
+        documents = generate_corpus(corpus_dir, sizes, formats, seed=args.seed)
+        questions = sample_questions(generate_paragraphs(CORPUS_SIZES[sizes[0]], seed=args.seed + list(CORPUS_SIZES).index(sizes[0])),
+                                     args.queries, seed=args.seed)
+
+        results = []
+        print("Benchmarking readers and chunkers...")
+        results += bench_readers(documents, args.repeat)
+        results += bench_chunking(documents, args.repeat)
+        print("Benchmarking add_documents_to_chroma...")
+        results += bench_add_documents(state, sizes[-1])
+        print("Benchmarking ingest...")
+        ingest_results, collection = bench_ingest(corpus_dir, workdir)
+        results += ingest_results
+        print("Benchmarking retrieval...")
+        results += bench_queries(collection, questions)
+        print("Benchmarking the question path...")
+        results += bench_question_path(collection, questions)
+
+        config = dict(vars(args), fake_server=state.snapshot())
+        sections = {"telemetry": telemetry.registry.snapshot()} if args.telemetry else {}
+        write_report(args.output, results, config, **sections)
+        print()
+        print_results(results)
+        print(f"\nReport written to '{args.output}'.")
+    finally:
+        server.shutdown()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+# benchmarks/startup_profile.py
+"""
+Profiles the startup of the interactive CLI (main.py) and writes a JSON report.
+
+    python -m benchmarks.startup_profile --runs 5 --output startup_report.json
+
+Two measurements, each in fresh Python processes:
+  * the import-time breakdown of `import main` (python -X importtime), per top-level package;
+  * time to the first "Your Question:" prompt and to the first answer on an already indexed
+    corpus, with the CLI pointed at a local fake Azure OpenAI server.
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from collections import defaultdict
+
+from fake_azure_server import run_fake_server
+from benchmarks.corpus import generate_corpus, CORPUS_FORMATS
+from benchmarks.harness import summarize, write_report, print_results
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROMPT_MARKER = "Your Question:"
+# Printed by the CLI after every answer
+ANSWER_END_MARKER = "--------------"
+
+def cli_environment(server, workdir):
+    env = dict(os.environ,
+               AZURE_OPENAI_API_KEY="benchmark",
+               AZURE_OPENAI_ENDPOINT=f"http://127.0.0.1:{server.server_port}",
+               AZURE_OPENAI_API_VERSION="2024-06-01",
+               AZURE_OPENAI_DEPLOYMENT_NAME="bench-chat",
+               AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME="bench-embeddings",
+               EMBEDDING_CACHE_DIR=os.path.join(workdir, "embedding_cache"),
+               SEMANTIC_CACHE_ENABLED="false",
+               PYTHONUNBUFFERED="1")
+    env.setdefault("EMBEDDING_BACKEND", "azure")
+    return env
+
+def parse_importtime(stderr):
+    """Parses `python -X importtime` output into [(module, self_us, cumulative_us, depth)]."""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return modules
+
+def import_profile(env, module="main", top=15):
+    """Import-time breakdown of one module: total, per top-level package and the slowest direct imports."""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, cwd=REPO_DIR, env=env).stderr
+    modules = parse_importtime(stderr)
+    packages = defaultdict(int)
+    for name, self_us, _, _ in modules:
+        packages[name.split(".")[0]] += self_us
+    # Entries are listed after their own imports, so the imports of the profiled module
+    # are the entries one level deeper that directly precede it
+    position = next((i for i, entry in enumerate(modules) if entry[0] == module and entry[3] == 0), len(modules))
+    total_us = modules[position][2] if position < len(modules) else sum(packages.values())
+    direct = []
+    for name, _, cumulative, depth in reversed(modules[:position]):
+        if depth == 0:
+            break
+        if depth == 1:
+            direct.append((name, cumulative))
+    return {
+        "module": module,
+        "total_ms": total_us / 1000,
+        "packages_ms": {name: us / 1000 for name, us in sorted(packages.items(), key=lambda item: -item[1])[:top]},
+        "direct_imports_ms": {name: us / 1000 for name, us in sorted(direct, key=lambda item: -item[1])[:top]},
+        "loaded": sorted(packages),
+    }
+
+def read_until(process, marker, timeout):
+    """Reads the CLI output until marker appears; returns the output read."""
+    output = ""
+    deadline = time.monotonic() + timeout
+    while marker not in output:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"'{marker}' did not appear within {timeout}s:\n{output[-2000:]}")
+        char = process.stdout.read(1)
+        if not char:
+            raise RuntimeError(f"The CLI exited before printing '{marker}':\n{output[-2000:]}")
+        output += char
+    return output
+
+def run_cli(env, workdir, question=None, timeout=300):
+    """Starts main.py on the indexed corpus; returns (seconds to the prompt, seconds to the first answer)."""
+    start_time = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "main.py")], cwd=workdir, env=env,
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        read_until(process, PROMPT_MARKER, timeout)
+        prompt_seconds = time.perf_counter() - start_time
+        answer_seconds = None
+        if question:
+            process.stdin.write(question + "\n")
+            process.stdin.flush()
+            read_until(process, ANSWER_END_MARKER, timeout)
+            answer_seconds = time.perf_counter() - start_time
+        process.stdin.write("exit\n")
+        process.stdin.flush()
+        process.wait(timeout)
+        return prompt_seconds, answer_seconds
+    finally:
+        if process.poll() is None:
+            process.kill()
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile the CLI startup against a fake Azure OpenAI server.")
+    parser.add_argument("--runs", type=int, default=5, help="Warm CLI starts to time.")
+    parser.add_argument("--sizes", default="small", help="Comma-separated document sizes of the indexed corpus.")
+    parser.add_argument("--formats", default=",".join(CORPUS_FORMATS), help="Comma-separated document formats.")
+    parser.add_argument("--question", default="What does the policy say about training?")
+    parser.add_argument("--top", type=int, default=15, help="Packages and imports listed in the breakdown.")
+    parser.add_argument("--workdir", help="Scratch directory (default: a temporary directory, removed afterwards).")
+    parser.add_argument("--output", default="startup_report.json")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="rag-startup-")
+    os.makedirs(workdir, exist_ok=True)
+    server, _ = run_fake_server()
+    env = cli_environment(server, workdir)
+    try:
+        print("Profiling imports of main.py...")
+        profile = import_profile(env, top=args.top)
+
+        print("Indexing the corpus (first start)...")
+        generate_corpus(os.path.join(workdir, "my_local_documents"), [size for size in args.sizes.split(",") if size],
+                        [fmt for fmt in args.formats.split(",") if fmt])
+        cold_seconds, _ = run_cli(env, workdir)
+
+        print(f"Timing {args.runs} starts on the indexed corpus...")
+        prompt_latencies, answer_latencies = [], []
+        for _ in range(args.runs):
+            prompt_seconds, answer_seconds = run_cli(env, workdir, args.question)
+            prompt_latencies.append(prompt_seconds)
+            answer_latencies.append(answer_seconds)
+        results = [
+            summarize("cli_time_to_prompt[indexed]", prompt_latencies, len(prompt_latencies), "starts",
+                      cold_start_seconds=cold_seconds),
+            summarize("cli_time_to_first_answer[indexed]", answer_latencies, len(answer_latencies), "starts"),
+        ]
+
+        write_report(args.output, results, vars(args), import_profile=profile)
+        print(f"\nimport main: {profile['total_ms']:.0f} ms")
+        print("  by package:")
+        for name, ms in profile["packages_ms"].items():
+            print(f"    {name:<36} {ms:8.1f} ms")
+        print("  slowest direct imports (cumulative):")
+        for name, ms in profile["direct_imports_ms"].items():
+            print(f"    {name:<36} {ms:8.1f} ms")
+        print()
+        print_results(results)
+        print(f"\nReport written to '{args.output}'.")
+    finally:
+        server.shutdown()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+# benchmarks/vector_store_bench.py
+"""
+Compares ChromaDB with the quantized vector store on synthetic embeddings:
+
+    python -m benchmarks.vector_store_bench --rows 20000 --dim 1536 --queries 200 --output vector_store_report.json
+
+Every store is built and queried in its own process, so open time (cold start) and peak
+RSS are measured per store. Recall@k is measured against exact float32 search.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+from benchmarks.harness import summarize, peak_rss_mb, write_report, print_results
+
+# Store configurations: (kind, options); "int8" is the default configuration
+STORES = {
+    "chroma": ("chroma", {}),
+    "int8": ("quantized", {}),
+    "int8-exact": ("quantized", {"dtype": "int8", "search": "exact"}),
+    "int8-ivf": ("quantized", {"dtype": "int8", "search": "ivf"}),
+    "int8-float-rerank": ("quantized", {"dtype": "int8", "search": "exact", "keep_float": True}),
+    "float16-exact": ("quantized", {"dtype": "float16", "search": "exact"}),
+}
+BUILD_BATCH_SIZE = 1000
+
+def generate_vectors(rows, dim, num_queries, seed=0, num_clusters=100):
+    """Unit vectors around random cluster centres (like topical embeddings) and queries near stored vectors."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((num_clusters, dim)).astype(np.float32)
+    vectors = centres[rng.integers(0, num_clusters, rows)] + 0.6 * rng.standard_normal((rows, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    # Noise of norm ~0.3 around a stored (unit) vector
+    queries = vectors[rng.integers(0, rows, num_queries)] + (0.3 / np.sqrt(dim)) * rng.standard_normal((num_queries, dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return vectors, queries
+
+def exact_neighbours(vectors, queries, k, block_rows=8192):
+    """Indices of the k nearest vectors (squared L2, float32) of every query."""
+    best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+    best_distances = np.zeros((len(queries), 0), dtype=np.float32)
+    for start in range(0, len(vectors), block_rows):
+        block = vectors[start:start + block_rows]
+        distances = np.sum(block * block, axis=1)[None, :] - 2.0 * queries @ block.T
+        best_rows = np.concatenate([best_rows, np.broadcast_to(np.arange(start, start + len(block)), distances.shape)], axis=1)
+        best_distances = np.concatenate([best_distances, distances], axis=1)
+        order = np.argsort(best_distances, axis=1)[:, :k]
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        best_distances = np.take_along_axis(best_distances, order, axis=1)
+    return best_rows
+
+def open_store(name, workdir):
+    kind, options = STORES[name]
+    if kind == "chroma":
+        import chromadb
+        client = chromadb.PersistentClient(path=os.path.join(workdir, "chroma"))
+        return client.get_or_create_collection(name="bench")
+    import vector_store
+    if options.get("search") == "ivf":
+        # Train the IVF clusters whatever the benchmark size
+        vector_store.VECTOR_STORE_IVF_MIN_ROWS = min(vector_store.VECTOR_STORE_IVF_MIN_ROWS, 1000)
+    return vector_store.QuantizedVectorStore(name, os.path.join(workdir, "quantized"), **options)
+
+def directory_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, filename)) for root, _, filenames in os.walk(path) for filename in filenames)
+
+def build_worker(name, workdir):
+    vectors = np.load(os.path.join(workdir, "vectors.npy"), mmap_mode='r')
+    start_time = time.perf_counter()
+    store = open_store(name, workdir)
+    for start in range(0, len(vectors), BUILD_BATCH_SIZE):
+        end = min(start + BUILD_BATCH_SIZE, len(vectors))
+        store.upsert(ids=[f"chunk-{i}" for i in range(start, end)], embeddings=np.asarray(vectors[start:end]),
+                     documents=[f"Chunk number {i}." for i in range(start, end)])
+    path = os.path.join(workdir, "chroma" if STORES[name][0] == "chroma" else os.path.join("quantized", name))
+    return {"build_seconds": time.perf_counter() - start_time, "disk_mb": directory_bytes(path) / (1024 * 1024)}
+
+def query_worker(name, workdir, k):
+    queries = np.load(os.path.join(workdir, "queries.npy"))
+    truth = np.load(os.path.join(workdir, "truth.npy"))
+    rss_before = peak_rss_mb()
+    start_time = time.perf_counter()
+    store = open_store(name, workdir)
+    store.query(query_embeddings=queries[:1], n_results=k, include=["distances"])
+    open_seconds = time.perf_counter() - start_time
+    latencies, hits = [], 0
+    for query, expected in zip(queries, truth):
+        start_time = time.perf_counter()
+        found = store.query(query_embeddings=query[None, :], n_results=k, include=["distances"])["ids"][0]
+        latencies.append(time.perf_counter() - start_time)
+        hits += len({int(chunk_id.rsplit("-", 1)[1]) for chunk_id in found} & set(expected.tolist()))
+    return {"latencies": latencies, "recall": hits / truth.size, "open_seconds": open_seconds,
+            "peak_rss_mb": peak_rss_mb(), "rss_before_open_mb": rss_before}
+
+def run_worker(phase, name, workdir, k):
+    """Runs one phase for one store in a fresh Python process and returns its JSON result."""
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.vector_store_bench", "--worker", phase, "--store", name,
+         "--workdir", workdir, "--k", str(k)],
+        capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare ChromaDB with the quantized vector store.")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--stores", default=",".join(STORES), help=f"Comma-separated stores ({', '.join(STORES)}).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="Scratch directory (default: a temporary directory, removed afterwards).")
+    parser.add_argument("--output", default="vector_store_report.json")
+    parser.add_argument("--worker", choices=["build", "query"], help=argparse.SUPPRESS)
+    parser.add_argument("--store", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        result = build_worker(args.store, args.workdir) if args.worker == "build" else query_worker(args.store, args.workdir, args.k)
+        print(json.dumps(result))
+        return 0
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="rag-vector-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        print(f"Generating {args.rows} vectors of dimension {args.dim} and {args.queries} queries...")
+        vectors, queries = generate_vectors(args.rows, args.dim, args.queries, args.seed)
+        np.save(os.path.join(workdir, "vectors.npy"), vectors)
+        np.save(os.path.join(workdir, "queries.npy"), queries)
+        np.save(os.path.join(workdir, "truth.npy"), exact_neighbours(vectors, queries, args.k))
+        del vectors
+
+        results = []
+        for name in [store for store in args.stores.split(",") if store]:
+            print(f"Benchmarking {name}...")
+            build = run_worker("build", name, workdir, args.k)
+            query = run_worker("query", name, workdir, args.k)
+            result = summarize(f"vector_store[{name}]", query["latencies"], len(query["latencies"]), "queries",
+                               recall_at_k=query["recall"], open_ms=query["open_seconds"] * 1000,
+                               build_seconds=build["build_seconds"], disk_mb=build["disk_mb"],
+                               rss_before_open_mb=query["rss_before_open_mb"])
+            # Memory of the query process, not of this one
+            result["peak_rss_mb"] = query["peak_rss_mb"]
+            results.append(result)
+
+        write_report(args.output, results, vars(args))
+        print()
+        print_results(results)
+        for result in results:
+            print(f"{result['name']:<40} recall@{args.k} {result['recall_at_k']:.3f}  open {result['open_ms']:.0f} ms  "
+                  f"build {result['build_seconds']:.1f} s  disk {result['disk_mb']:.1f} MiB")
+        print(f"\nReport written to '{args.output}'.")
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+# benchmarks/watcher_bench.py
+"""
+Measures how quickly the document watcher makes new files searchable and how much a
+large drop of files slows down queries served at the same time:
+
+    python -m benchmarks.watcher_bench --files 200 --mode auto --output watcher_report.json
+
+A base corpus is indexed first. Then --files documents, each containing a unique marker
+word, are written into the watched directory in one burst while a thread keeps querying.
+A file counts as searchable once its marker is found by the BM25 index, which is updated
+in the same step as the vector store.
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+
+from fake_azure_server import run_fake_server
+from benchmarks.corpus import generate_corpus, generate_paragraphs, sample_questions, write_txt, CORPUS_SIZES
+from benchmarks.harness import summarize, quiet, write_report, print_results
+from benchmarks.run_benchmarks import configure_environment
+
+def query_loop(collection, questions, stop, latencies):
+    from chromadb_utils import query_chroma
+    i = 0
+    while not stop.is_set():
+        start_time = time.perf_counter()
+        query_chroma(collection, [questions[i % len(questions)]], 3)
+        latencies.append(time.perf_counter() - start_time)
+        i += 1
+
+def measure_queries(collection, questions, seconds):
+    """Query latencies of a background query loop over the given period."""
+    stop, latencies = threading.Event(), []
+    thread = threading.Thread(target=query_loop, args=(collection, questions, stop, latencies))
+    thread.start()
+    time.sleep(seconds)
+    stop.set()
+    thread.join()
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the document watcher against a fake Azure OpenAI server.")
+    parser.add_argument("--files", type=int, default=200, help="Documents dropped into the watched directory at once.")
+    parser.add_argument("--file-chars", type=int, default=CORPUS_SIZES["small"], help="Characters per dropped document.")
+    parser.add_argument("--mode", default="auto", choices=["auto", "poll"], help="Watcher mode (auto uses watchdog if installed).")
+    parser.add_argument("--debounce", type=float, default=0.5)
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--batch-files", type=int, default=16)
+    parser.add_argument("--idle-seconds", type=float, default=3.0, help="Query-only period measured before the drop.")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--workdir", help="Scratch directory (default: a temporary directory, removed afterwards).")
+    parser.add_argument("--output", default="watcher_report.json")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="rag-watch-bench-")
+    server, state = run_fake_server()
+    configure_environment(server, workdir, embedding_cache=False)
+
+    import chromadb_utils
+    chromadb_utils.CHROMA_DB_PERSIST_DIR = os.path.join(workdir, "chroma_db_data")
+    chromadb_utils.BM25_INDEX_DIR = os.path.join(workdir, "chroma_db_data", "bm25")
+    chromadb_utils.QUANTIZED_STORE_DIR = os.path.join(workdir, "chroma_db_data", "quantized")
+    from indexer import prepare_and_index_documents
+    from document_watcher import DocumentWatcher
+
+    docs_dir = os.path.join(workdir, "documents")
+    manifest_path = os.path.join(workdir, "chroma_db_data", "watch_manifest.json")
+    watcher = None
+    try:
+        print("Indexing the base corpus...")
+        generate_corpus(docs_dir, ["small", "medium"], ["txt"])
+        questions = sample_questions(generate_paragraphs(CORPUS_SIZES["small"]), 50)
+        with quiet():
+            collection = chromadb_utils.get_chroma_collection("watch_bench")
+            prepare_and_index_documents(collection, docs_dir, manifest_path)
+            watcher = DocumentWatcher(collection, docs_dir, manifest_path, mode=args.mode, debounce_seconds=args.debounce,
+                                      poll_interval=args.poll_interval, batch_files=args.batch_files)
+            watcher.start()
+            watcher.wait_idle(args.timeout)
+
+        print(f"Measuring queries for {args.idle_seconds:.0f}s without changes...")
+        with quiet():
+            idle_latencies = measure_queries(collection, questions, args.idle_seconds)
+
+        print(f"Dropping {args.files} documents into the watched directory...")
+        stop, drop_latencies = threading.Event(), []
+        query_thread = threading.Thread(target=query_loop, args=(collection, questions, stop, drop_latencies))
+        query_thread.start()
+        written = {}
+        with quiet():
+            for i in range(args.files):
+                marker = f"watchmarker{i:06d}"
+                paragraphs = generate_paragraphs(args.file_chars, seed=1000 + i)
+                write_txt(os.path.join(docs_dir, f"dropped_{i:06d}.txt"), [f"{marker} {paragraphs[0]}"] + paragraphs[1:])
+                written[marker] = time.time()
+            drop_end = time.time()
+
+            # Poll the lexical index for the markers until every dropped file is searchable
+            bm25 = chromadb_utils.get_bm25_index()
+            searchable, max_queue_depth = {}, 0
+            deadline = time.monotonic() + args.timeout
+            while len(searchable) < len(written) and time.monotonic() < deadline:
+                max_queue_depth = max(max_queue_depth, watcher.stats()["queue_depth"])
+                for marker, write_time in written.items():
+                    if marker not in searchable and bm25.search(marker, k=1):
+                        searchable[marker] = time.time() - write_time
+                time.sleep(0.05)
+            all_searchable = time.time() - drop_end
+            stop.set()
+            query_thread.join()
+
+        watcher_stats = watcher.stats()
+        results = [
+            summarize(f"watch_change_to_searchable[{watcher.mode}]", list(searchable.values()), len(searchable), "files",
+                      missing=len(written) - len(searchable), max_queue_depth=max_queue_depth,
+                      all_searchable_seconds=all_searchable, batches=watcher_stats["batches"]),
+            summarize("query_chroma[idle]", idle_latencies, len(idle_latencies), "queries"),
+            summarize("query_chroma[during_drop]", drop_latencies, len(drop_latencies), "queries"),
+        ]
+        write_report(args.output, results, dict(vars(args), fake_server=state.snapshot()), watcher=watcher_stats)
+        print()
+        print_results(results)
+        print(f"\n{len(searchable)}/{len(written)} files searchable, all of them {all_searchable:.1f}s after the drop "
+              f"(queue depth up to {max_queue_depth}, {watcher_stats['batches']} indexing runs).")
+        print(f"Report written to '{args.output}'.")
+    finally:
+        if watcher is not None:
+            watcher.stop()
+        server.shutdown()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
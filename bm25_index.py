@@ -0,0 +1,296 @@
+# bm25_index.py
+import os
+import re
+import json
+import math
+import threading
+from collections import Counter
+
+import numpy as np
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_INDEX_VERSION = 1
+
+# Lowercased alphanumeric tokens; "E-1042", "v2.3" and "max_tokens" are kept whole
+# (and additionally indexed by their parts) so IDs and error codes match exactly
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*")
+_PART_SPLIT_RE = re.compile(r"[-_.]")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have how i if in into is it its of on or "
+    "our that the their there these this to was were what when where which who why will with "
+    "you your do does did can could should would".split()
+)
+
+def tokenize(text):
+    """Splits text into BM25 terms."""
+    terms = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in _STOPWORDS:
+            continue
+        terms.append(token)
+        if not token.isalnum():
+            terms.extend(part for part in _PART_SPLIT_RE.split(token) if part and part not in _STOPWORDS)
+    return terms
+
+class BM25Index:
+    """
+    Inverted-index BM25 engine kept next to the vector store.
+    The compacted index lives on disk as flat NumPy arrays (postings doc numbers and term
+    frequencies, document lengths) that are memory-mapped on load, plus small JSON files
+    for the vocabulary and document IDs. Incremental adds go to an in-memory delta and
+    deletes are tombstones; save() merges both into a new compact index.
+    """
+    def __init__(self, index_dir, k1=BM25_K1, b=BM25_B):
+        self.index_dir = index_dir
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()
+        self._version = 0 # Incremented by every change, so save() can tell if one raced it
+        self._reset()
+        self.load()
+
+    def _reset(self):
+        self._ids = []
+        self._sources = []
+        self._id_to_doc = {}
+        self._lengths = np.zeros(0, dtype=np.uint32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._vocab = {} # term -> (offset, count) into the compacted postings
+        self._postings_docs = np.zeros(0, dtype=np.uint32)
+        self._postings_tfs = np.zeros(0, dtype=np.uint16)
+        self._delta = {} # term -> list of (doc, tf) added since the last compaction
+        self._new_lengths = []
+        self._dirty = False
+        self._version += 1
+
+    def _path(self, name):
+        return os.path.join(self.index_dir, name)
+
+    def load(self):
+        """Memory-maps the compacted index from disk; returns False if there is none."""
+        with self._lock:
+            self._reset()
+            if not os.path.exists(self._path("docs.json")):
+                return False
+            try:
+                with open(self._path("docs.json"), 'r', encoding='utf-8') as f:
+                    docs = json.load(f)
+                if docs.get("version") != BM25_INDEX_VERSION:
+                    return False
+                with open(self._path("vocab.json"), 'r', encoding='utf-8') as f:
+                    self._vocab = {term: tuple(span) for term, span in json.load(f).items()}
+                self._ids = docs["ids"]
+                self._sources = docs["sources"]
+                self._id_to_doc = {chunk_id: doc for doc, chunk_id in enumerate(self._ids)}
+                self._map_arrays()
+                return True
+            except Exception as e:
+                print(f"Error loading BM25 index from {self.index_dir}: {e}")
+                self._reset()
+                return False
+
+    def _map_arrays(self):
+        # Plain ndarray views of the memory maps: slicing np.memmap objects is several times slower
+        self._lengths = np.asarray(np.load(self._path("lengths.npy"), mmap_mode='r'))
+        self._alive = np.ones(len(self._ids), dtype=bool)
+        self._postings_docs = np.asarray(np.load(self._path("postings_docs.npy"), mmap_mode='r'))
+        self._postings_tfs = np.asarray(np.load(self._path("postings_tfs.npy"), mmap_mode='r'))
+
+    def __len__(self):
+        with self._lock:
+            return int(self._alive.sum())
+
+    def sources(self):
+        """The set of sources with at least one live document."""
+        with self._lock:
+            return {source for source, alive in zip(self._sources, self._alive) if alive}
+
+    def _delete_doc(self, doc):
+        if self._alive[doc]:
+            if not self._alive.flags.writeable:
+                self._alive = self._alive.copy()
+            self._alive[doc] = False
+            self._dirty = True
+            self._version += 1
+
+    def add_documents(self, ids, documents, sources):
+        """Adds (or replaces, for known IDs) documents in the index."""
+        with self._lock:
+            new_alive = []
+            for chunk_id, document, source in zip(ids, documents, sources):
+                if chunk_id in self._id_to_doc:
+                    self._delete_doc(self._id_to_doc[chunk_id])
+                doc = len(self._ids)
+                self._ids.append(chunk_id)
+                self._sources.append(source)
+                self._id_to_doc[chunk_id] = doc
+                terms = tokenize(document)
+                self._new_lengths.append(len(terms))
+                new_alive.append(True)
+                for term, tf in Counter(terms).items():
+                    self._delta.setdefault(term, []).append((doc, min(tf, 65535)))
+            if new_alive:
+                self._lengths = np.concatenate([self._lengths, np.asarray(self._new_lengths, dtype=np.uint32)])
+                self._new_lengths = []
+                self._alive = np.concatenate([self._alive, np.asarray(new_alive, dtype=bool)])
+                self._dirty = True
+                self._version += 1
+
+    def remove_source(self, source):
+        """Tombstones every document of a source."""
+        with self._lock:
+            for doc, doc_source in enumerate(self._sources):
+                if doc_source == source:
+                    self._delete_doc(doc)
+
+    def _postings(self, term, state=None):
+        """The (docs, tfs) postings of a term in the live index, or in a _snapshot() state."""
+        vocab, postings_docs, postings_tfs, delta = (
+            (self._vocab, self._postings_docs, self._postings_tfs, self._delta) if state is None else
+            (state["vocab"], state["postings_docs"], state["postings_tfs"], state["delta"]))
+        docs_parts, tfs_parts = [], []
+        span = vocab.get(term)
+        if span:
+            offset, count = span
+            docs_parts.append(postings_docs[offset:offset + count])
+            tfs_parts.append(postings_tfs[offset:offset + count])
+        delta = delta.get(term)
+        if delta:
+            docs_parts.append(np.fromiter((d for d, _ in delta), dtype=np.uint32, count=len(delta)))
+            tfs_parts.append(np.fromiter((tf for _, tf in delta), dtype=np.uint16, count=len(delta)))
+        if not docs_parts:
+            return None, None
+        if len(docs_parts) == 1:
+            return docs_parts[0], tfs_parts[0]
+        return np.concatenate(docs_parts), np.concatenate(tfs_parts)
+
+    def search(self, query, k=10):
+        """
+        Returns up to k (chunk_id, score, coverage) tuples, best first. coverage is the
+        fraction of distinct query terms that occur in the document.
+        """
+        with self._lock:
+            terms = list(dict.fromkeys(tokenize(query)))
+            num_docs = int(self._alive.sum())
+            if not terms or not num_docs:
+                return []
+            lengths = np.asarray(self._lengths, dtype=np.float32)
+            avg_length = float(lengths[self._alive].mean()) or 1.0
+            scores = np.zeros(len(self._ids), dtype=np.float32)
+            matched = np.zeros(len(self._ids), dtype=np.uint16)
+            for term in terms:
+                docs, tfs = self._postings(term)
+                if docs is None:
+                    continue
+                live = self._alive[docs]
+                docs = docs[live]
+                if not len(docs):
+                    continue
+                tfs = tfs[live].astype(np.float32)
+                idf = math.log(1.0 + (num_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                norm = self.k1 * (1.0 - self.b + self.b * lengths[docs] / avg_length)
+                # Each document appears at most once per term, so plain fancy-index += is safe
+                scores[docs] += idf * tfs * (self.k1 + 1.0) / (tfs + norm)
+                matched[docs] += 1
+            candidates = np.flatnonzero(scores)
+            if not len(candidates):
+                return []
+            if len(candidates) > k:
+                candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+            candidates = candidates[np.argsort(-scores[candidates])]
+            return [(self._ids[doc], float(scores[doc]), float(matched[doc]) / len(terms)) for doc in candidates]
+
+    def _snapshot(self):
+        """A copy of the index state that later changes do not affect (the compacted arrays are never modified)."""
+        return {
+            "version": self._version,
+            "vocab": self._vocab,
+            "postings_docs": self._postings_docs,
+            "postings_tfs": self._postings_tfs,
+            "delta": {term: list(postings) for term, postings in self._delta.items()},
+            "alive": self._alive.copy(),
+            "lengths": np.asarray(self._lengths, dtype=np.uint32),
+            "ids": list(self._ids),
+            "sources": list(self._sources),
+        }
+
+    def _write_compacted(self, state):
+        """Merges the delta and tombstones of a snapshot into new '.tmp' index files; returns the new vocabulary and documents."""
+        alive = state["alive"]
+        live_docs = np.flatnonzero(alive)
+        renumber = np.full(len(alive), -1, dtype=np.int64)
+        renumber[live_docs] = np.arange(len(live_docs))
+
+        # Flat (term number, doc, tf) postings of the compacted index followed by the delta; a
+        # stable sort by term number keeps each term's postings in their original order
+        terms = sorted(set(state["vocab"]) | set(state["delta"]))
+        term_numbers = {term: number for number, term in enumerate(terms)}
+        spans = sorted((offset, count, term_numbers[term]) for term, (offset, count) in state["vocab"].items())
+        base_terms = np.repeat(np.asarray([number for _, _, number in spans], dtype=np.int64),
+                               np.asarray([count for _, count, _ in spans], dtype=np.int64))
+        base_docs = np.concatenate([state["postings_docs"][offset:offset + count] for offset, count, _ in spans]) if spans else np.zeros(0, dtype=np.uint32)
+        base_tfs = np.concatenate([state["postings_tfs"][offset:offset + count] for offset, count, _ in spans]) if spans else np.zeros(0, dtype=np.uint16)
+        delta_terms = np.asarray([term_numbers[term] for term, postings in state["delta"].items() for _ in postings], dtype=np.int64)
+        delta_docs = np.asarray([doc for postings in state["delta"].values() for doc, _ in postings], dtype=np.uint32)
+        delta_tfs = np.asarray([tf for postings in state["delta"].values() for _, tf in postings], dtype=np.uint16)
+        term_column = np.concatenate([base_terms, delta_terms])
+        docs = np.concatenate([base_docs, delta_docs])
+        tfs = np.concatenate([base_tfs, delta_tfs])
+
+        live = alive[docs]
+        term_column, docs, tfs = term_column[live], docs[live], tfs[live]
+        order = np.argsort(term_column, kind='stable')
+        postings_docs = renumber[docs[order]].astype(np.uint32)
+        postings_tfs = tfs[order].astype(np.uint16)
+        counts = np.bincount(term_column, minlength=len(terms))
+        offsets = np.concatenate([[0], np.cumsum(counts)[:-1]]) if len(terms) else counts
+        vocab = {terms[number]: (int(offsets[number]), int(counts[number])) for number in np.flatnonzero(counts)}
+
+        os.makedirs(self.index_dir, exist_ok=True)
+        ids = [state["ids"][doc] for doc in live_docs]
+        sources = [state["sources"][doc] for doc in live_docs]
+        # Arrays first, docs.json last: it is what load() checks for
+        for name, array in (("postings_docs.npy", postings_docs), ("postings_tfs.npy", postings_tfs),
+                            ("lengths.npy", state["lengths"][live_docs])):
+            with open(self._path(name + ".tmp"), 'wb') as f:
+                np.save(f, array)
+        # json.dumps uses the C encoder; json.dump(obj, f) streams through the pure-Python one
+        with open(self._path("vocab.json.tmp"), 'w', encoding='utf-8') as f:
+            f.write(json.dumps(vocab))
+        with open(self._path("docs.json.tmp"), 'w', encoding='utf-8') as f:
+            f.write(json.dumps({"version": BM25_INDEX_VERSION, "ids": ids, "sources": sources}))
+        return vocab, ids, sources
+
+    def save(self):
+        """
+        Merges the delta and tombstones into a new compacted on-disk index, then remaps it.
+        The merge works on a snapshot without holding the lock, so searches continue
+        meanwhile; only if the index changed during the merge is it redone under the lock.
+        """
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                state = self._snapshot()
+            vocab, ids, sources = self._write_compacted(state)
+            with self._lock:
+                if self._version != state["version"]:
+                    vocab, ids, sources = self._write_compacted(self._snapshot())
+                # Release the old memory maps before replacing the files they point to
+                self._postings_docs = self._postings_tfs = self._lengths = None
+                for name in ("postings_docs.npy", "postings_tfs.npy", "lengths.npy", "vocab.json", "docs.json"):
+                    os.replace(self._path(name + ".tmp"), self._path(name))
+                self._reset()
+                self._vocab, self._ids, self._sources = vocab, ids, sources
+                self._id_to_doc = {chunk_id: doc for doc, chunk_id in enumerate(ids)}
+                self._map_arrays()
+
+    def rebuild(self, ids, documents, sources):
+        """Replaces the whole index with the given documents and saves it."""
+        with self._lock:
+            self._reset()
+            self.add_documents(ids, documents, sources)
+            self._dirty = True
+        self.save()
@@ -1,64 +1,166 @@
 import os
-import chromadb
-from chromadb.utils import embedding_functions
-import os
+import re
+import shutil
+import numpy as np
 from dotenv import load_dotenv
-from openai import AzureOpenAI # Import for the custom embedding function
+from embedding_cache import cached_embed
+from embedding_backends import create_embedding_backend
+from ingestion_engine import ingest_documents
+from bm25_index import BM25Index
+from reranker import rerank_batch, RERANK_ENABLED, RERANK_CANDIDATES
+from vector_store import QuantizedVectorStore, VECTOR_STORE, VECTOR_STORE_DTYPE
+from token_utils import count_tokens_batch
+import telemetry
 load_dotenv()
 # Define the directory where ChromaDB will store its data
 CHROMA_DB_PERSIST_DIR = "./chroma_db_data"
 
-AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
-AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
-AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION")
-AZURE_OPENAI_DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME") # This is your deployment name
-AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME")
+# The lexical (BM25) index is kept next to the ChromaDB data so that wiping one always wipes the other
+BM25_INDEX_DIR = os.path.join(CHROMA_DB_PERSIST_DIR, "bm25")
+# With VECTOR_STORE=quantized, the vectors live here instead of in ChromaDB
+QUANTIZED_STORE_DIR = os.path.join(CHROMA_DB_PERSIST_DIR, "quantized")
 
+# "vector": embeddings only; "hybrid": BM25 and vector results fused with Reciprocal Rank Fusion;
+# "auto": like hybrid, but confident lexical matches (IDs, error codes, exact phrases) are
+# answered from BM25 alone without embedding the query
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "auto").lower()
+RRF_K = 60
+# Each retriever contributes this many candidates to the fusion
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+# The lexical fast path is taken only when the best BM25 hit contains every query term
+# and outscores the runner-up by this factor
+LEXICAL_FAST_PATH_MIN_RATIO = float(os.getenv("LEXICAL_FAST_PATH_MIN_RATIO", "2.0"))
 
-class AzureOpenAIEmbeddingFunction(embedding_functions.EmbeddingFunction):
-    """Custom EmbeddingFunction for ChromaDB using Azure OpenAI."""
-    def __init__(self, api_key, azure_endpoint, api_version, deployment_name):
-        self.client = AzureOpenAI(
-            api_key=api_key,
-            azure_endpoint=azure_endpoint,
-            api_version=api_version
-        )
-        self.deployment_name = deployment_name
-
-    def __call__(self, texts):
-        # The texts argument is expected to be a list of strings
-        # Azure OpenAI embedding API expects a list of strings
-        response = self.client.embeddings.create(
-            input=texts,
-            model=self.deployment_name
-        )
-        # Extract the embedding vectors from the response
-        return [data.embedding for data in response.data]
+class BackendEmbeddingFunction:
+    """
+    Embedding function on top of an embedding backend (see embedding_backends.py). It follows
+    ChromaDB's EmbeddingFunction interface; _chroma_embedding_function adapts it to the
+    protocol class when a ChromaDB collection is opened, so that chromadb is only imported then.
+    """
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __call__(self, input):
+        # The input argument is expected to be a list of strings
+        # Texts already embedded in this vector space are served from the embedding cache
+        with telemetry.span("embed", texts=len(input), backend=self.backend.name):
+            if self.backend.cache_namespace is None:
+                return list(self._embed_uncached(list(input)))
+            return cached_embed(self.backend.cache_namespace, list(input), self._embed_uncached)
+
+    def _embed_uncached(self, texts):
+        telemetry.observe("rag_embedding_batch_size", len(texts), buckets=telemetry.SIZE_BUCKETS)
+        if telemetry.is_enabled():
+            telemetry.incr("rag_embedding_tokens_total", sum(count_tokens_batch(texts)))
+        return self.backend.embed(texts)
+
+    def without_client_retries(self):
+        """This embedding function with the backend client's own retries disabled (see EmbeddingBackend)."""
+        backend = self.backend.without_client_retries()
+        return self if backend is self.backend else BackendEmbeddingFunction(backend)
+
+    def dimension(self):
+        """The embedding dimension; backends that don't know it up front embed a probe text once."""
+        if self.backend.dimension is None:
+            self.backend.dimension = len(self(["dimension probe"])[0])
+        return self.backend.dimension
+
+_embedding_function = None
+_bm25_index = None
+
+# Incremented whenever this process changes the indexed documents; caches built on top of
+# retrieval results (e.g. the semantic answer cache) use it to invalidate themselves
+_index_generation = 0
+
+def get_index_generation():
+    """Returns a counter that changes every time documents are added, deleted or updated."""
+    return _index_generation
+
+def _bump_index_generation():
+    global _index_generation
+    _index_generation += 1
+
+def get_embedding_function():
+    """Returns the shared embedding function of the configured EMBEDDING_BACKEND, or None if it is not configured."""
+    global _embedding_function
+    if _embedding_function is None:
+        backend = create_embedding_backend()
+        if backend is None:
+            return None
+        _embedding_function = BackendEmbeddingFunction(backend)
+    return _embedding_function
+
+def embed_query(text):
+    """Embeds a single query with the configured backend; returns None on failure."""
+    embedding_function = get_embedding_function()
+    if embedding_function is None:
+        return None
+    try:
+        return embedding_function([text])[0]
+    except Exception as e:
+        print(f"Error generating embedding: {e}")
+        return None
+
+def get_collection_name(base_name, embedding_function):
+    """
+    Names the collection after its vector space, e.g. 'rag_documents__azure-embeddings_1536',
+    so that a collection is never queried or extended with vectors of another backend or dimension.
+    """
+    space = f"{embedding_function.backend.name}_{embedding_function.dimension()}"
+    name = re.sub(r"[^a-zA-Z0-9._-]", "-", f"{base_name}__{space}")[:512]
+    return name.strip("._-")
+
+def get_bm25_index():
+    """Returns the shared BM25 index, memory-mapped from BM25_INDEX_DIR on first use."""
+    global _bm25_index
+    if _bm25_index is None:
+        _bm25_index = BM25Index(BM25_INDEX_DIR)
+    return _bm25_index
+
+def _chroma_embedding_function(embedding_function):
+    """Wraps an embedding function in ChromaDB's EmbeddingFunction protocol class."""
+    from chromadb.utils import embedding_functions
+
+    class ChromaEmbeddingFunction(embedding_functions.EmbeddingFunction):
+        def __call__(self, input):
+            return embedding_function(input)
+
+    return ChromaEmbeddingFunction()
+
+def get_quantized_store_name(collection_name, embedding_function):
+    """The quantized store of a collection is named after its vector space and storage type."""
+    return f"{get_collection_name(collection_name, embedding_function)}__{VECTOR_STORE_DTYPE}"
 
 def get_chroma_collection(collection_name="rag_documents"):
     """
-    Initializes and returns a ChromaDB client and collection.
+    Initializes and returns a ChromaDB client and collection, or with VECTOR_STORE=quantized
+    a QuantizedVectorStore, which offers the same collection interface.
     """
     try:
-        # Initialize ChromaDB client (persistent to save data to disk)
-        client = chromadb.PersistentClient(path=CHROMA_DB_PERSIST_DIR)
+        # Initialize the configured embedding backend for ChromaDB
+        embedding_function = get_embedding_function()
+        if embedding_function is None:
+            return None
 
-        # Initialize Azure OpenAI Embedding Function for ChromaDB
-        if not all([AZURE_OPENAI_API_KEY, AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_API_VERSION, AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME]):
-            print("Error: Missing Azure OpenAI embedding environment variables. Cannot create embedding function.")
+        if VECTOR_STORE == "quantized":
+            store_name = get_quantized_store_name(collection_name, embedding_function)
+            collection = QuantizedVectorStore(store_name, QUANTIZED_STORE_DIR, embedding_function)
+            print(f"Quantized vector store '{store_name}' initialized. Data stored in {QUANTIZED_STORE_DIR}")
+            return collection
+        if VECTOR_STORE != "chroma":
+            print(f"Error: Unknown VECTOR_STORE '{VECTOR_STORE}'. Choose 'chroma' or 'quantized'.")
             return None
 
-        embedding_function = AzureOpenAIEmbeddingFunction(
-            api_key=AZURE_OPENAI_API_KEY,
-            azure_endpoint=AZURE_OPENAI_ENDPOINT,
-            api_version=AZURE_OPENAI_API_VERSION,
-            deployment_name=AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME
-        )
+        # Initialize ChromaDB client (persistent to save data to disk); chromadb is slow to
+        # import, so it is only loaded when this store is used
+        import chromadb
+        client = chromadb.PersistentClient(path=CHROMA_DB_PERSIST_DIR)
 
-        # Get or create the collection
+        # Get or create the collection of this embedding space
+        collection_name = get_collection_name(collection_name, embedding_function)
         collection = client.get_or_create_collection(
             name=collection_name,
-            embedding_function=embedding_function # Pass the custom embedding function here
+            embedding_function=_chroma_embedding_function(embedding_function) # Pass the custom embedding function here
         )
         print(f"ChromaDB collection '{collection_name}' initialized. Data stored in {CHROMA_DB_PERSIST_DIR}")
         return collection
@@ -67,45 +169,249 @@ def get_chroma_collection(collection_name="rag_documents"):
         return None
 
 def add_documents_to_chroma(collection, documents, metadatas=None, ids=None):
-    """Adds documents (chunks) to the ChromaDB collection."""
+    """
+    Adds documents (chunks) to the ChromaDB collection.
+    Chunks are embedded in token-budgeted batches on a worker pool with retry/backoff, and
+    each batch is upserted as soon as it is embedded. Returns True only if every batch succeeded.
+    """
     if not collection:
         return False
+    embedding_function = get_embedding_function()
+    if embedding_function is None:
+        return False
     try:
         # ChromaDB expects lists of texts, metadatas, and ids
-        # Embeddings are generated automatically by the embedding_function passed during collection creation
-        collection.add(
-            documents=documents,
-            metadatas=metadatas if metadatas else [{}] * len(documents),
-            ids=ids if ids else [f"doc_{i}" for i in range(len(documents))]
-        )
-        print(f"Added {len(documents)} documents to the ChromaDB collection.")
-        return True
+        metadatas = metadatas if metadatas else [{}] * len(documents)
+        ids = ids if ids else [f"doc_{i}" for i in range(len(documents))]
+        # Upsert keeps re-runs idempotent when the same deterministic IDs are indexed again
+        summary = ingest_documents(collection, embedding_function, documents, metadatas, ids)
+        if summary["documents_added"]:
+            _bump_index_generation()
+        if summary["failed_batches"] == 0:
+            # A partially failed file is re-indexed on the next run, so only complete files reach BM25
+            get_bm25_index().add_documents(ids, documents, [metadata.get("source") for metadata in metadatas])
+        print(f"Added {summary['documents_added']} of {len(documents)} documents to the ChromaDB collection "
+              f"({summary['batches']} batches, {summary['retries']} retries).")
+        return summary["failed_batches"] == 0
     except Exception as e:
         print(f"Error adding documents to ChromaDB: {e}")
         return False
 
-def query_chroma(collection, query_texts, n_results=5):
-    """Queries the ChromaDB collection for relevant documents."""
+def delete_documents_from_chroma(collection, source):
+    """Deletes all chunks that were indexed from the given source file."""
     if not collection:
-        return []
+        return False
     try:
-        results = collection.query(
-            query_texts=query_texts,
-            n_results=n_results
-        )
-        # results['documents'] is a list of lists. We want the first (and usually only) inner list.
-        retrieved_docs = results['documents'][0] if results and results['documents'] else []
-        print(f"Queried ChromaDB for '{query_texts[0]}' and found {len(retrieved_docs)} results.")
-        return retrieved_docs
+        collection.delete(where={"source": source})
+        get_bm25_index().remove_source(source)
+        _bump_index_generation()
+        print(f"Deleted chunks of '{source}' from the ChromaDB collection.")
+        return True
+    except Exception as e:
+        print(f"Error deleting documents of '{source}' from ChromaDB: {e}")
+        return False
+
+def update_chunk_sources(collection, sources_by_id):
+    """
+    Records in the 'sources' metadata of each chunk every source file whose content it
+    represents (near-duplicates from other files are merged into one chunk at ingest time).
+    """
+    if not collection:
+        return False
+    if not sources_by_id:
+        return True
+    try:
+        existing = collection.get(ids=list(sources_by_id), include=["metadatas"])
+        ids, metadatas = [], []
+        for chunk_id, metadata in zip(existing["ids"], existing["metadatas"]):
+            ids.append(chunk_id)
+            metadatas.append(dict(metadata or {}, sources="; ".join(sources_by_id[chunk_id])))
+        if ids:
+            collection.update(ids=ids, metadatas=metadatas)
+            _bump_index_generation()
+        return True
+    except Exception as e:
+        print(f"Error updating chunk sources in ChromaDB: {e}")
+        return False
+
+def rebuild_bm25_index(collection, page_size=5000):
+    """Rebuilds the BM25 index from the documents stored in ChromaDB (no embedding calls)."""
+    ids, documents, sources = [], [], []
+    offset = 0
+    while True:
+        page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        ids.extend(page["ids"])
+        documents.extend(page["documents"])
+        sources.extend((metadata or {}).get("source") for metadata in page["metadatas"])
+        offset += len(page["ids"])
+    get_bm25_index().rebuild(ids, documents, sources)
+    print(f"Rebuilt the BM25 index from {len(ids)} ChromaDB documents.")
+
+def _fetch_chunks(collection, ids, where=None, include_embeddings=False):
+    """Returns {id: (document, metadata, embedding)} for the given chunk IDs that exist (and match where)."""
+    if not ids:
+        return {}
+    include = ["documents", "metadatas"] + (["embeddings"] if include_embeddings else [])
+    found = collection.get(ids=list(ids), where=where, include=include)
+    embeddings = found["embeddings"] if include_embeddings else [None] * len(found["ids"])
+    return {chunk_id: (document, metadata, embedding)
+            for chunk_id, document, metadata, embedding in zip(found["ids"], found["documents"], found["metadatas"], embeddings)}
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Fuses ranked ID lists: each ID scores sum(1 / (k + rank)) over the lists it appears in."""
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+def is_confident_lexical_match(lexical_hits):
+    """True when the top BM25 hit contains every query term and clearly beats the runner-up."""
+    if not lexical_hits or lexical_hits[0][2] < 1.0:
+        return False
+    runner_up = lexical_hits[1][1] if len(lexical_hits) > 1 else 0.0
+    return lexical_hits[0][1] >= LEXICAL_FAST_PATH_MIN_RATIO * runner_up
+
+@telemetry.traced("retrieve")
+def query_chroma_batch(collection, query_texts, n_results=5, where=None, max_distance=None, mode=None,
+                       include_embeddings=False, rerank=None):
+    """
+    Retrieves chunks for a batch of queries with one embedding call and one ChromaDB query.
+    Returns one dict per query with parallel "ids", "documents", "metadatas" and
+    "distances" lists, best first, plus "retrieval": "vector", "hybrid" or "lexical".
+    where is a ChromaDB metadata filter, e.g. {"source": "policy.pdf"}; results farther
+    than max_distance from the query are dropped. mode is as for query_chroma; chunks
+    found only by BM25 have no distance (None) and are not subject to max_distance.
+    With include_embeddings=True, each dict also has the stored "embeddings" of its chunks.
+    "query_embedding" is the query's embedding, or None if the lexical fast path answered it
+    without one.
+    With rerank (default RERANK_ENABLED), RERANK_CANDIDATES chunks are retrieved and the
+    best n_results by re-ranker score are returned (see reranker.rerank_batch), with
+    "rerank" and, unless the latency budget ran out, "relevance" added to each dict.
+    """
+    mode = (mode or RETRIEVAL_MODE).lower()
+    rerank = RERANK_ENABLED if rerank is None else rerank
+    final_results = n_results
+    if rerank:
+        n_results = max(n_results, RERANK_CANDIDATES)
+    candidates = max(n_results, HYBRID_CANDIDATES)
+    with telemetry.span("bm25_search", queries=len(query_texts)):
+        lexical_hits = [get_bm25_index().search(text, k=candidates) if mode in ("hybrid", "auto") else []
+                        for text in query_texts]
+    # BM25 knows nothing about metadata, so filtered queries always consult the vector index
+    lexical_only = [mode == "auto" and where is None and is_confident_lexical_match(hits) for hits in lexical_hits]
+
+    # Only queries not answered by the lexical fast path are embedded, all in one call
+    vector_positions = [i for i, lexical in enumerate(lexical_only) if not lexical]
+    vector_results = {}
+    if vector_positions:
+        query_embeddings = get_embedding_function()([query_texts[i] for i in vector_positions])
+        with telemetry.span("chroma_query", queries=len(vector_positions)):
+            results = collection.query(
+                query_embeddings=query_embeddings,
+                n_results=candidates if mode != "vector" else n_results,
+                where=where,
+                include=["documents", "metadatas", "distances"] + (["embeddings"] if include_embeddings else [])
+            )
+        for row, position in enumerate(vector_positions):
+            embeddings = results["embeddings"][row] if include_embeddings else [None] * len(results["ids"][row])
+            vector_results[position] = [
+                (chunk_id, document, metadata, distance, embedding)
+                for chunk_id, document, metadata, distance, embedding in zip(
+                    results["ids"][row], results["documents"][row], results["metadatas"][row],
+                    results["distances"][row], embeddings)
+                if max_distance is None or distance <= max_distance
+            ]
+
+    # Rank each query's candidates, then fetch every chunk found only by BM25 in one call
+    rankings = []
+    for position, hits in enumerate(lexical_hits):
+        lexical_ids = [hit[0] for hit in hits]
+        if lexical_only[position]:
+            rankings.append(lexical_ids[:n_results])
+        elif hits:
+            vector_ids = [result[0] for result in vector_results[position]]
+            rankings.append(reciprocal_rank_fusion([vector_ids, lexical_ids])[:n_results])
+        else:
+            rankings.append([result[0] for result in vector_results[position]][:n_results])
+    # Distances are per query, so each query keeps its own lookup of vector results
+    vector_by_id = {position: {result[0]: result[1:] for result in results} for position, results in vector_results.items()}
+    missing = {chunk_id for position, ranking in enumerate(rankings) for chunk_id in ranking
+               if chunk_id not in vector_by_id.get(position, {})}
+    with telemetry.span("chroma_get", ids=len(missing)):
+        fetched = {chunk_id: (document, metadata, None, embedding) for chunk_id, (document, metadata, embedding)
+                   in _fetch_chunks(collection, sorted(missing), where, include_embeddings).items()}
+
+    batch = []
+    for position, ranking in enumerate(rankings):
+        own = vector_by_id.get(position, {})
+        rows = [(chunk_id, own.get(chunk_id) or fetched.get(chunk_id)) for chunk_id in ranking]
+        rows = [(chunk_id, row) for chunk_id, row in rows if row is not None]
+        result = {
+            "ids": [chunk_id for chunk_id, _ in rows],
+            "documents": [row[0] for _, row in rows],
+            "metadatas": [row[1] for _, row in rows],
+            "distances": [row[2] for _, row in rows],
+            "retrieval": "lexical" if lexical_only[position] else "hybrid" if lexical_hits[position] else "vector",
+        }
+        if include_embeddings:
+            result["embeddings"] = [row[3] for _, row in rows]
+        # An array rather than a list, so that re-ranking doesn't take it for a per-chunk list
+        result["query_embedding"] = (np.asarray(query_embeddings[vector_positions.index(position)], dtype=np.float32)
+                                     if not lexical_only[position] else None)
+        telemetry.incr("rag_retrievals_total", retrieval=result["retrieval"])
+        batch.append(result)
+    if rerank:
+        batch = rerank_batch(query_texts, batch, final_results)
+    return batch
+
+def query_chroma(collection, query_texts, n_results=5, include_ids=False, mode=None, where=None, max_distance=None,
+                 include_query_embedding=False):
+    """
+    Queries the ChromaDB collection for documents relevant to the first query text.
+    mode (default RETRIEVAL_MODE) selects plain vector search, hybrid BM25 + vector search
+    fused with Reciprocal Rank Fusion, or "auto", which additionally serves confident
+    lexical matches from BM25 alone, without an embedding call.
+    where and max_distance filter the results as in query_chroma_batch, which should be
+    used to retrieve for many queries at once.
+    With include_ids=True, returns (documents, ids) instead of just the documents; with
+    include_query_embedding=True, (documents, ids, query embedding or None).
+    """
+    def failed():
+        return ([], [], None) if include_query_embedding else ([], []) if include_ids else []
+
+    if not collection:
+        return failed()
+    try:
+        result = query_chroma_batch(collection, query_texts[:1], n_results, where, max_distance, mode)[0]
+        retrieved_docs, retrieved_ids = result["documents"], result["ids"]
+        if result["retrieval"] == "lexical":
+            print(f"Queried BM25 for '{query_texts[0]}' and found {len(retrieved_docs)} confident lexical results.")
+        else:
+            print(f"Queried ChromaDB for '{query_texts[0]}' and found {len(retrieved_docs)} results.")
+        if include_query_embedding:
+            return retrieved_docs, retrieved_ids, result["query_embedding"]
+        return (retrieved_docs, retrieved_ids) if include_ids else retrieved_docs
     except Exception as e:
         print(f"Error querying ChromaDB: {e}")
-        return []
+        return failed()
 
 def clear_chroma_collection(collection_name="rag_documents"):
     """Deletes and recreates the ChromaDB collection to clear its contents."""
     try:
-        client = chromadb.PersistentClient(path=CHROMA_DB_PERSIST_DIR)
-        client.delete_collection(name=collection_name)
+        embedding_function = get_embedding_function()
+        if VECTOR_STORE == "quantized" and embedding_function is not None:
+            collection_name = get_quantized_store_name(collection_name, embedding_function)
+            shutil.rmtree(os.path.join(QUANTIZED_STORE_DIR, collection_name), ignore_errors=True)
+        else:
+            import chromadb
+            client = chromadb.PersistentClient(path=CHROMA_DB_PERSIST_DIR)
+            if embedding_function is not None:
+                collection_name = get_collection_name(collection_name, embedding_function)
+            client.delete_collection(name=collection_name)
+        get_bm25_index().rebuild([], [], [])
         print(f"ChromaDB collection '{collection_name}' cleared.")
         return True
     except Exception as e:
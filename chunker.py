@@ -0,0 +1,247 @@
+# chunker.py
+import os
+import re
+
+from dotenv import load_dotenv
+
+from document_processor import chunk_text_stream
+from token_utils import count_tokens_batch, APPROX_CHARS_PER_TOKEN
+
+load_dotenv()
+
+# Which chunker prepare_and_index_documents uses ("tokens" or "characters") and its sizes
+CHUNKER = os.getenv("CHUNKER", "tokens")
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "300"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "40"))
+
+# Text without a paragraph break is force-split once the pending buffer grows this large,
+# which keeps scanning linear for inputs that are one giant paragraph
+MAX_PENDING_CHARS = 200_000
+# Every new segment is searched for paragraph breaks together with this many characters of
+# the text before it, so that a break split across two segments is still found
+SCAN_BACKUP_CHARS = 256
+
+# Boundary regexes are compiled once and reused for the whole corpus
+_PARAGRAPH_BREAK_RE = re.compile(r"\n[ \t]*\n\s*")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])[\"')\]]*\s+")
+_HEADING_RE = re.compile(
+    r"^(?:#{1,6}\s+\S.*"                       # Markdown heading
+    r"|(?:\d+\.)+\d*\s+[A-Z].{0,100}"          # Numbered heading: "2.1 Scope"
+    r"|[A-Z][A-Z0-9 \t\-:,&/()]{2,100})$"      # ALL CAPS heading
+)
+
+def _is_heading(block):
+    """A block whose first line looks like a heading starts a new section."""
+    first_line = block.lstrip().split("\n", 1)[0].strip()
+    return bool(first_line) and bool(_HEADING_RE.match(first_line))
+
+class _Unit:
+    """A contiguous span of the document (a paragraph, sentence or word window)."""
+    __slots__ = ("start", "text", "tokens", "is_heading")
+
+    def __init__(self, start, text, tokens, is_heading=False):
+        self.start = start
+        self.text = text
+        self.tokens = tokens
+        self.is_heading = is_heading
+
+class TokenChunker:
+    """
+    Splits text into chunks of at most max_tokens tokens, preferring heading, paragraph and
+    sentence boundaries over raw offsets. Consumes (page, text) segments as a stream,
+    never lets a chunk span two pages, and yields (chunk_text, metadata) with the page
+    number, character offsets and token count of every chunk. Consecutive chunks share
+    up to overlap_tokens tokens of trailing sentences/paragraphs.
+    """
+    def __init__(self, max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+        if overlap_tokens >= max_tokens:
+            raise ValueError("overlap_tokens must be smaller than max_tokens")
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+
+    def __call__(self, segments):
+        return self.chunk(segments)
+
+    def chunk(self, segments):
+        units = []
+        pending = [] # Segments not yet split into units; joined only when they are
+        pending_chars = 0
+        tail = "" # End of the pending text, already searched for paragraph breaks
+        offset = 0 # Character offset of the start of the pending text within the whole document
+        current_page = None
+        for page, text in segments:
+            if page != current_page:
+                buffer = "".join(pending)
+                units.extend(self._split(buffer, offset))
+                offset += len(buffer)
+                pending, pending_chars, tail = [], 0, ""
+                yield from self._pack(units, current_page, final=True)
+                units = []
+                current_page = page
+            if not text:
+                continue
+            # Only the new text (and the tail before it) is searched, so scanning stays linear
+            window = tail + text
+            cut = self._find_cut(window)
+            if cut:
+                cut += pending_chars - len(tail)
+            pending.append(text)
+            pending_chars += len(text)
+            tail = window[-SCAN_BACKUP_CHARS:]
+            if not cut and pending_chars > MAX_PENDING_CHARS:
+                cut = self._force_cut("".join(pending))
+            if cut:
+                buffer = "".join(pending)
+                units.extend(self._split(buffer[:cut], offset))
+                offset += cut
+                rest = buffer[cut:]
+                pending, pending_chars, tail = ([rest] if rest else []), len(rest), rest[-SCAN_BACKUP_CHARS:]
+                # Keep the units of the chunk still being filled; emit the completed ones
+                units = yield from self._pack(units, current_page)
+        units.extend(self._split("".join(pending), offset))
+        yield from self._pack(units, current_page, final=True)
+
+    def _find_cut(self, text):
+        """Returns the offset up to which text holds complete paragraphs (0 if none)."""
+        cut = 0
+        for match in _PARAGRAPH_BREAK_RE.finditer(text):
+            cut = match.end()
+        return cut
+
+    def _force_cut(self, buffer):
+        """Cut for a buffer without paragraph breaks: its last sentence end, else its last space."""
+        cut = 0
+        for match in _SENTENCE_END_RE.finditer(buffer):
+            cut = match.end()
+        return cut or buffer.rfind(" ") + 1 or len(buffer)
+
+    def _split(self, text, offset):
+        """Splits complete text into units that each fit into max_tokens."""
+        if not text:
+            return []
+        blocks = []
+        start = 0
+        for match in _PARAGRAPH_BREAK_RE.finditer(text):
+            blocks.append((start, text[start:match.end()]))
+            start = match.end()
+        if start < len(text):
+            blocks.append((start, text[start:]))
+
+        units = []
+        for (start, block), tokens in zip(blocks, count_tokens_batch([block for _, block in blocks])):
+            if tokens <= self.max_tokens:
+                units.append(_Unit(offset + start, block, tokens, _is_heading(block)))
+            else:
+                units.extend(self._split_sentences(block, offset + start))
+        return units
+
+    def _split_sentences(self, block, offset):
+        sentences = []
+        start = 0
+        for match in _SENTENCE_END_RE.finditer(block):
+            sentences.append((start, block[start:match.end()]))
+            start = match.end()
+        if start < len(block):
+            sentences.append((start, block[start:]))
+
+        units = []
+        for (start, sentence), tokens in zip(sentences, count_tokens_batch([s for _, s in sentences])):
+            if tokens <= self.max_tokens:
+                units.append(_Unit(offset + start, sentence, tokens))
+            else:
+                units.extend(self._split_words(sentence, offset + start))
+        return units
+
+    def _split_words(self, text, offset):
+        """Last resort for sentences longer than max_tokens: windows cut at whitespace."""
+        units = []
+        window = self.max_tokens * APPROX_CHARS_PER_TOKEN
+        start = 0
+        while start < len(text):
+            end = min(start + window, len(text))
+            if end < len(text):
+                space = text.rfind(" ", start + 1, end)
+                if space > start:
+                    end = space + 1
+            piece = text[start:end]
+            tokens = count_tokens_batch([piece])[0]
+            if tokens > self.max_tokens and end - start > 1:
+                # Dense text (code, non-Latin scripts): shrink the window and retry
+                window = max(1, int(window * self.max_tokens / tokens * 0.9))
+                continue
+            units.append(_Unit(offset + start, piece, tokens))
+            start = end
+        return units
+
+    def _pack(self, units, page, final=False):
+        """
+        Greedily packs units into chunks. Yields every completed chunk and returns the
+        units of the chunk still being filled (all units are emitted when final is True).
+        """
+        current = []
+        current_tokens = 0
+        for unit in units:
+            if not current and not unit.text.strip():
+                continue # Don't start a chunk with whitespace
+            if current and unit.is_heading:
+                # A heading starts a new section; don't carry overlap across it
+                yield self._make_chunk(current, page, current_tokens)
+                current, current_tokens = [], 0
+            elif current and current_tokens + unit.tokens > self.max_tokens:
+                yield self._make_chunk(current, page, current_tokens)
+                current = self._overlap(current)
+                current_tokens = sum(u.tokens for u in current)
+                if current_tokens + unit.tokens > self.max_tokens:
+                    current, current_tokens = [], 0
+            current.append(unit)
+            current_tokens += unit.tokens
+        if final:
+            if current and any(u.text.strip() for u in current):
+                yield self._make_chunk(current, page, current_tokens)
+            return []
+        return current
+
+    def _overlap(self, units):
+        """Returns the trailing units (never all of them) that fit into overlap_tokens."""
+        overlap = []
+        tokens = 0
+        for unit in reversed(units[1:]):
+            if tokens + unit.tokens > self.overlap_tokens:
+                break
+            overlap.append(unit)
+            tokens += unit.tokens
+        overlap.reverse()
+        return overlap
+
+    def _make_chunk(self, units, page, tokens):
+        raw = "".join(u.text for u in units)
+        text = raw.strip()
+        char_start = units[0].start + (len(raw) - len(raw.lstrip()))
+        metadata = {"char_start": char_start, "char_end": char_start + len(text), "token_count": tokens}
+        if page is not None:
+            metadata["page"] = page
+        return text, metadata
+
+class CharacterChunker:
+    """The original fixed-size character windows (chunk_text), as a streaming chunker."""
+    def __init__(self, chunk_size=1000, chunk_overlap=200):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    def __call__(self, segments):
+        step = self.chunk_size - self.chunk_overlap
+        texts = (text for _, text in segments)
+        for i, chunk in enumerate(chunk_text_stream(texts, self.chunk_size, self.chunk_overlap)):
+            yield chunk, {"char_start": i * step, "char_end": i * step + len(chunk)}
+
+# Registry of available chunkers; add new strategies here
+CHUNKERS = {
+    "tokens": TokenChunker,
+    "characters": CharacterChunker,
+}
+
+def get_chunker(name=CHUNKER):
+    """Returns a chunker instance by name. Chunkers map (page, text) segments to (text, metadata) chunks."""
+    if name not in CHUNKERS:
+        raise ValueError(f"Unknown chunker '{name}'. Available: {', '.join(sorted(CHUNKERS))}")
+    return CHUNKERS[name]()
@@ -0,0 +1,161 @@
+# context_packer.py
+import os
+
+import numpy as np
+
+from chromadb_utils import query_chroma_batch
+from rag_prompts import format_context
+from token_utils import count_tokens, truncate_to_tokens
+import telemetry
+
+# Assemble the prompt context from a diverse, token-budgeted set of chunks instead of a fixed top-k
+CONTEXT_PACKING_ENABLED = os.getenv("CONTEXT_PACKING_ENABLED", "true").lower() != "false"
+# Maximum number of tokens of the context block sent to the chat model
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Number of candidates retrieved before diversification
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "20"))
+# Trade-off between relevance (1.0) and diversity (0.0) in maximal marginal relevance
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+# The leftover budget is filled with a truncated chunk only if at least this many tokens remain
+MIN_FILL_TOKENS = 32
+
+def candidate_relevance(distances):
+    """
+    Relevance in [0, 1] of candidates ordered best first. Cosine similarity is recovered from
+    ChromaDB's squared L2 distance (embeddings are unit length); candidates ranked by fusion
+    or BM25 alone have no distance for every chunk, so their rank decides.
+    """
+    if distances and all(distance is not None for distance in distances):
+        return np.clip(1.0 - np.asarray(distances, dtype=np.float32) / 2.0, 0.0, 1.0)
+    return 1.0 - np.arange(len(distances), dtype=np.float32) / max(len(distances), 1)
+
+def mmr_order(embeddings, relevance, mmr_lambda=MMR_LAMBDA):
+    """
+    Orders candidates by maximal marginal relevance: each step picks the candidate maximizing
+    mmr_lambda * relevance - (1 - mmr_lambda) * (max cosine similarity to those already picked).
+    """
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    similarity = vectors @ vectors.T
+    max_similarity = np.zeros(len(vectors), dtype=np.float32)
+    available = np.ones(len(vectors), dtype=bool)
+    order = []
+    for _ in range(len(vectors)):
+        scores = mmr_lambda * relevance - (1.0 - mmr_lambda) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        order.append(best)
+        available[best] = False
+        np.maximum(max_similarity, similarity[:, best], out=max_similarity)
+    return order
+
+def _adjacent(previous, following):
+    return (previous["metadata"].get("source") == following["metadata"].get("source")
+            and previous["metadata"].get("page") == following["metadata"].get("page")
+            and following["metadata"].get("chunk_idx") == previous["metadata"].get("chunk_idx", -2) + 1)
+
+def merge_adjacent(chunks):
+    """
+    Merges chunks that follow each other in the same source (consecutive chunk_idx) into one
+    passage, dropping the text they overlap by according to their character offsets.
+    Passages keep the position of their earliest chunk; returns [(text, ids)].
+    """
+    ordered = sorted(range(len(chunks)), key=lambda i: (
+        str(chunks[i]["metadata"].get("source")), chunks[i]["metadata"].get("chunk_idx", -1)))
+    passages = [] # [first position, text, ids, last chunk]
+    for i in ordered:
+        chunk = chunks[i]
+        if passages and _adjacent(passages[-1][3], chunk):
+            passage = passages[-1]
+            previous_end = passage[3]["metadata"].get("char_end")
+            start = chunk["metadata"].get("char_start")
+            if previous_end is not None and start is not None and start < previous_end:
+                passage[1] += chunk["document"][previous_end - start:]
+            else:
+                passage[1] += "\n\n" + chunk["document"]
+            passage[0] = min(passage[0], i)
+            passage[2].append(chunk["id"])
+            passage[3] = chunk
+        else:
+            passages.append([i, chunk["document"], [chunk["id"]], chunk])
+    passages.sort(key=lambda passage: passage[0])
+    return [(text, ids) for _, text, ids, _ in passages]
+
+@telemetry.traced("pack")
+def pack_result(result, token_budget=CONTEXT_TOKEN_BUDGET, mmr_lambda=MMR_LAMBDA):
+    """
+    Packs one query_chroma_batch result (with embeddings) into a context that fits
+    token_budget tokens as formatted by rag_prompts.format_context. Candidates are taken in
+    MMR order, merged with their neighbours, and dropped if they would overflow the budget;
+    the budget left over at the end is filled with the best rejected chunk, truncated.
+    Returns {"documents": passages, "ids": chunk ids, "tokens": context tokens, "candidates": n,
+    "query_embedding": the result's query embedding}.
+    """
+    chunks = [{"id": chunk_id, "document": document, "metadata": metadata or {}}
+              for chunk_id, document, metadata in zip(result["ids"], result["documents"], result["metadatas"])]
+    packed = {"documents": [], "ids": [], "tokens": 0, "candidates": len(chunks),
+              "query_embedding": result.get("query_embedding")}
+    if not chunks:
+        return packed
+
+    # Re-ranked candidates carry their own relevance, in the re-ranked order
+    relevance = result.get("relevance")
+    relevance = candidate_relevance(result["distances"]) if relevance is None else np.asarray(relevance, dtype=np.float32)
+    order = mmr_order(result["embeddings"], relevance, mmr_lambda)
+    selected, rejected = [], []
+    for i in order:
+        passages = merge_adjacent(selected + [chunks[i]])
+        tokens = count_tokens(format_context([text for text, _ in passages]))
+        if tokens <= token_budget:
+            selected.append(chunks[i])
+            packed["documents"] = [text for text, _ in passages]
+            packed["ids"] = [chunk_id for _, ids in passages for chunk_id in ids]
+            packed["tokens"] = tokens
+        else:
+            rejected.append(chunks[i])
+
+    remaining = token_budget - packed["tokens"]
+    if rejected and remaining >= MIN_FILL_TOKENS:
+        chunk = rejected[0]
+        # Token boundaries can shift at the seam, so shrink until the whole context fits
+        limit = remaining - count_tokens(format_context(["x"]))
+        while limit > 0:
+            documents = packed["documents"] + [truncate_to_tokens(chunk["document"], limit)]
+            tokens = count_tokens(format_context(documents))
+            if tokens <= token_budget:
+                packed.update(documents=documents, ids=packed["ids"] + [chunk["id"]], tokens=tokens)
+                break
+            limit -= max(1, tokens - token_budget)
+    return packed
+
+def pack_context_batch(collection, query_texts, token_budget=CONTEXT_TOKEN_BUDGET, candidates=CONTEXT_CANDIDATES,
+                       where=None, max_distance=None, mode=None):
+    """Over-fetches candidates for every query in one retrieval call and packs each into a context."""
+    results = query_chroma_batch(collection, query_texts, candidates, where, max_distance, mode, include_embeddings=True)
+    packed = [pack_result(result, token_budget) for result in results]
+    for context in packed:
+        telemetry.observe("rag_context_tokens", context["tokens"], buckets=telemetry.SIZE_BUCKETS)
+    return packed
+
+def pack_context(collection, query_text, token_budget=CONTEXT_TOKEN_BUDGET, candidates=CONTEXT_CANDIDATES,
+                 where=None, max_distance=None, mode=None, include_query_embedding=False):
+    """
+    Retrieves and packs the context for one question. Returns (passages, chunk_ids), plus
+    the question's embedding (None if retrieval didn't embed it) with include_query_embedding=True;
+    both lists are empty if retrieval fails.
+    """
+    def failed():
+        return ([], [], None) if include_query_embedding else ([], [])
+
+    if not collection:
+        return failed()
+    try:
+        packed = pack_context_batch(collection, [query_text], token_budget, candidates, where, max_distance, mode)[0]
+        print(f"Packed {len(packed['ids'])} of {packed['candidates']} retrieved chunks for '{query_text}' "
+              f"into {len(packed['documents'])} passages ({packed['tokens']}/{token_budget} tokens).")
+        if include_query_embedding:
+            return packed["documents"], packed["ids"], packed["query_embedding"]
+        return packed["documents"], packed["ids"]
+    except Exception as e:
+        print(f"Error retrieving context from ChromaDB: {e}")
+        return failed()
@@ -0,0 +1,191 @@
+# dedup.py
+import os
+import re
+import json
+import zlib
+import base64
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Near-duplicate detection settings; chunks whose estimated Jaccard similarity of word
+# shingles reaches the threshold are merged into the first chunk seen with that content
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() != "false"
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))
+DEDUP_NUM_PERM = 128
+DEDUP_BANDS = 16 # 16 bands x 8 rows: pairs above ~0.7 similarity almost always share a bucket
+DEDUP_SHINGLE_SIZE = 5
+DEDUP_STATE_VERSION = 1
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_WORD_RE = re.compile(r"\w+")
+
+class MinHashDeduplicator:
+    """
+    MinHash/LSH index of the chunks that were actually embedded.
+    filter_chunks drops chunks that are near-duplicates of an indexed chunk and records
+    their source on that canonical chunk instead; remove_source keeps the state in sync
+    when files are deleted or changed. The state is persisted as JSON between runs.
+    """
+    def __init__(self, threshold=DEDUP_THRESHOLD, num_perm=DEDUP_NUM_PERM, bands=DEDUP_BANDS,
+                 shingle_size=DEDUP_SHINGLE_SIZE, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        # a < 2**31 and 32-bit shingle hashes keep a * h + b within uint64
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 1 << 31, size=num_perm, dtype=np.int64).astype(np.uint64)
+        self._b = rng.randint(0, 1 << 31, size=num_perm, dtype=np.int64).astype(np.uint64)
+        self.entries = {} # chunk id -> {"signature", "source", "merged"}
+        self._buckets = {} # band key -> set of chunk ids
+        self.saved_embeddings = 0 # Across all runs
+        self.skipped_this_run = 0
+
+    def signature(self, text):
+        """Returns the MinHash signature (uint32 array) of the word shingles of a text."""
+        words = _WORD_RE.findall(text.lower())
+        k = self.shingle_size
+        if len(words) <= k:
+            shingles = [" ".join(words)]
+        else:
+            shingles = [" ".join(words[i:i + k]) for i in range(len(words) - k + 1)]
+        hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in set(shingles)), dtype=np.uint64)
+        permuted = (np.outer(self._a, hashes) + self._b[:, None]) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, signature):
+        return [
+            f"{band}:{signature[band * self.rows:(band + 1) * self.rows].tobytes().hex()}"
+            for band in range(self.bands)
+        ]
+
+    def _insert(self, chunk_id, signature, source, merged):
+        self.entries[chunk_id] = {"signature": signature, "source": source, "merged": merged}
+        for key in self._band_keys(signature):
+            self._buckets.setdefault(key, set()).add(chunk_id)
+
+    def _remove(self, chunk_id):
+        entry = self.entries.pop(chunk_id)
+        for key in self._band_keys(entry["signature"]):
+            bucket = self._buckets.get(key)
+            if bucket:
+                bucket.discard(chunk_id)
+                if not bucket:
+                    del self._buckets[key]
+        return entry
+
+    def find_duplicate(self, signature, exclude_id=None):
+        """Returns the ID of the most similar indexed chunk above the threshold, or None."""
+        candidates = set()
+        for key in self._band_keys(signature):
+            candidates.update(self._buckets.get(key, ()))
+        candidates.discard(exclude_id)
+        best_id, best_similarity = None, self.threshold
+        for candidate in candidates:
+            similarity = float(np.mean(self.entries[candidate]["signature"] == signature))
+            if similarity >= best_similarity:
+                best_id, best_similarity = candidate, similarity
+        return best_id
+
+    def sources_of(self, chunk_id):
+        """All sources whose content is represented by a canonical chunk."""
+        entry = self.entries[chunk_id]
+        return [entry["source"]] + entry["merged"]
+
+    def filter_chunks(self, ids, documents, metadatas):
+        """
+        Splits a group of chunks into the ones to embed and the near-duplicates to drop.
+        Returns (kept_indices, merged_ids), where merged_ids are canonical chunks that gained
+        a new source and need their 'sources' metadata updated.
+        """
+        kept = []
+        merged_ids = set()
+        for i, (chunk_id, document, metadata) in enumerate(zip(ids, documents, metadatas)):
+            signature = self.signature(document)
+            duplicate_id = self.find_duplicate(signature, exclude_id=chunk_id)
+            if duplicate_id is None:
+                self._insert(chunk_id, signature, metadata["source"], [])
+                kept.append(i)
+                continue
+            self.skipped_this_run += 1
+            self.saved_embeddings += 1
+            entry = self.entries[duplicate_id]
+            source = metadata["source"]
+            if source != entry["source"] and source not in entry["merged"]:
+                entry["merged"].append(source)
+                merged_ids.add(duplicate_id)
+        return kept, merged_ids
+
+    def remove_source(self, source):
+        """
+        Forgets every chunk of a source that is being deleted or re-indexed.
+        Returns (orphaned_sources, updated_ids): sources whose content only survived as a
+        merged duplicate of a removed chunk and must be re-indexed, and canonical chunks
+        of other sources whose 'sources' metadata lost this source.
+        """
+        orphaned = set()
+        updated_ids = set()
+        for chunk_id in list(self.entries):
+            entry = self.entries[chunk_id]
+            if entry["source"] == source:
+                orphaned.update(s for s in self._remove(chunk_id)["merged"] if s != source)
+            elif source in entry["merged"]:
+                entry["merged"].remove(source)
+                updated_ids.add(chunk_id)
+        return orphaned, updated_ids
+
+    def _params(self):
+        return {"threshold": self.threshold, "num_perm": self.num_perm,
+                "bands": self.bands, "shingle_size": self.shingle_size}
+
+    def save(self, path):
+        """Atomically writes the deduplication state to disk."""
+        state = {
+            "version": DEDUP_STATE_VERSION,
+            "params": self._params(),
+            "saved_embeddings": self.saved_embeddings,
+            "entries": {
+                chunk_id: {
+                    "signature": base64.b64encode(entry["signature"].tobytes()).decode('ascii'),
+                    "source": entry["source"],
+                    "merged": entry["merged"],
+                }
+                for chunk_id, entry in self.entries.items()
+            },
+        }
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            # json.dumps uses the C encoder; json.dump(state, f) streams through the pure-Python one
+            f.write(json.dumps(state))
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """
+        Loads state saved by save(). Returns False (leaving the index empty) if it is missing,
+        unreadable or was built with different parameters.
+        """
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get("version") != DEDUP_STATE_VERSION or state.get("params") != self._params():
+                print(f"Deduplication settings changed; ignoring state in '{path}'.")
+                return False
+            for chunk_id, entry in state["entries"].items():
+                signature = np.frombuffer(base64.b64decode(entry["signature"]), dtype=np.uint32).copy()
+                self._insert(chunk_id, signature, entry["source"], entry["merged"])
+            self.saved_embeddings = state.get("saved_embeddings", 0)
+            return True
+        except Exception as e:
+            print(f"Error reading deduplication state {path}: {e}")
+            self.entries, self._buckets = {}, {}
+            return False
@@ -1,7 +1,17 @@
 # document_processor.py
 import os
-import PyPDF2 # For PDF
-from docx import Document # For DOCX
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import telemetry
+
+# Large PDFs are split into page ranges of this size so one manual can use several cores
+PDF_PAGES_PER_TASK = 50
+
+PDF_MIME_TYPE = 'application/pdf'
+
+# Text files are streamed in blocks of this many characters
+TEXT_READ_BLOCK_SIZE = 1024 * 1024
 
 def read_text_file(filepath):
     """Reads content from a plain text file."""
@@ -12,32 +22,82 @@ def read_text_file(filepath):
         print(f"Error reading text file {filepath}: {e}")
         return None
 
+def _pdf_page_texts(filepath, start_page=0, end_page=None):
+    """Yields the text of pages [start_page, end_page) of a PDF file. Raises on read errors."""
+    import PyPDF2 # Imported on first use: most runs never parse a PDF
+    with open(filepath, 'rb') as f:
+        reader = PyPDF2.PdfReader(f)
+        num_pages = len(reader.pages) if end_page is None else min(end_page, len(reader.pages))
+        for page_num in range(start_page, num_pages):
+            yield reader.pages[page_num].extract_text() or "" # Handle empty pages
+
+def _docx_paragraph_texts(filepath):
+    """
+    Yields the paragraphs of a DOCX file, each followed by a blank line, so that chunkers see
+    paragraph (and heading) boundaries as in plain text. Raises on read errors.
+    """
+    from docx import Document # Imported on first use, like PyPDF2
+    doc = Document(filepath)
+    for paragraph in doc.paragraphs:
+        yield paragraph.text + "\n\n"
+
 def read_pdf_file(filepath):
     """Reads content from a PDF file."""
-    text = ""
     try:
+        return "".join(_pdf_page_texts(filepath))
+    except Exception as e:
+        print(f"Error reading PDF file {filepath}: {e}")
+        return None
+
+def get_pdf_page_count(filepath):
+    """Returns the number of pages of a PDF file, or 0 if it cannot be read."""
+    try:
+        import PyPDF2
         with open(filepath, 'rb') as f:
-            reader = PyPDF2.PdfReader(f)
-            for page_num in range(len(reader.pages)):
-                page = reader.pages[page_num]
-                text += page.extract_text() or "" # Handle empty pages
-        return text
+            return len(PyPDF2.PdfReader(f).pages)
     except Exception as e:
         print(f"Error reading PDF file {filepath}: {e}")
+        return 0
+
+def read_pdf_pages(filepath, start_page, end_page):
+    """Reads the content of pages [start_page, end_page) of a PDF file."""
+    try:
+        return "".join(_pdf_page_texts(filepath, start_page, end_page))
+    except Exception as e:
+        print(f"Error reading pages {start_page}-{end_page} of PDF file {filepath}: {e}")
         return None
 
 def read_docx_file(filepath):
     """Reads content from a DOCX file."""
-    text = ""
     try:
-        doc = Document(filepath)
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text
+        return "".join(_docx_paragraph_texts(filepath))
     except Exception as e:
         print(f"Error reading DOCX file {filepath}: {e}")
         return None
 
+def iter_text_file(filepath, block_size=TEXT_READ_BLOCK_SIZE):
+    """Yields the content of a plain text file in blocks, without loading the whole file."""
+    try:
+        with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
+            for block in iter(lambda: f.read(block_size), ""):
+                yield block
+    except Exception as e:
+        print(f"Error reading text file {filepath}: {e}")
+
+def iter_pdf_pages(filepath):
+    """Yields the text of a PDF file page by page."""
+    try:
+        yield from _pdf_page_texts(filepath)
+    except Exception as e:
+        print(f"Error reading PDF file {filepath}: {e}")
+
+def iter_docx_paragraphs(filepath):
+    """Yields the text of a DOCX file paragraph by paragraph."""
+    try:
+        yield from _docx_paragraph_texts(filepath)
+    except Exception as e:
+        print(f"Error reading DOCX file {filepath}: {e}")
+
 def get_file_content(filepath, mime_type):
     """Determines file type and extracts content."""
     if mime_type == 'text/plain':
@@ -50,6 +110,118 @@ def get_file_content(filepath, mime_type):
         print(f"Unsupported file type for content extraction: {mime_type} for {os.path.basename(filepath)}")
         return None
 
+def iter_file_content(filepath, mime_type):
+    """Determines file type and yields its content piece by piece (blocks, pages or paragraphs)."""
+    if mime_type == 'text/plain':
+        return iter_text_file(filepath)
+    elif mime_type == 'application/pdf':
+        return iter_pdf_pages(filepath)
+    elif mime_type == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document':
+        return iter_docx_paragraphs(filepath)
+    else:
+        print(f"Unsupported file type for content extraction: {mime_type} for {os.path.basename(filepath)}")
+        return iter(())
+
+def iter_file_segments(filepath, mime_type):
+    """
+    Yields (page, text) segments of a file: one per page for PDFs (numbered from 1) and
+    (None, piece) for formats without pages. Chunkers use the page to annotate chunks.
+    """
+    if mime_type == PDF_MIME_TYPE:
+        return enumerate(iter_pdf_pages(filepath), start=1)
+    return ((None, piece) for piece in iter_file_content(filepath, mime_type))
+
+def extract_segments(filepath, mime_type, page_range=None):
+    """
+    Extracts a whole file, or one [start, end) page range of a PDF, as a list of
+    (page, text) segments. Returns None if the content could not be read.
+    """
+    try:
+        if page_range is not None:
+            start_page, end_page = page_range
+            return list(enumerate(_pdf_page_texts(filepath, start_page, end_page), start=start_page + 1))
+        if mime_type == PDF_MIME_TYPE:
+            return list(enumerate(_pdf_page_texts(filepath), start=1))
+    except Exception as e:
+        print(f"Error reading PDF file {filepath}: {e}")
+        return None
+    content = get_file_content(filepath, mime_type)
+    return [(None, content)] if content is not None else None
+
+def _extract_segments_timed(filepath, mime_type, page_range=None):
+    """extract_segments for worker processes: also returns the seconds it took, since spans don't cross processes."""
+    start_time = time.perf_counter()
+    segments = extract_segments(filepath, mime_type, page_range)
+    return segments, time.perf_counter() - start_time
+
+def _plan_extraction_tasks(files, pdf_pages_per_task):
+    """Expands (filepath, mime_type) pairs into tasks, splitting large PDFs by page range."""
+    for filepath, mime_type in files:
+        if mime_type == PDF_MIME_TYPE:
+            num_pages = get_pdf_page_count(filepath)
+            if num_pages > pdf_pages_per_task:
+                ranges = [(start, min(start + pdf_pages_per_task, num_pages))
+                          for start in range(0, num_pages, pdf_pages_per_task)]
+                for part, page_range in enumerate(ranges):
+                    yield filepath, mime_type, page_range, part, len(ranges)
+                continue
+        yield filepath, mime_type, None, 0, 1
+
+def extract_files_parallel(files, max_workers=None, pdf_pages_per_task=PDF_PAGES_PER_TASK):
+    """
+    Extracts the content of (filepath, mime_type) pairs on a process pool and yields
+    (filepath, segments) as each file completes, in completion order, where segments are
+    the (page, text) pairs of extract_segments (None on failure). Large PDFs are
+    fanned out by page range and reassembled in page order. Only a bounded number of
+    tasks is in flight, so results stream to the consumer instead of piling up.
+    With max_workers=1 extraction runs serially in this process.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers <= 1:
+        for filepath, mime_type in files:
+            with telemetry.span("extract", file=os.path.basename(filepath)):
+                segments = extract_segments(filepath, mime_type)
+            yield filepath, segments
+        return
+
+    tasks = _plan_extraction_tasks(files, pdf_pages_per_task)
+    parts = {} # filepath -> list of page-range segment lists, for files split into several tasks
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = {}
+
+        def submit_next():
+            task = next(tasks, None)
+            if task is None:
+                return False
+            filepath, mime_type, page_range, part, num_parts = task
+            future = executor.submit(_extract_segments_timed, filepath, mime_type, page_range)
+            in_flight[future] = (filepath, part, num_parts)
+            return True
+
+        while len(in_flight) < max_workers * 2 and submit_next():
+            pass
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                filepath, part, num_parts = in_flight.pop(future)
+                try:
+                    content, seconds = future.result()
+                    telemetry.record("extract", seconds, file=os.path.basename(filepath), part=part)
+                except Exception as e:
+                    print(f"Error extracting content from {filepath}: {e}")
+                    content = None
+                submit_next()
+
+                if num_parts == 1:
+                    yield filepath, content
+                    continue
+                file_parts = parts.setdefault(filepath, [None] * num_parts)
+                file_parts[part] = content if content is not None else []
+                if all(p is not None for p in file_parts):
+                    del parts[filepath]
+                    yield filepath, [segment for segments in file_parts for segment in segments] or None
+
 def chunk_text(text, chunk_size=1000, chunk_overlap=200):
     """Splits a long text into smaller chunks with overlap."""
     if not text:
@@ -68,4 +240,30 @@ def chunk_text(text, chunk_size=1000, chunk_overlap=200):
         if current_position < 0:
             current_position = 0
 
-    return chunks
\ No newline at end of file
+    return chunks
+
+def chunk_text_stream(pieces, chunk_size=1000, chunk_overlap=200):
+    """
+    Streaming variant of chunk_text: consumes an iterable of text pieces (blocks, pages,
+    paragraphs) and yields the same chunks chunk_text would produce for their concatenation.
+    Only a sliding window of roughly chunk_size plus one piece is kept in memory.
+    """
+    step = chunk_size - chunk_overlap
+    if step <= 0:
+        raise ValueError("chunk_overlap must be smaller than chunk_size")
+
+    buffer = ""
+    for piece in pieces:
+        if not piece:
+            continue
+        buffer += piece
+        # Emit every chunk that is guaranteed not to be the last one, then drop consumed text once
+        position = 0
+        while len(buffer) - position > chunk_size:
+            yield buffer[position:position + chunk_size]
+            position += step
+        if position:
+            buffer = buffer[position:]
+
+    if buffer:
+        yield buffer
@@ -0,0 +1,246 @@
+# document_watcher.py
+import os
+import time
+import threading
+from collections import deque
+
+import numpy as np
+from dotenv import load_dotenv
+
+from indexer import LOCAL_DOCS_PATH, MANIFEST_PATH, prepare_and_index_documents, scan_documents, load_manifest
+import telemetry
+
+load_dotenv()
+
+# Keep the index in step with LOCAL_DOCS_PATH while the CLI or the service is running
+WATCH_DOCUMENTS = os.getenv("WATCH_DOCUMENTS", "true").lower() != "false"
+# "auto": file system events through the optional watchdog package (inotify, FSEvents, ...)
+# when it is installed, polling otherwise; "poll": always poll
+WATCH_MODE = os.getenv("WATCH_MODE", "auto").lower()
+# A file is indexed once it has not changed for this long, so bursts of writes and copies
+# of large files are indexed once, after they are complete
+WATCH_DEBOUNCE_SECONDS = float(os.getenv("WATCH_DEBOUNCE_SECONDS", "1.0"))
+WATCH_POLL_INTERVAL = float(os.getenv("WATCH_POLL_INTERVAL", "2.0"))
+# Files per indexing run: a large drop of files is indexed in several runs, so the first
+# files become searchable early and the indexing lock is released in between
+WATCH_BATCH_FILES = int(os.getenv("WATCH_BATCH_FILES", "16"))
+# Files that failed to index (e.g. the embedding service was down) are retried after this delay
+WATCH_RETRY_SECONDS = float(os.getenv("WATCH_RETRY_SECONDS", "30"))
+# Number of change-to-searchable latencies kept for the percentiles in stats()
+WATCH_LATENCY_HISTORY = 1000
+
+# Event types that change a file; watchdog also reports files being opened and read
+_CHANGE_EVENT_TYPES = {"created", "modified", "deleted", "moved", "closed"}
+
+class DocumentWatcher:
+    """
+    Watches a documents directory and indexes changed files on a background worker thread
+    while queries keep being served. Changes are noticed through watchdog events or by
+    polling file sizes and modification times, debounced per file, and passed to
+    prepare_and_index_documents in batches, which upserts new and changed files and deletes
+    the chunks of removed ones. stats() reports the queue depth and the latency from a
+    change to the file being searchable; both are also exported as telemetry metrics.
+    """
+    def __init__(self, collection, docs_path=LOCAL_DOCS_PATH, manifest_path=MANIFEST_PATH, mode=WATCH_MODE,
+                 debounce_seconds=WATCH_DEBOUNCE_SECONDS, poll_interval=WATCH_POLL_INTERVAL,
+                 batch_files=WATCH_BATCH_FILES, retry_seconds=WATCH_RETRY_SECONDS):
+        self.collection = collection
+        self.docs_path = docs_path
+        self.manifest_path = manifest_path
+        self.mode = mode
+        self.debounce_seconds = debounce_seconds
+        self.poll_interval = poll_interval
+        self.batch_files = batch_files
+        self.retry_seconds = retry_seconds
+        self._pending = {} # filename -> [time of the first unindexed change, time it is ready]
+        self._indexing = False
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        self._threads = []
+        self._observer = None
+        self._latencies = deque(maxlen=WATCH_LATENCY_HISTORY)
+        self._counts = {"files_indexed": 0, "batches": 0, "retries": 0}
+
+    def start(self):
+        """Starts watching; the first indexing run picks up changes made while nothing was watching."""
+        if self.mode not in ("auto", "poll"):
+            print(f"Error: Unknown WATCH_MODE '{self.mode}'. Choose 'auto' or 'poll'.")
+            return False
+        if self.mode == "auto" and self._start_observer():
+            self.mode = "events"
+        else:
+            self.mode = "poll"
+            self._start_thread(self._poll, "document-watcher-poll")
+        self._start_thread(self._work, "document-watcher")
+        print(f"Watching '{self.docs_path}' for changes ({'file system events' if self.mode == 'events' else 'polling'}).")
+        return True
+
+    def stop(self, timeout=None):
+        """Stops watching; an indexing run in progress is finished first (up to timeout seconds)."""
+        self._stopped.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout)
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def notify(self, filename, event_time=None):
+        """Records a change of a file in the documents directory (called for every event)."""
+        now = time.time()
+        with self._condition:
+            entry = self._pending.setdefault(filename, [min(event_time or now, now), 0.0])
+            entry[1] = now + self.debounce_seconds
+            self._set_queue_gauge()
+            self._condition.notify_all()
+
+    def wait_idle(self, timeout=None):
+        """Blocks until no change is queued or being indexed; returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._pending or self._indexing:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def stats(self):
+        """Queue depth, indexing counters and change-to-searchable latency percentiles (seconds)."""
+        with self._condition:
+            latencies = np.asarray(self._latencies, dtype=np.float64)
+            stats = dict(self._counts, mode=self.mode, queue_depth=len(self._pending), indexing=self._indexing)
+        for name, percentile in (("latency_p50_seconds", 50), ("latency_p95_seconds", 95), ("latency_max_seconds", 100)):
+            stats[name] = float(np.percentile(latencies, percentile)) if len(latencies) else None
+        return stats
+
+    def _start_thread(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _start_observer(self):
+        """Subscribes to file system events through watchdog; returns False if it is unavailable."""
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            return False
+        watcher = self
+        docs_path = os.path.abspath(self.docs_path)
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.is_directory or event.event_type not in _CHANGE_EVENT_TYPES:
+                    return
+                # A move (rename) changes both its source and its destination
+                for path in (event.src_path, getattr(event, "dest_path", "")):
+                    path = os.fsdecode(path)
+                    # Only files directly in the directory are indexed (see scan_documents)
+                    if path and os.path.dirname(os.path.abspath(path)) == docs_path:
+                        watcher.notify(os.path.basename(path))
+
+        try:
+            observer = Observer()
+            observer.schedule(Handler(), docs_path, recursive=False)
+            observer.daemon = True
+            observer.start()
+        except Exception as e:
+            print(f"Could not watch '{self.docs_path}' for file system events ({e}). Falling back to polling.")
+            return False
+        self._observer = observer
+        return True
+
+    def _poll(self):
+        """Compares the size and mtime of every file with the previous scan."""
+        previous = self._scan()
+        while not self._stopped.wait(self.poll_interval):
+            current = self._scan()
+            for filename in previous.keys() | current.keys():
+                stat = current.get(filename)
+                if stat != previous.get(filename):
+                    # The modification time is the best estimate of when the change happened
+                    self.notify(filename, stat["mtime_ns"] / 1e9 if stat else None)
+            previous = current
+
+    def _scan(self):
+        try:
+            return scan_documents(self.docs_path)
+        except OSError as e:
+            print(f"Error scanning '{self.docs_path}': {e}")
+            return {}
+
+    def _next_batch(self):
+        """Waits for files whose debounce delay has passed; returns up to batch_files of them, oldest change first."""
+        with self._condition:
+            while not self._stopped.is_set():
+                now = time.time()
+                ready = sorted((entry[0], filename) for filename, entry in self._pending.items() if entry[1] <= now)
+                if ready:
+                    batch = {filename: self._pending.pop(filename)[0] for _, filename in ready[:self.batch_files]}
+                    self._indexing = True
+                    self._set_queue_gauge()
+                    return batch
+                if self._pending:
+                    self._condition.wait(max(min(entry[1] for entry in self._pending.values()) - now, 0.01))
+                else:
+                    self._condition.wait()
+        return None
+
+    def _work(self):
+        with self._condition:
+            self._indexing = True
+        self._index(None)
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._index(batch)
+
+    def _index(self, batch):
+        """Indexes a batch of changed files ({filename: first change time}), or every file if batch is None."""
+        try:
+            prepare_and_index_documents(self.collection, self.docs_path, self.manifest_path,
+                                        None if batch is None else sorted(batch))
+        except Exception as e:
+            print(f"Error indexing changed documents: {e}")
+        if batch is None:
+            with self._condition:
+                self._indexing = False
+                self._condition.notify_all()
+            return
+        done = time.time()
+        current_files = self._scan()
+        indexed_files = load_manifest(self.manifest_path)["files"]
+        indexed, failed = {}, []
+        for filename, first_change in batch.items():
+            stat, entry = current_files.get(filename), indexed_files.get(filename)
+            # Indexed means the manifest records the file as it is now (or no longer records a deleted one)
+            if (stat is None and entry is None) or (stat and entry and all(entry.get(key) == value for key, value in stat.items())):
+                indexed[filename] = done - first_change
+            else:
+                failed.append(filename)
+        with self._condition:
+            for filename in failed:
+                # A file that changed again while it was being indexed is already queued anew
+                if filename not in self._pending:
+                    self._pending[filename] = [batch[filename], done + self.retry_seconds]
+                    self._counts["retries"] += 1
+            self._latencies.extend(indexed.values())
+            self._counts["files_indexed"] += len(indexed)
+            self._counts["batches"] += 1
+            self._indexing = False
+            queue_depth = len(self._pending)
+            self._set_queue_gauge()
+            self._condition.notify_all()
+        for latency in indexed.values():
+            telemetry.observe("rag_watch_change_latency_seconds", latency)
+        if indexed:
+            print(f"Watcher: {len(indexed)} changed file(s) indexed {max(indexed.values()):.1f}s after the change "
+                  f"({queue_depth} queued).")
+        if failed:
+            print(f"Watcher: {len(failed)} file(s) could not be indexed; retrying in {self.retry_seconds:.0f}s.")
+
+    def _set_queue_gauge(self):
+        telemetry.set_gauge("rag_watch_queue_depth", len(self._pending))
@@ -0,0 +1,185 @@
+# embedding_backends.py
+import os
+import re
+import math
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Which backend embeds documents and queries: "azure", "hashing" or "sentence-transformers"
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "azure").lower()
+
+AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
+AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
+AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION")
+AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME")
+
+# Hashing backend: dimension of the random projection and the number of word vectors kept in memory
+HASHING_EMBEDDING_DIM = int(os.getenv("HASHING_EMBEDDING_DIM", "384"))
+HASHING_VECTOR_CACHE_SIZE = 100_000
+
+# Sentence-transformers backend: any model name or local path the library accepts
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "64"))
+
+_WORD_RE = re.compile(r"\w+")
+
+class EmbeddingBackend:
+    """
+    Interface of the embedding backends. embed() maps a list of texts to a float32 array
+    of shape (len(texts), dimension). name identifies the vector space (backend and model)
+    so that vectors of different backends are never mixed; cache_namespace is the
+    embedding cache namespace, or None for backends that are cheaper than the cache.
+    """
+    name = None
+    cache_namespace = None
+    dimension = None # None if only known after the first embedding
+
+    def embed(self, texts):
+        raise NotImplementedError
+
+    def without_client_retries(self):
+        """
+        This backend for callers that retry failed calls themselves (ingestion_engine.call_with_retry),
+        with the client's own retries disabled. Backends without an API client return themselves.
+        """
+        return self
+
+class AzureOpenAIBackend(EmbeddingBackend):
+    """
+    Embeddings from an Azure OpenAI deployment. Requests go through the client shared with
+    chat (openai_utils.get_openai_client), which is only created when the first text that
+    is not in the embedding cache has to be embedded. max_retries overrides the client's
+    own retries (None keeps the SDK default).
+    """
+    def __init__(self, deployment_name, client=None, max_retries=None):
+        self._client = client
+        self.max_retries = max_retries
+        self.deployment_name = deployment_name
+        self.name = f"azure-{deployment_name}"
+        # Keyed by deployment name alone, so caches filled before backends existed stay valid
+        self.cache_namespace = deployment_name
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai_utils import get_openai_client
+            self._client = get_openai_client()
+            if self._client is None:
+                raise RuntimeError("The Azure OpenAI client could not be created.")
+            if self.max_retries is not None:
+                self._client = self._client.with_options(max_retries=self.max_retries)
+        return self._client
+
+    def without_client_retries(self):
+        backend = AzureOpenAIBackend(self.deployment_name, max_retries=0)
+        if self._client is not None:
+            backend._client = self._client.with_options(max_retries=0)
+        backend.dimension = self.dimension
+        return backend
+
+    def embed(self, texts):
+        response = self.client.embeddings.create(input=texts, model=self.deployment_name)
+        return np.asarray([data.embedding for data in response.data], dtype=np.float32)
+
+class HashingEmbeddingBackend(EmbeddingBackend):
+    """
+    CPU-only embeddings without a model: a random projection of sublinear-TF weighted
+    words and word bigrams. Every term gets a fixed pseudo-random Gaussian vector seeded by
+    its hash, so embeddings are deterministic across processes and machines. Meant for
+    tests, CI and air-gapped setups; texts sharing vocabulary end up close together.
+    """
+    cache_namespace = None
+
+    def __init__(self, dimension=HASHING_EMBEDDING_DIM):
+        self.dimension = dimension
+        self.name = "hashing-v1"
+        self._term_vectors = OrderedDict()
+        self._lock = threading.Lock() # Batches are embedded on several ingestion threads
+
+    def _terms(self, text):
+        words = _WORD_RE.findall(text.lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def _term_vector(self, term):
+        vector = self._term_vectors.get(term)
+        if vector is None:
+            seed = int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+            self._term_vectors[term] = vector
+            if len(self._term_vectors) > HASHING_VECTOR_CACHE_SIZE:
+                self._term_vectors.popitem(last=False)
+        else:
+            self._term_vectors.move_to_end(term)
+        return vector
+
+    def embed(self, texts):
+        # Sparse (texts x terms) weight matrix times the (terms x dimension) projection
+        counts = [Counter(self._terms(text)) for text in texts]
+        vocabulary = {}
+        rows, cols, weights = [], [], []
+        for row, text_counts in enumerate(counts):
+            for term, count in text_counts.items():
+                rows.append(row)
+                cols.append(vocabulary.setdefault(term, len(vocabulary)))
+                weights.append(1.0 + math.log(count))
+        embeddings = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        if vocabulary:
+            weight_matrix = np.zeros((len(texts), len(vocabulary)), dtype=np.float32)
+            weight_matrix[rows, cols] = weights
+            with self._lock:
+                projection = np.stack([self._term_vector(term) for term in vocabulary])
+            embeddings = weight_matrix @ projection
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, 1e-12)
+
+class SentenceTransformerBackend(EmbeddingBackend):
+    """Embeddings from a local sentence-transformers model (requires the optional sentence-transformers package)."""
+    def __init__(self, model_name=LOCAL_EMBEDDING_MODEL, batch_size=LOCAL_EMBEDDING_BATCH_SIZE):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.batch_size = batch_size
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        self.name = f"st-{os.path.basename(model_name.rstrip('/'))}"
+        self.cache_namespace = f"sentence-transformers:{model_name}"
+
+    def embed(self, texts):
+        return np.asarray(self.model.encode(
+            list(texts), batch_size=self.batch_size, normalize_embeddings=True, convert_to_numpy=True
+        ), dtype=np.float32)
+
+def _create_azure_backend():
+    if not all([AZURE_OPENAI_API_KEY, AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_API_VERSION, AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME]):
+        print("Error: Missing Azure OpenAI embedding environment variables. Cannot create embedding function.")
+        return None
+    return AzureOpenAIBackend(deployment_name=AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME)
+
+def _create_sentence_transformer_backend():
+    try:
+        return SentenceTransformerBackend()
+    except ImportError:
+        print("Error: EMBEDDING_BACKEND=sentence-transformers requires the sentence-transformers package.")
+        return None
+    except Exception as e:
+        print(f"Error loading sentence-transformers model '{LOCAL_EMBEDDING_MODEL}': {e}")
+        return None
+
+# Registry of available backends; add new ones here
+EMBEDDING_BACKENDS = {
+    "azure": _create_azure_backend,
+    "hashing": HashingEmbeddingBackend,
+    "sentence-transformers": _create_sentence_transformer_backend,
+}
+
+def create_embedding_backend(name=EMBEDDING_BACKEND):
+    """Creates the named embedding backend, or returns None if it is unknown or cannot be configured."""
+    factory = EMBEDDING_BACKENDS.get(name)
+    if factory is None:
+        print(f"Error: Unknown EMBEDDING_BACKEND '{name}'. Choose one of: {', '.join(EMBEDDING_BACKENDS)}.")
+        return None
+    return factory()
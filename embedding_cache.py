@@ -0,0 +1,214 @@
+# embedding_cache.py
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+
+import numpy as np
+from dotenv import load_dotenv
+
+import telemetry
+
+load_dotenv()
+
+# Where cached vectors are stored and how large the cache may grow before LRU eviction kicks in
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "./embedding_cache")
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() != "false"
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+def normalize_text(text):
+    """Normalizes text before hashing so trivial whitespace/unicode differences share a cache entry."""
+    return _WHITESPACE_RE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+def make_cache_key(namespace, text):
+    """Builds the cache key from the embedding deployment (namespace) and the normalized text."""
+    payload = f"{namespace}\x00{normalize_text(text)}".encode('utf-8', errors='ignore')
+    return hashlib.sha256(payload).hexdigest()
+
+class EmbeddingCache:
+    """
+    Disk-backed, content-addressed embedding cache.
+    Vectors are stored as float32 rows in one memory-mapped file per dimension; a SQLite
+    index maps each key to its row and tracks last access for size-based LRU eviction.
+    """
+    def __init__(self, cache_dir=EMBEDDING_CACHE_DIR, max_bytes=EMBEDDING_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._maps = {}
+        os.makedirs(cache_dir, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(cache_dir, "index.sqlite3"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, dim INTEGER NOT NULL, slot INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries(last_access)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS free_slots (dim INTEGER NOT NULL, slot INTEGER NOT NULL)")
+        self._db.commit()
+        self._total_bytes = self._db.execute("SELECT COALESCE(SUM(dim * 4), 0) FROM entries").fetchone()[0]
+
+    def _vector_path(self, dim):
+        return os.path.join(self.cache_dir, f"vectors_{dim}.f32")
+
+    def _num_slots(self, dim):
+        path = self._vector_path(dim)
+        return os.path.getsize(path) // (dim * 4) if os.path.exists(path) else 0
+
+    def _read_slot(self, dim, slot):
+        vectors = self._maps.get(dim)
+        if vectors is None or slot >= vectors.shape[0]:
+            # The file grew since it was mapped; remap it
+            vectors = np.memmap(self._vector_path(dim), dtype=np.float32, mode='r').reshape(-1, dim)
+            self._maps[dim] = vectors
+        return np.array(vectors[slot])
+
+    def _write_slot(self, dim, slot, vector):
+        path = self._vector_path(dim)
+        mode = 'r+b' if os.path.exists(path) else 'w+b'
+        with open(path, mode) as f:
+            f.seek(slot * dim * 4)
+            f.write(np.asarray(vector, dtype=np.float32).tobytes())
+
+    def _allocate_slot(self, dim):
+        row = self._db.execute("SELECT rowid, slot FROM free_slots WHERE dim = ? LIMIT 1", (dim,)).fetchone()
+        if row:
+            self._db.execute("DELETE FROM free_slots WHERE rowid = ?", (row[0],))
+            return row[1]
+        return self._num_slots(dim)
+
+    def _evict_if_needed(self):
+        if self._total_bytes <= self.max_bytes:
+            return
+        # Evict down to 90% of the budget so we don't evict on every insert
+        target = int(self.max_bytes * 0.9)
+        rows = self._db.execute("SELECT key, dim, slot FROM entries ORDER BY last_access ASC")
+        evicted = []
+        for key, dim, slot in rows:
+            if self._total_bytes <= target:
+                break
+            evicted.append((key, dim, slot))
+            self._total_bytes -= dim * 4
+        self._db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _, _ in evicted])
+        self._db.executemany("INSERT INTO free_slots (dim, slot) VALUES (?, ?)", [(dim, slot) for _, dim, slot in evicted])
+        self.evictions += len(evicted)
+
+    def get_many(self, keys):
+        """Returns a list with the cached vector (np.float32 array) or None for every key."""
+        with self._lock:
+            results = []
+            found = []
+            for key in keys:
+                row = self._db.execute("SELECT dim, slot FROM entries WHERE key = ?", (key,)).fetchone()
+                if row:
+                    results.append(self._read_slot(row[0], row[1]))
+                    found.append(key)
+                    self.hits += 1
+                else:
+                    results.append(None)
+                    self.misses += 1
+            if found:
+                now = time.time()
+                self._db.executemany("UPDATE entries SET last_access = ? WHERE key = ?", [(now, key) for key in found])
+                self._db.commit()
+            return results
+
+    def put_many(self, keys, vectors):
+        """Stores vectors under their keys, evicting least recently used entries when over budget."""
+        with self._lock:
+            now = time.time()
+            for key, vector in zip(keys, vectors):
+                if self._db.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone():
+                    continue
+                dim = len(vector)
+                slot = self._allocate_slot(dim)
+                self._write_slot(dim, slot, vector)
+                self._db.execute(
+                    "INSERT INTO entries (key, dim, slot, last_access) VALUES (?, ?, ?, ?)",
+                    (key, dim, slot, now)
+                )
+                self._total_bytes += dim * 4
+            self._evict_if_needed()
+            self._db.commit()
+
+    def stats(self):
+        """Returns hit/miss counters and current size of the cache."""
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+def get_embedding_cache():
+    """Returns the process-wide embedding cache, or None if caching is disabled or unavailable."""
+    global _embedding_cache
+    if not EMBEDDING_CACHE_ENABLED:
+        return None
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            try:
+                _embedding_cache = EmbeddingCache()
+            except Exception as e:
+                print(f"Error initializing embedding cache in {EMBEDDING_CACHE_DIR}: {e}")
+                return None
+        return _embedding_cache
+
+def cached_embed(namespace, texts, embed_fn):
+    """
+    Embeds texts through the cache. Only texts that are not cached (deduplicated within
+    the batch) are passed to embed_fn in a single call; the results are stored for reuse.
+    Cache errors never fail the embedding itself.
+    """
+    cache = get_embedding_cache()
+    if cache is None:
+        return embed_fn(texts)
+
+    keys = [make_cache_key(namespace, text) for text in texts]
+    try:
+        cached = cache.get_many(keys)
+    except Exception as e:
+        print(f"Error reading embedding cache: {e}")
+        return embed_fn(texts)
+
+    missing = {}
+    num_misses = 0
+    for i, vector in enumerate(cached):
+        if vector is None:
+            num_misses += 1
+            if keys[i] not in missing:
+                missing[keys[i]] = texts[i]
+    telemetry.incr("rag_embedding_cache_hits_total", len(keys) - num_misses)
+    telemetry.incr("rag_embedding_cache_misses_total", num_misses)
+
+    computed = {}
+    if missing:
+        missing_keys = list(missing)
+        new_vectors = embed_fn([missing[key] for key in missing_keys])
+        computed = dict(zip(missing_keys, new_vectors))
+        try:
+            cache.put_many(missing_keys, new_vectors)
+        except Exception as e:
+            print(f"Error writing embedding cache: {e}")
+
+    return [
+        vector.tolist() if vector is not None else np.asarray(computed[key], dtype=np.float32).tolist()
+        for key, vector in zip(keys, cached)
+    ]
@@ -0,0 +1,235 @@
+# fake_azure_server.py
+"""
+A local stand-in for the Azure OpenAI REST API, for exercising the pipeline without
+network access or cost. Point AZURE_OPENAI_ENDPOINT at it (any API key/version works).
+
+Embeddings are deterministic: every word is hashed into a bucket of a fixed-size vector,
+so identical texts get identical vectors and texts sharing words are similar. Chat
+completions return a canned answer (with fenced code/test blocks when the prompt asks
+for them), either whole or streamed as server-sent events. The server can deliberately
+throttle (429 + Retry-After) every Nth request or whenever more than a given number of
+requests are in flight, add latency per request and per streamed token, and counts what
+it served so benchmarks can report it.
+"""
+import re
+import json
+import math
+import time
+import zlib
+import uuid
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+
+DEFAULT_EMBEDDING_DIM = 256
+
+_WORD_RE = re.compile(r"\w+")
+_DEPLOYMENT_PATH_RE = re.compile(r"^/openai/deployments/([^/]+)/(embeddings|chat/completions)$")
+_FENCE_RE = re.compile(r"```(\w+)")
+
+def fake_embedding(text, dim=DEFAULT_EMBEDDING_DIM):
+    """Deterministic, L2-normalized bag-of-hashed-words embedding."""
+    vector = [0.0] * dim
+    for word in _WORD_RE.findall(text.lower()):
+        h = zlib.crc32(word.encode('utf-8'))
+        vector[h % dim] += 1.0 if (h >> 16) & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+def fake_chat_answer(messages):
+    """Canned, deterministic answer; prompts containing a ```<language> fence get code and test blocks."""
+    prompt = messages[-1].get("content", "") if messages else ""
+    fence = _FENCE_RE.search(prompt)
+    if fence:
+        language = fence.group(1)
+        return (
+            f"Here is the fix:\n```{language}\ndef solution(value):\n    return value\n```\n\n"
+            f"And the test:\n```{language}\ndef test_solution():\n    assert solution(1) == 1\n```\n"
+        )
+    return f"This is a stubbed answer to a prompt of {len(_WORD_RE.findall(prompt))} words."
+
+class FakeAzureState:
+    """Configuration and counters shared by all request handlers of one server."""
+    def __init__(self, embedding_dim=DEFAULT_EMBEDDING_DIM, latency=0.0, throttle_every=0, retry_after=1,
+                 max_concurrent=0, token_latency=0.0):
+        self.embedding_dim = embedding_dim
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.max_concurrent = max_concurrent # 0 = unlimited
+        self.token_latency = token_latency # Seconds between streamed chat chunks
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.embedded_texts = 0
+        self.chat_completions = 0
+
+    def next_request_throttled(self):
+        """Counts a new request and decides whether to throttle it; non-throttled requests must call request_done()."""
+        with self.lock:
+            self.requests += 1
+            throttled = (bool(self.throttle_every) and self.requests % self.throttle_every == 0) or \
+                (bool(self.max_concurrent) and self.in_flight >= self.max_concurrent)
+            if throttled:
+                self.throttled += 1
+            else:
+                self.in_flight += 1
+                self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            return throttled
+
+    def request_done(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def snapshot(self):
+        """The counters as a dict, e.g. for benchmark reports."""
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "peak_in_flight": self.peak_in_flight,
+                "embedded_texts": self.embedded_texts,
+                "chat_completions": self.chat_completions,
+            }
+
+class FakeAzureHandler(BaseHTTPRequestHandler):
+    state = None # Set per server by run_fake_server
+
+    def log_message(self, format, *args):
+        pass # Keep benchmark/test output quiet
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        match = _DEPLOYMENT_PATH_RE.match(urlparse(self.path).path)
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not match:
+            self._send_json(404, {"error": {"code": "404", "message": f"Unknown path {self.path}"}})
+            return
+
+        if self.state.next_request_throttled():
+            self._send_json(
+                429,
+                {"error": {"code": "429", "message": "Requests to the deployment have exceeded the rate limit."}},
+                headers={"Retry-After": str(self.state.retry_after)}
+            )
+            return
+
+        deployment, operation = match.groups()
+        try:
+            if self.state.latency:
+                time.sleep(self.state.latency)
+            if operation == "embeddings":
+                self._handle_embeddings(deployment, request)
+            else:
+                self._handle_chat(deployment, request)
+        finally:
+            self.state.request_done()
+
+    def _handle_embeddings(self, deployment, request):
+        texts = request.get("input", [])
+        if isinstance(texts, str):
+            texts = [texts]
+        with self.state.lock:
+            self.state.embedded_texts += len(texts)
+        data = [
+            {"object": "embedding", "index": i, "embedding": fake_embedding(text, self.state.embedding_dim)}
+            for i, text in enumerate(texts)
+        ]
+        tokens = sum(len(_WORD_RE.findall(text)) for text in texts)
+        self._send_json(200, {
+            "object": "list",
+            "data": data,
+            "model": deployment,
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+        })
+
+    def _handle_chat(self, deployment, request):
+        with self.state.lock:
+            self.state.chat_completions += 1
+        answer = fake_chat_answer(request.get("messages", []))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        completion_tokens = len(_WORD_RE.findall(answer))
+        if not request.get("stream"):
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": deployment,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": completion_tokens, "total_tokens": completion_tokens}
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        pieces = re.findall(r"\S+\s*|\s+", answer)
+        try:
+            for i, piece in enumerate(pieces + [None]):
+                choice = {"index": 0, "delta": {}, "finish_reason": "stop"} if piece is None else \
+                    {"index": 0, "delta": {"role": "assistant", "content": piece} if i == 0 else {"content": piece}, "finish_reason": None}
+                chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                         "model": deployment, "choices": [choice]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+                if self.state.token_latency and piece is not None:
+                    time.sleep(self.state.token_latency)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass # The client closed the stream early
+
+def run_fake_server(host="127.0.0.1", port=0, **config):
+    """
+    Starts the fake server on a background thread and returns (server, state).
+    Use port=0 to pick a free port; the endpoint is f"http://{host}:{server.server_port}".
+    Call server.shutdown() to stop it.
+    """
+    state = FakeAzureState(**config)
+    handler = type("BoundFakeAzureHandler", (FakeAzureHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local fake Azure OpenAI server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--embedding-dim", type=int, default=DEFAULT_EMBEDDING_DIM)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request.")
+    parser.add_argument("--throttle-every", type=int, default=0, help="Answer every Nth request with 429.")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s.")
+    parser.add_argument("--max-concurrent", type=int, default=0, help="Answer requests beyond this many in flight with 429.")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Seconds between streamed chat chunks.")
+    args = parser.parse_args()
+
+    server, _ = run_fake_server(
+        args.host, args.port,
+        embedding_dim=args.embedding_dim,
+        latency=args.latency,
+        throttle_every=args.throttle_every,
+        retry_after=args.retry_after,
+        max_concurrent=args.max_concurrent,
+        token_latency=args.token_latency
+    )
+    print(f"Fake Azure OpenAI server listening on http://{args.host}:{server.server_port}. Press Ctrl+C to stop.")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,382 @@
+# indexer.py
+import os
+import json
+import time
+import hashlib
+import threading
+
+from chromadb_utils import (add_documents_to_chroma, delete_documents_from_chroma, update_chunk_sources,
+                            get_bm25_index, rebuild_bm25_index, CHROMA_DB_PERSIST_DIR)
+from document_processor import iter_file_segments, extract_files_parallel
+from chunker import get_chunker, CHUNKER, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS
+from dedup import MinHashDeduplicator, DEDUP_ENABLED, DEDUP_THRESHOLD
+import telemetry
+
+# Define the local directory where your documents are stored
+LOCAL_DOCS_PATH = "my_local_documents" # <--- IMPORTANT: Change this to your desired folder path
+
+# The manifest lives next to the ChromaDB data so that wiping one always wipes the other
+MANIFEST_PATH = os.path.join(CHROMA_DB_PERSIST_DIR, "index_manifest.json")
+MANIFEST_VERSION = 1
+
+# Number of processes used to extract document text (PDF parsing is CPU-bound)
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", str(os.cpu_count() or 1)))
+
+# Chunks are handed to ChromaDB in groups of this size, so huge files never sit in memory whole
+INDEX_FLUSH_CHUNKS = 1024
+
+TEXT_MIME_TYPE = "text/plain"
+
+# Recorded in the manifest; changing the chunking or deduplication settings re-indexes every document
+INDEX_CONFIG = (f"{CHUNKER}:{CHUNK_MAX_TOKENS}:{CHUNK_OVERLAP_TOKENS}:"
+                f"dedup={DEDUP_THRESHOLD if DEDUP_ENABLED else 'off'}")
+
+# Name of the near-duplicate detection state, stored next to the manifest
+DEDUP_STATE_FILENAME = "dedup_state.json"
+
+# The manifest and deduplication state are saved together at most this often while files are
+# indexed, and once at the end of the run; files indexed since the last save are re-indexed
+# if the run is interrupted
+INDEX_CHECKPOINT_SECONDS = float(os.getenv("INDEX_CHECKPOINT_SECONDS", "30"))
+
+# Indexing runs (start-up, /ingest, the document watcher) share the manifest, so they take turns
+_index_lock = threading.Lock()
+
+# --- Helper to determine MIME type from extension (simplified for local files) ---
+def get_mime_type_from_filename(filename):
+    """Simple heuristic to get MIME type based on file extension."""
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == ".txt":
+        return "text/plain"
+    elif ext == ".pdf":
+        return "application/pdf"
+    elif ext == ".docx":
+        return "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+    # Add more as needed
+    return "application/octet-stream" # Default for unknown types
+
+def compute_file_hash(filepath, block_size=1024 * 1024):
+    """Returns the SHA-256 hex digest of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def make_chunk_id(source, chunk_idx, chunk):
+    """
+    Builds a deterministic chunk ID from the source file and the chunk content.
+    The chunk index is included so that repeated text within one file stays unique.
+    """
+    chunk_hash = hashlib.sha256(chunk.encode('utf-8', errors='ignore')).hexdigest()[:16]
+    return f"{source}:{chunk_idx}:{chunk_hash}"
+
+def load_manifest(path=MANIFEST_PATH):
+    """Loads the indexing manifest, returning an empty one if it is missing or unreadable."""
+    empty = {"version": MANIFEST_VERSION, "files": {}}
+    if not os.path.exists(path):
+        return empty
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get("version") != MANIFEST_VERSION:
+            print(f"Manifest version mismatch in '{path}'. Rebuilding the index manifest.")
+            return empty
+        return manifest
+    except Exception as e:
+        print(f"Error reading manifest {path}: {e}")
+        return empty
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    """Atomically writes the indexing manifest to disk."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def scan_documents(docs_path=LOCAL_DOCS_PATH):
+    """Returns {filename: {"size": ..., "mtime_ns": ...}} for the regular files in docs_path."""
+    files = {}
+    with os.scandir(docs_path) as entries:
+        for entry in entries:
+            # Skip directories and non-files
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            files[entry.name] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    return files
+
+def diff_documents(manifest_files, current_files, docs_path=LOCAL_DOCS_PATH):
+    """
+    Compares the manifest with the files currently on disk.
+    Files whose size and mtime are unchanged are trusted without hashing; otherwise the
+    content hash decides whether the file really changed (e.g. after a 'touch').
+    Returns (added, modified, removed, touched), where touched maps filenames whose
+    content is unchanged to their refreshed manifest entries.
+    """
+    added, modified, touched = [], [], {}
+    for filename, stat in current_files.items():
+        previous = manifest_files.get(filename)
+        if previous is None:
+            added.append(filename)
+            continue
+        if previous.get("size") == stat["size"] and previous.get("mtime_ns") == stat["mtime_ns"]:
+            continue
+        file_hash = compute_file_hash(os.path.join(docs_path, filename))
+        if file_hash == previous.get("sha256"):
+            touched[filename] = dict(previous, **stat)
+        else:
+            modified.append(filename)
+    removed = [filename for filename in manifest_files if filename not in current_files]
+    return sorted(added), sorted(modified), sorted(removed), touched
+
+def load_deduplicator(path):
+    """Returns the near-duplicate detector with its saved state, or None if deduplication is disabled."""
+    if not DEDUP_ENABLED:
+        return None
+    deduplicator = MinHashDeduplicator()
+    deduplicator.load(path)
+    return deduplicator
+
+def remove_file_from_index(chroma_collection, filename, deduplicator=None):
+    """
+    Deletes the chunks of a file from ChromaDB and from the deduplication state.
+    Returns (ok, orphaned_sources): sources whose content was only indexed as a merged
+    near-duplicate of one of the deleted chunks, which therefore have to be re-indexed.
+    """
+    if not delete_documents_from_chroma(chroma_collection, filename):
+        return False, set()
+    if deduplicator is None:
+        return True, set()
+    orphaned, updated_ids = deduplicator.remove_source(filename)
+    update_chunk_sources(chroma_collection, {chunk_id: deduplicator.sources_of(chunk_id) for chunk_id in updated_ids})
+    return True, orphaned
+
+def sync_bm25_index(chroma_collection, manifest_files):
+    """
+    Rebuilds the BM25 index from ChromaDB if it does not cover exactly the files the
+    manifest records as indexed (e.g. it is missing, or a run was interrupted before saving it).
+    """
+    indexed_sources = {filename for filename, entry in manifest_files.items() if entry.get("chunks")}
+    if get_bm25_index().sources() != indexed_sources:
+        print("BM25 index is missing or out of date. Rebuilding it from ChromaDB.")
+        rebuild_bm25_index(chroma_collection)
+
+def index_file(chroma_collection, filename, docs_path=LOCAL_DOCS_PATH, deduplicator=None):
+    """
+    Streams a single file through extraction, chunking and ChromaDB without loading it whole.
+    Returns the number of chunks indexed, or None if indexing failed.
+    """
+    filepath = os.path.join(docs_path, filename)
+    print(f"Processing '{filename}'...")
+    segments = iter_file_segments(filepath, get_mime_type_from_filename(filename))
+    return index_segments(chroma_collection, filename, segments, deduplicator)
+
+@telemetry.traced("index_file")
+def index_segments(chroma_collection, filename, segments, deduplicator=None):
+    """
+    Chunks the (page, text) segments of one file and adds them to ChromaDB in groups of
+    INDEX_FLUSH_CHUNKS. Chunk metadata carries the source, chunk index and whatever the
+    chunker records (page, character offsets, token count). With a deduplicator,
+    near-duplicates of already indexed chunks are not embedded; the surviving chunk's
+    'sources' metadata lists this file instead.
+    Returns the number of chunks indexed, or None if the content could not be extracted
+    (segments is None) or adding any group to ChromaDB failed, so the file is retried.
+    """
+    if segments is None:
+        print(f"Could not extract content from '{filename}'.")
+        return None
+
+    documents_to_add = []
+    metadatas_to_add = []
+    ids_to_add = []
+    num_chunks = 0
+    num_skipped = 0
+    failed = False
+
+    def flush():
+        nonlocal num_skipped
+        documents, metadatas, ids = documents_to_add, metadatas_to_add, ids_to_add
+        merged_ids = ()
+        if deduplicator is not None:
+            with telemetry.span("dedup", chunks=len(ids)):
+                kept, merged_ids = deduplicator.filter_chunks(ids, documents, metadatas)
+            num_skipped += len(ids) - len(kept)
+            documents = [documents[i] for i in kept]
+            metadatas = [metadatas[i] for i in kept]
+            ids = [ids[i] for i in kept]
+        ok = not documents or add_documents_to_chroma(chroma_collection, documents, metadatas, ids)
+        if merged_ids:
+            update_chunk_sources(chroma_collection, {chunk_id: deduplicator.sources_of(chunk_id) for chunk_id in merged_ids})
+        documents_to_add.clear()
+        metadatas_to_add.clear()
+        ids_to_add.clear()
+        return ok
+
+    # Time spent chunking, excluding the flushes; streamed files are read lazily, so it includes their reading
+    chunk_time = 0.0
+    start_time = time.perf_counter()
+    for i, (chunk, chunk_metadata) in enumerate(get_chunker()(segments)):
+        documents_to_add.append(chunk)
+        metadatas_to_add.append(dict(chunk_metadata, source=filename, chunk_idx=i))
+        ids_to_add.append(make_chunk_id(filename, i, chunk))
+        num_chunks += 1
+        if len(documents_to_add) >= INDEX_FLUSH_CHUNKS:
+            chunk_time += time.perf_counter() - start_time
+            if not flush():
+                failed = True
+            start_time = time.perf_counter()
+    chunk_time += time.perf_counter() - start_time
+    telemetry.record("chunk", chunk_time, file=filename, chunks=num_chunks)
+    if documents_to_add and not flush():
+        failed = True
+
+    if not num_chunks:
+        print(f"Warning: No content or chunks extracted from '{filename}'. Skipping.")
+        return 0
+    if failed:
+        return None
+    if num_skipped:
+        print(f"Processed '{filename}' into {num_chunks} chunks ({num_skipped} near-duplicates not embedded).")
+    else:
+        print(f"Processed '{filename}' into {num_chunks} chunks.")
+    return num_chunks - num_skipped
+
+@telemetry.traced("ingest")
+def prepare_and_index_documents(chroma_collection, docs_path=LOCAL_DOCS_PATH, manifest_path=MANIFEST_PATH,
+                                filenames=None):
+    """
+    Incrementally indexes LOCAL_DOCS_PATH into ChromaDB.
+    Only added or changed files are read, chunked and embedded; the chunks of removed or
+    modified files are deleted by their 'source' metadata. A manifest of path, size, mtime
+    and content hash records what is already indexed, so a restart with an unchanged
+    corpus makes no embedding calls at all. Near-duplicate chunks are detected across
+    files and runs and embedded only once. A BM25 index over the same chunks is kept in
+    step for lexical and hybrid retrieval.
+    With filenames, only those files are compared with the manifest (e.g. the ones a
+    file watcher saw change). Concurrent calls run one after the other.
+    Returns the number of chunks indexed by this run.
+    """
+    with _index_lock:
+        return _index_documents(chroma_collection, docs_path, manifest_path, filenames)
+
+def _index_documents(chroma_collection, docs_path, manifest_path, filenames):
+    print(f"\n--- Preparing and Indexing Documents from '{docs_path}' ---")
+    manifest = load_manifest(manifest_path)
+    manifest_files = manifest["files"]
+    current_files = scan_documents(docs_path)
+    dedup_path = os.path.join(os.path.dirname(manifest_path), DEDUP_STATE_FILENAME)
+
+    # The collection name records the embedding backend and dimension (see get_collection_name)
+    if manifest.get("index_config") != INDEX_CONFIG or manifest.get("collection") != chroma_collection.name:
+        if manifest_files:
+            print(f"Indexing settings changed to '{INDEX_CONFIG}' in collection '{chroma_collection.name}'. "
+                  "All documents will be re-indexed.")
+            # Forget size/mtime/hash so every indexed file is treated as modified
+            for entry in manifest_files.values():
+                entry.update(size=None, mtime_ns=None, sha256=None)
+        manifest["index_config"] = INDEX_CONFIG
+        manifest["collection"] = chroma_collection.name
+
+    sync_bm25_index(chroma_collection, manifest_files)
+    if filenames is None:
+        added, modified, removed, touched = diff_documents(manifest_files, current_files, docs_path)
+    else:
+        # current_files stays complete: files orphaned by a removal below are re-indexed too
+        scope = set(filenames)
+        added, modified, removed, touched = diff_documents(
+            {filename: entry for filename, entry in manifest_files.items() if filename in scope},
+            {filename: stat for filename, stat in current_files.items() if filename in scope}, docs_path)
+
+    if touched:
+        # Content is unchanged, only refresh size/mtime so the next run skips hashing
+        manifest_files.update(touched)
+        save_manifest(manifest, manifest_path)
+
+    if not (added or modified or removed):
+        total_chunks = sum(entry.get("chunks", 0) for entry in manifest_files.values())
+        print(f"Index is up to date ({len(manifest_files)} files, {total_chunks} chunks). Nothing to embed.")
+        return 0
+
+    print(f"Changes detected: {len(added)} added, {len(modified)} modified, {len(removed)} removed.")
+    deduplicator = load_deduplicator(dedup_path)
+
+    # Clear old chunks of every changed file (added ones too, in case an earlier run failed
+    # half-way). Removing a chunk that absorbed near-duplicates of other files orphans
+    # those files, so they are cleared and re-indexed as well.
+    pending = removed + modified + added
+    cleared = set()
+    while pending:
+        filename = pending.pop(0)
+        if filename in cleared:
+            continue
+        ok, orphaned = remove_file_from_index(chroma_collection, filename, deduplicator)
+        if not ok:
+            print(f"Could not remove stale chunks of '{filename}'. It will be retried on the next run.")
+            continue
+        cleared.add(filename)
+        manifest_files.pop(filename, None)
+        for source in sorted(orphaned - cleared):
+            if source in current_files:
+                print(f"'{source}' shared content with '{filename}' and will be re-indexed.")
+                pending.append(source)
+    save_manifest(manifest, manifest_path)
+    if deduplicator is not None:
+        deduplicator.save(dedup_path)
+    get_bm25_index().save()
+
+    # Files that could not be cleared above keep their manifest entry; don't index on top of them
+    to_index = sorted(filename for filename in cleared if filename in current_files)
+    # Hash before extraction so a file changing mid-run is picked up again next time
+    file_hashes = {filename: compute_file_hash(os.path.join(docs_path, filename)) for filename in to_index}
+    # Plain text is I/O-bound and is streamed in this process; shipping a multi-GB string
+    # back from a worker process would defeat the streaming readers
+    text_files = [filename for filename in to_index if get_mime_type_from_filename(filename) == TEXT_MIME_TYPE]
+    pool_files = [(os.path.join(docs_path, filename), get_mime_type_from_filename(filename))
+                  for filename in to_index if filename not in text_files]
+
+    last_checkpoint = time.monotonic()
+
+    def checkpoint(force=False):
+        """Saves the manifest with the deduplication state it matches, at most every INDEX_CHECKPOINT_SECONDS."""
+        nonlocal last_checkpoint
+        if not force and time.monotonic() - last_checkpoint < INDEX_CHECKPOINT_SECONDS:
+            return
+        if deduplicator is not None:
+            deduplicator.save(dedup_path)
+        save_manifest(manifest, manifest_path)
+        last_checkpoint = time.monotonic()
+
+    def record(filename, num_chunks):
+        if num_chunks is None:
+            print(f"Failed to index '{filename}'. It will be retried on the next run.")
+            return 0
+        manifest_files[filename] = dict(current_files[filename], sha256=file_hashes[filename], chunks=num_chunks)
+        checkpoint()
+        return num_chunks
+
+    indexed_chunks = 0
+    try:
+        # Other files are extracted on a process pool and chunked/embedded as soon as each one completes
+        for filepath, segments in extract_files_parallel(pool_files, max_workers=EXTRACTION_WORKERS):
+            filename = os.path.basename(filepath)
+            print(f"Extracted '{filename}'.")
+            indexed_chunks += record(filename, index_segments(chroma_collection, filename, segments, deduplicator))
+
+        for filename in text_files:
+            indexed_chunks += record(filename, index_file(chroma_collection, filename, docs_path, deduplicator))
+    finally:
+        checkpoint(force=True)
+
+    # Compacts the incremental BM25 additions into the memory-mapped on-disk index
+    get_bm25_index().save()
+
+    if indexed_chunks:
+        print(f"\nSuccessfully indexed {indexed_chunks} document chunks.")
+    else:
+        print("No new processable documents found in the directory to add to the knowledge base.")
+    if deduplicator is not None and deduplicator.skipped_this_run:
+        print(f"Deduplication skipped {deduplicator.skipped_this_run} near-duplicate chunks this run "
+              f"({deduplicator.saved_embeddings} embeddings saved in total).")
+    return indexed_chunks
@@ -0,0 +1,136 @@
+# ingestion_engine.py
+import os
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+import telemetry
+from token_utils import count_tokens_batch
+
+load_dotenv()
+
+# Azure OpenAI accepts at most 2048 inputs per embedding request; the token budget keeps
+# requests well under the per-request limit and spreads load over the worker pool.
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "50000"))
+EMBEDDING_BATCH_MAX_ITEMS = int(os.getenv("EMBEDDING_BATCH_MAX_ITEMS", "256"))
+EMBEDDING_MAX_WORKERS = int(os.getenv("EMBEDDING_MAX_WORKERS", "4"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))
+RETRY_BASE_DELAY = 1.0 # Seconds; doubled on every attempt
+RETRY_MAX_DELAY = 60.0
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# Guards the retry counts of stats dicts shared by worker threads
+_stats_lock = threading.Lock()
+
+def make_batches(documents, max_batch_tokens=EMBEDDING_BATCH_MAX_TOKENS, max_batch_items=EMBEDDING_BATCH_MAX_ITEMS):
+    """
+    Splits documents into contiguous (start, end) index ranges whose token count stays
+    within max_batch_tokens. A single document larger than the budget gets its own batch.
+    """
+    batches = []
+    start = 0
+    batch_tokens = 0
+    for i, tokens in enumerate(count_tokens_batch(documents)):
+        if i > start and (batch_tokens + tokens > max_batch_tokens or i - start >= max_batch_items):
+            batches.append((start, i))
+            start = i
+            batch_tokens = 0
+        batch_tokens += tokens
+    if start < len(documents):
+        batches.append((start, len(documents)))
+    return batches
+
+def get_retry_after(error):
+    """Returns the server's Retry-After hint in seconds for an API error, if it sent one."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        # Retry-After can also be an HTTP date; fall back to exponential backoff
+        return None
+    return None
+
+def is_retryable_error(error):
+    """Throttling, timeouts, connection errors and 5xx responses are worth retrying."""
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+def call_with_retry(fn, *args, max_retries=EMBEDDING_MAX_RETRIES, base_delay=RETRY_BASE_DELAY,
+                    max_delay=RETRY_MAX_DELAY, stats=None):
+    """
+    Calls fn(*args), retrying retryable errors with jittered exponential backoff.
+    A 429 Retry-After hint from the server takes precedence over the computed delay.
+    The number of retries is accumulated in stats["retries"] when a dict is given; the dict
+    may be shared by several threads. fn should not retry itself (e.g. an OpenAI client
+    created with max_retries=0), or every attempt here makes several requests.
+    """
+    attempt = 0
+    while True:
+        try:
+            return fn(*args)
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable_error(e):
+                raise
+            delay = get_retry_after(e)
+            if delay is None:
+                delay = min(max_delay, base_delay * (2 ** attempt)) * random.uniform(0.5, 1.0)
+            attempt += 1
+            if stats is not None:
+                with _stats_lock:
+                    stats["retries"] = stats.get("retries", 0) + 1
+            telemetry.incr("rag_retries_total", error=e.__class__.__name__)
+            print(f"Retryable error ({e.__class__.__name__}), retry {attempt}/{max_retries} in {delay:.1f}s.")
+            time.sleep(delay)
+
+def ingest_documents(collection, embedding_function, documents, metadatas, ids,
+                     max_workers=EMBEDDING_MAX_WORKERS, max_batch_tokens=EMBEDDING_BATCH_MAX_TOKENS,
+                     max_batch_items=EMBEDDING_BATCH_MAX_ITEMS, max_retries=EMBEDDING_MAX_RETRIES):
+    """
+    Embeds documents in token-budgeted batches on a bounded worker pool and upserts every
+    batch into the collection as soon as its embeddings arrive, so one throttled or failed
+    batch does not lose the others.
+    Returns a summary dict with batch, document and retry counts.
+    """
+    batches = make_batches(documents, max_batch_tokens, max_batch_items)
+    # Retries happen in call_with_retry, which counts them and honours Retry-After
+    if hasattr(embedding_function, "without_client_retries"):
+        embedding_function = embedding_function.without_client_retries()
+    summary = {"batches": len(batches), "failed_batches": 0, "documents_added": 0, "retries": 0}
+    if not batches:
+        return summary
+
+    def embed_batch(start, end):
+        return call_with_retry(embedding_function, documents[start:end], max_retries=max_retries, stats=summary)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as executor:
+        futures = {executor.submit(embed_batch, start, end): (start, end) for start, end in batches}
+        for future in as_completed(futures):
+            start, end = futures[future]
+            try:
+                embeddings = future.result()
+                # Upserts happen on this thread only, so ChromaDB writes are never concurrent
+                with telemetry.span("chroma_upsert", documents=end - start):
+                    collection.upsert(
+                        ids=ids[start:end],
+                        embeddings=embeddings,
+                        documents=documents[start:end],
+                        metadatas=metadatas[start:end]
+                    )
+                summary["documents_added"] += end - start
+                telemetry.incr("rag_chroma_upserted_documents_total", end - start)
+            except Exception as e:
+                summary["failed_batches"] += 1
+                print(f"Error ingesting batch of documents {start}-{end}: {e}")
+    return summary
@@ -1,87 +1,144 @@
 import os
-from openai import AzureOpenAI # Import AzureOpenAI instead of OpenAI
 from dotenv import load_dotenv
-import re
+from openai_utils import get_openai_client, stream_chat_completion
 
 load_dotenv()
 
 # Azure OpenAI Specific Configuration
-AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
-AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
-AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION")
 AZURE_OPENAI_DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME") # This is your deployment name
 
+# Bump whenever the prompt below changes: cached batch results (batch_codegen.py) are keyed by it
+CODEGEN_PROMPT_TEMPLATE_VERSION = 2
+CODEGEN_SYSTEM_MESSAGE = "You are a helpful AI assistant that generates code and tests."
+# The instructions come first and the ticket last, so requests share the longest possible prefix
+CODEGEN_PROMPT_TEMPLATE = """You are an expert software engineer. Given the following problem description from a support ticket,
+generate a code snippet in {language} that fixes the described bug or implements the requested feature,
+and a corresponding unit test using Pytest.
+
+Please ensure the code is clean, concise, and directly addresses the problem.
+The unit test should cover the fix/feature and ideally include edge cases.
+
+Provide the code snippet first, enclosed in a ```{language} block,
+followed by the test code, enclosed in a ```{language} block.
+
+Example format:
+```{language}
+# Your code fix here
+```
+
+```{language}
+# Your test code here (using pytest)
+```
+
+Problem Description (from Jira ticket):
+---
+{description}
+---
+"""
+CODEGEN_TEMPERATURE = 0.7 # Adjust for creativity vs. consistency
+CODEGEN_MAX_TOKENS = 1500 # Adjust based on expected code length
+
 def get_llm_client():
-    """Initializes and returns an Azure OpenAI client."""
-    if not all([AZURE_OPENAI_API_KEY, AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_API_VERSION, AZURE_OPENAI_DEPLOYMENT_NAME]):
+    """Returns the Azure OpenAI client shared with the RAG pipeline (see openai_utils.get_openai_client)."""
+    if not AZURE_OPENAI_DEPLOYMENT_NAME:
         print("Error: Missing one or more Azure OpenAI environment variables. Please check your .env file.")
         return None
-    try:
-        # Initialize AzureOpenAI client
-        client = AzureOpenAI(
-            api_key=AZURE_OPENAI_API_KEY,
-            azure_endpoint=AZURE_OPENAI_ENDPOINT,
-            api_version=AZURE_OPENAI_API_VERSION
-        )
-        print(f"Initialized Azure OpenAI client with deployment: {AZURE_OPENAI_DEPLOYMENT_NAME}")
-        return client
-    except Exception as e:
-        print(f"Error initializing Azure OpenAI client: {e}")
-        return None
-
-def generate_code_and_tests(llm_client, problem_description, programming_language="python"):
+    client = get_openai_client()
+    if client is not None:
+        print(f"Using Azure OpenAI deployment: {AZURE_OPENAI_DEPLOYMENT_NAME}")
+    return client
+
+def build_codegen_messages(problem_description, programming_language="python"):
+    """Builds the chat messages asking for a code fix and its Pytest test (template CODEGEN_PROMPT_TEMPLATE_VERSION)."""
+    return [
+        {"role": "system", "content": CODEGEN_SYSTEM_MESSAGE},
+        {"role": "user", "content": CODEGEN_PROMPT_TEMPLATE.format(language=programming_language,
+                                                                   description=problem_description.strip())}
+    ]
+
+class CodeBlockExtractor:
+    """
+    Incrementally extracts ```<language> fenced blocks from streamed LLM output.
+    Each feed() only scans the newly arrived text (plus a fence-length overlap), so
+    extraction stays linear in the response length.
+    """
+    def __init__(self, programming_language):
+        self.fence = f"```{programming_language}\n"
+        self.text = ""
+        self.blocks = []
+        self._search_from = 0 # Where to look for the next opening fence
+        self._content_start = None # Start of the currently open block's content
+        self._close_from = 0 # Where to look for the closing fence
+
+    def feed(self, delta):
+        """Adds streamed text and returns the list of blocks completed so far."""
+        self.text += delta
+        while True:
+            if self._content_start is None:
+                start = self.text.find(self.fence, self._search_from)
+                if start < 0:
+                    # Keep a fence-length tail so a fence split across deltas is still found
+                    self._search_from = max(self._search_from, len(self.text) - len(self.fence) + 1)
+                    return self.blocks
+                self._content_start = start + len(self.fence)
+                self._close_from = self._content_start
+            end = self.text.find("```", self._close_from)
+            if end < 0:
+                self._close_from = max(self._close_from, len(self.text) - 2)
+                return self.blocks
+            self.blocks.append(self.text[self._content_start:end].strip())
+            self._search_from = end + 3
+            self._content_start = None
+
+def extract_code_and_test(response_content, programming_language="python"):
+    """Returns (code, test): the first two ```<language> blocks of a response, "" for a missing one."""
+    blocks = CodeBlockExtractor(programming_language).feed(response_content)
+    return (blocks[0] if blocks else ""), (blocks[1] if len(blocks) > 1 else "")
+
+def generate_code_and_tests(llm_client, problem_description, programming_language="python", stream=True, stats=None):
     """
     Generates code and tests using the LLM based on a problem description.
     This simulates the Copilot's code generation capability.
+    With stream=True the response is streamed and the code/test blocks are extracted as
+    they arrive; the stream is closed as soon as both blocks are complete. Timing and
+    token counts are recorded in stats if a dict is given.
     """
-    prompt = f"""
-    You are an expert software engineer. Given the following problem description from a support ticket,
-    generate a code snippet in {programming_language} that fixes the described bug or implements the requested feature,
-    and a corresponding unit test using Pytest.
-
-    Problem Description (from Jira ticket):
-    ---
-    {problem_description}
-    ---
-
-    Please ensure the code is clean, concise, and directly addresses the problem.
-    The unit test should cover the fix/feature and ideally include edge cases.
-
-    Provide the code snippet first, enclosed in a ```{programming_language} block,
-    followed by the test code, enclosed in a ```{programming_language} block.
-
-    Example format:
-    ```{programming_language}
-    # Your code fix here
-    ```
-
-    ```{programming_language}
-    # Your test code here (using pytest)
-    ```
-    """
+    messages = build_codegen_messages(problem_description, programming_language)
+
+    if stream:
+        stats = {} if stats is None else stats
+        extractor = CodeBlockExtractor(programming_language)
+        deltas = stream_chat_completion(llm_client, messages, temperature=CODEGEN_TEMPERATURE,
+                                        max_tokens=CODEGEN_MAX_TOKENS, stats=stats)
+        for delta in deltas:
+            if len(extractor.feed(delta)) >= 2:
+                deltas.close() # Both blocks are complete; stop generating the rest
+                break
+        if not extractor.text:
+            return None, None
+        if stats.get("error") and len(extractor.blocks) < 2:
+            print("Error: The LLM response stream was interrupted before the code and test were complete.")
+            return None, None
+        print("LLM generated response.")
+        generated_code = extractor.blocks[0] if extractor.blocks else ""
+        generated_test = extractor.blocks[1] if len(extractor.blocks) > 1 else ""
+        if not generated_code and not generated_test:
+            print("Warning: Could not extract code or test from LLM response.")
+            print(f"Full LLM response: {extractor.text}")
+        return generated_code, generated_test
 
     try:
         chat_completion = llm_client.chat.completions.create(
             # For Azure OpenAI, you use the deployment_name here
             model=AZURE_OPENAI_DEPLOYMENT_NAME,
-            messages=[
-                {"role": "system", "content": "You are a helpful AI assistant that generates code and tests."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7, # Adjust for creativity vs. consistency
-            max_tokens=1500 # Adjust based on expected code length
+            messages=messages,
+            temperature=CODEGEN_TEMPERATURE,
+            max_tokens=CODEGEN_MAX_TOKENS
         )
         response_content = chat_completion.choices[0].message.content
         print("LLM generated response.")
 
-        # Extract code and test using regex
-        code_match = re.search(r"```" + programming_language + r"\n(.*?)```", response_content, re.DOTALL)
-        # Ensure the second regex search starts after the first code block to correctly find the test block
-        test_match = re.search(r"```" + programming_language + r"\n(.*?)```", response_content[code_match.end():] if code_match else response_content, re.DOTALL)
-
-
-        generated_code = code_match.group(1).strip() if code_match else ""
-        generated_test = test_match.group(1).strip() if test_match else ""
+        generated_code, generated_test = extract_code_and_test(response_content, programming_language)
 
         if not generated_code and not generated_test:
             print("Warning: Could not extract code or test from LLM response.")
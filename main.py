@@ -1,98 +1,101 @@
 import os
-import uuid # For generating unique IDs for chunks
+import time
 import shutil # For clearing the ChromaDB data directory
+import threading
 
-from openai_utils import get_openai_client, get_embedding, get_chat_completion
-from chromadb_utils import get_chroma_collection, add_documents_to_chroma, query_chroma, clear_chroma_collection, CHROMA_DB_PERSIST_DIR
-from document_processor import chunk_text, get_file_content # Assuming you'll adapt this for your document source
+from openai_utils import (get_openai_client, get_chat_completion, stream_chat_completion, is_openai_configured,
+                          preload_openai)
+from chromadb_utils import get_chroma_collection, embed_query, query_chroma, get_index_generation, CHROMA_DB_PERSIST_DIR
+from indexer import LOCAL_DOCS_PATH, prepare_and_index_documents
+from document_watcher import DocumentWatcher, WATCH_DOCUMENTS
+from context_packer import pack_context, CONTEXT_PACKING_ENABLED
+from semantic_cache import SemanticAnswerCache, SEMANTIC_CACHE_ENABLED
+from rag_prompts import build_rag_messages
 
 # --- Configuration ---
-# Define the local directory where your documents are stored
-LOCAL_DOCS_PATH = "my_local_documents" # <--- IMPORTANT: Change this to your desired folder path
+# The local documents directory is configured in indexer.py (LOCAL_DOCS_PATH)
 os.makedirs(LOCAL_DOCS_PATH, exist_ok=True) # Ensure the directory exists
 
-# --- Helper to determine MIME type from extension (simplified for local files) ---
-def get_mime_type_from_filename(filename):
-    """Simple heuristic to get MIME type based on file extension."""
-    ext = os.path.splitext(filename)[1].lower()
-    if ext == ".txt":
-        return "text/plain"
-    elif ext == ".pdf":
-        return "application/pdf"
-    elif ext == ".docx":
-        return "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-    # Add more as needed
-    return "application/octet-stream" # Default for unknown types
-
-def prepare_and_index_documents(chroma_collection):
-    """
-    Reads documents from LOCAL_DOCS_PATH, chunks them, and adds them to ChromaDB.
-    """
-    print(f"\n--- Preparing and Indexing Documents from '{LOCAL_DOCS_PATH}' ---")
-    documents_to_add = []
-    metadatas_to_add = []
-    ids_to_add = []
-
-    # Iterate through files in the specified local directory
-    for filename in os.listdir(LOCAL_DOCS_PATH):
-        filepath = os.path.join(LOCAL_DOCS_PATH, filename)
-
-        # Skip directories and non-files
-        if not os.path.isfile(filepath):
-            continue
+# By default only added/changed documents are re-indexed on start.
+# Set FULL_REINDEX=true to wipe the ChromaDB data and rebuild it from scratch.
+FULL_REINDEX = os.getenv("FULL_REINDEX", "false").lower() == "true"
 
-        print(f"Processing '{filename}'...")
-
-        mime_type = get_mime_type_from_filename(filename)
-        content = get_file_content(filepath, mime_type)
-
-        if content:
-            chunks = chunk_text(content)
-            if not chunks:
-                print(f"Warning: No content or chunks extracted from '{filename}'. Skipping.")
-                continue
-
-            for i, chunk in enumerate(chunks):
-                doc_id = str(uuid.uuid4()) # Generate a unique ID for each chunk
-                documents_to_add.append(chunk)
-                metadatas_to_add.append({"source": filename, "chunk_idx": i})
-                ids_to_add.append(doc_id)
-            print(f"Processed '{filename}' into {len(chunks)} chunks.")
-        else:
-            print(f"Could not extract content from '{filename}'. Skipping.")
+# Print answers token by token as they are generated (set STREAM_RESPONSES=false to wait for the full answer)
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "true").lower() != "false"
 
-    if documents_to_add:
-        add_documents_to_chroma(chroma_collection, documents_to_add, metadatas_to_add, ids_to_add)
-        print(f"\nSuccessfully indexed {len(documents_to_add)} document chunks.")
+def print_llm_answer(openai_client, messages, heading):
+    """
+    Prints the LLM answer under a heading, streaming it if enabled, and returns its text.
+    Returns None if there is no answer or the stream failed part-way, so that an incomplete
+    answer is never cached.
+    """
+    stats = {}
+    print(f"\n--- {heading} ---")
+    if STREAM_RESPONSES:
+        parts = []
+        for delta in stream_chat_completion(openai_client, messages, stats=stats):
+            print(delta, end="", flush=True)
+            parts.append(delta)
+        print()
+        response = "".join(parts) or None
+        if stats.get("error"):
+            print("[The answer above is incomplete: the response stream was interrupted.]")
+            response = None
     else:
-        print("No processable documents found in the directory to add to the knowledge base.")
+        response = get_chat_completion(openai_client, messages, stats=stats)
+        print(response)
+    if stats:
+        print(f"[{stats['mode']}: first token after {stats['ttft']:.2f}s, "
+              f"{stats['completion_tokens']} tokens in {stats['total_time']:.2f}s]")
+    return response
 
 def main():
     print("Welcome to the RAG System with Local ChromaDB!")
 
-    # Initialize clients
-    openai_client = get_openai_client()
+    # The OpenAI client is created when it is first needed; only its settings are checked here
+    openai_configured = is_openai_configured()
 
-    # Clear previous ChromaDB data for a fresh run
-    if os.path.exists(CHROMA_DB_PERSIST_DIR):
+    # Clear previous ChromaDB data only when a full rebuild was requested
+    if FULL_REINDEX and os.path.exists(CHROMA_DB_PERSIST_DIR):
         shutil.rmtree(CHROMA_DB_PERSIST_DIR)
         print(f"Cleaned up previous ChromaDB data in '{CHROMA_DB_PERSIST_DIR}'.")
 
     chroma_collection = get_chroma_collection()
 
-    if not all([openai_client, chroma_collection]):
+    if not all([openai_configured, chroma_collection]):
         print("Failed to initialize all necessary clients. Exiting.")
         return
 
-    # Prepare and Index Documents
+    # Prepare and Index Documents (incremental: only added/changed files are embedded)
     prepare_and_index_documents(chroma_collection)
 
+    # Documents added, changed or removed from now on are indexed in the background
+    watcher = DocumentWatcher(chroma_collection) if WATCH_DOCUMENTS else None
+    if watcher and not watcher.start():
+        watcher = None
+
+    # Answers to questions similar to earlier ones (with the same retrieved chunks) are reused
+    answer_cache = SemanticAnswerCache() if SEMANTIC_CACHE_ENABLED else None
+
     print("\nKnowledge base setup complete. You can now ask questions!")
     print("Type 'exit' to quit.")
+    # Import the OpenAI SDK while the first question is being typed
+    threading.Thread(target=preload_openai, daemon=True).start()
 
     while True:
         user_query = input("\nYour Question: ").strip()
         if user_query.lower() == 'exit':
+            if answer_cache:
+                stats = answer_cache.stats()
+                print(f"Answer cache: {stats['hits']} hits, {stats['misses']} misses "
+                      f"(hit rate {stats['hit_rate']:.0%}), {stats['latency_saved_seconds']:.1f}s of LLM latency saved.")
+            if watcher:
+                stats = watcher.stats()
+                if stats["files_indexed"]:
+                    print(f"Document watcher: {stats['files_indexed']} changed files indexed, searchable after "
+                          f"{stats['latency_p50_seconds']:.1f}s (p50) / {stats['latency_p95_seconds']:.1f}s (p95).")
+                # Let an indexing run in progress finish its batch
+                watcher.stop(timeout=10)
             print("Exiting application. Goodbye!")
             break
 
@@ -102,44 +105,45 @@ def main():
 
         # 1. Query ChromaDB for relevant documents
         print("Retrieving relevant documents from ChromaDB...")
-        retrieved_chunks = query_chroma(chroma_collection, [user_query], n_results=3)
+        if CONTEXT_PACKING_ENABLED:
+            # Diverse, de-overlapped chunks filling the context token budget
+            retrieved_chunks, retrieved_ids, query_embedding = pack_context(chroma_collection, user_query,
+                                                                            include_query_embedding=True)
+        else:
+            retrieved_chunks, retrieved_ids, query_embedding = query_chroma(
+                chroma_collection, [user_query], n_results=3, include_query_embedding=True)
+
+        # The answer cache reuses the retrieval's question embedding; a question answered by the
+        # BM25 fast path was not embedded, so that costs one embedding call here
+        if answer_cache is None:
+            query_embedding = None
+        elif query_embedding is None:
+            query_embedding = embed_query(user_query)
+        if query_embedding is not None:
+            cached_answer = answer_cache.lookup(query_embedding, retrieved_ids, get_index_generation())
+            if cached_answer is not None:
+                print("\n--- Answer (cached) ---")
+                print(cached_answer)
+                print("--------------")
+                continue
+        start_time = time.perf_counter()
+
+        # 2. Prepare prompt for LLM with retrieved context (or general knowledge if there is none)
+        messages = build_rag_messages(user_query, retrieved_chunks)
 
+        # 3. Get completion from Azure OpenAI chat model
+        openai_client = get_openai_client()
         if not retrieved_chunks:
             print("No relevant information found in the knowledge base.")
-            messages = [
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": user_query}
-            ]
-            response = get_chat_completion(openai_client, messages)
-            print("\n--- Answer (from general knowledge) ---")
-            print(response)
+            response = print_llm_answer(openai_client, messages, "Answer (from general knowledge)")
         else:
-            # 2. Prepare prompt for LLM with retrieved context
-            context_str = "\n\n".join([f"Content: {chunk}" for chunk in retrieved_chunks])
-
-            system_message = (
-                "You are a helpful assistant that answers questions based ONLY on the provided context. "
-                "If the answer is not found in the context, state that you don't know or that the information is not available."
-                "Do not make up information."
-            )
-            user_message = (
-                f"Context:\n{context_str}\n\n"
-                f"Question: {user_query}\n\n"
-                "Answer:"
-            )
-            messages = [
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": user_message}
-            ]
-
-            # 3. Get completion from Azure OpenAI chat model
             print("Generating response with LLM...")
-            response = get_chat_completion(openai_client, messages)
-
-            print("\n--- Answer ---")
-            print(response)
+            response = print_llm_answer(openai_client, messages, "Answer")
             print("--------------")
 
+        if query_embedding is not None:
+            answer_cache.store(query_embedding, retrieved_ids, response, time.perf_counter() - start_time, get_index_generation())
+
 if __name__ == "__main__":
     # --- IMPORTANT ---
     # Create the 'my_local_documents' folder in the same directory as main.py
@@ -1,8 +1,13 @@
 from dotenv import load_dotenv
-from openai import AzureOpenAI
+from embedding_cache import cached_embed
+from token_utils import count_tokens
+import telemetry
 
 
 import os
+import time
+import importlib
+import threading
 load_dotenv()
 
 AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
@@ -11,52 +16,205 @@ AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION")
 AZURE_OPENAI_DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME") # This is your deployment name
 AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME= os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME")
 
-def get_openai_client():
-    """Initializes and returns a single Azure OpenAI client for both embeddings and chat."""
+# Size of the HTTP connection pool shared by chat and embedding requests (ingestion embeds on several threads)
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "32"))
+
+_openai_client = None
+_openai_client_lock = threading.Lock()
+
+def is_openai_configured():
+    """Checks the Azure OpenAI settings without importing the SDK; prints an error if any is missing."""
     if not all([AZURE_OPENAI_API_KEY, AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_API_VERSION]):
         print("Error: Missing Azure OpenAI environment variables. Please check your .env file.")
+        return False
+    return True
+
+def preload_openai():
+    """
+    Imports the OpenAI SDK, the slowest import of the CLI, so that the first get_openai_client()
+    call is instant. Meant to run on a background thread while the user types a question.
+    """
+    try:
+        importlib.import_module("openai")
+    except Exception:
+        pass # get_openai_client reports the error
+
+def get_openai_client():
+    """
+    Returns the Azure OpenAI client shared by embeddings and chat, creating it on first use.
+    All threads share its pool of keep-alive HTTP connections. Returns None if it cannot be created.
+    """
+    global _openai_client
+    if _openai_client is not None:
+        return _openai_client
+    if not is_openai_configured():
+        return None
+    with _openai_client_lock:
+        if _openai_client is None:
+            try:
+                import httpx
+                from openai import AzureOpenAI, DefaultHttpxClient
+                _openai_client = AzureOpenAI(
+                    api_version=AZURE_OPENAI_API_VERSION,
+                    azure_endpoint=AZURE_OPENAI_ENDPOINT,
+                    api_key=AZURE_OPENAI_API_KEY, # Direct API key for simplicity, or use AzureKeyCredential
+                    http_client=DefaultHttpxClient(limits=httpx.Limits(
+                        max_connections=OPENAI_MAX_CONNECTIONS, max_keepalive_connections=OPENAI_MAX_CONNECTIONS))
+                )
+                print("Initialized Azure OpenAI client.")
+            except Exception as e:
+                print(f"Error initializing Azure OpenAI client: {e}")
+                return None
+    return _openai_client
+
+def get_async_openai_client():
+    """
+    Initializes and returns an AsyncAzureOpenAI client. Create it once and share it:
+    the client keeps a pool of HTTP connections that all requests reuse.
+    """
+    if not is_openai_configured():
         return None
     try:
-        client = AzureOpenAI(
+        from openai import AsyncAzureOpenAI
+        client = AsyncAzureOpenAI(
             api_version=AZURE_OPENAI_API_VERSION,
             azure_endpoint=AZURE_OPENAI_ENDPOINT,
-            api_key=AZURE_OPENAI_API_KEY # Direct API key for simplicity, or use AzureKeyCredential
+            api_key=AZURE_OPENAI_API_KEY
         )
-        print("Initialized Azure OpenAI client.")
+        print("Initialized async Azure OpenAI client.")
         return client
     except Exception as e:
-        print(f"Error initializing Azure OpenAI client: {e}")
+        print(f"Error initializing async Azure OpenAI client: {e}")
         return None
 
 def get_embedding(openai_client, text):
     """Generates an embedding for the given text using the Azure OpenAI embedding model."""
     if not openai_client:
         return None
-    try:
+    def embed_uncached(texts):
         response = openai_client.embeddings.create(
-            input=text,
+            input=texts,
             model=AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME
         )
-        return response.data[0].embedding
+        return [data.embedding for data in response.data]
+
+    try:
+        # Repeated questions are served from the embedding cache shared with ChromaDB
+        return cached_embed(AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME, [text], embed_uncached)[0]
     except Exception as e:
         print(f"Error generating embedding: {e}")
         return None
 
-def get_chat_completion(openai_client, messages, temperature=0.7, max_tokens=800):
-    """Generates a chat completion using the Azure OpenAI chat model."""
+def _record_usage(usage):
+    """Counts the prompt and completion tokens reported for a response."""
+    if usage is not None:
+        telemetry.incr("rag_llm_tokens_total", usage.prompt_tokens, kind="prompt")
+        telemetry.incr("rag_llm_tokens_total", usage.completion_tokens, kind="completion")
+
+def get_chat_completion(openai_client, messages, temperature=0.7, max_tokens=800, stats=None):
+    """
+    Generates a chat completion using the Azure OpenAI chat model.
+    If a stats dict is given, timing and token usage are recorded in it (see stream_chat_completion).
+    """
     if not openai_client:
         return None
+    start_time = time.perf_counter()
     try:
-        response = openai_client.chat.completions.create(
+        with telemetry.span("completion", mode="blocking") as span:
+            response = openai_client.chat.completions.create(
+                model=AZURE_OPENAI_DEPLOYMENT_NAME,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens
+            )
+            span.set(completion_tokens=response.usage.completion_tokens if response.usage else None)
+        _record_usage(response.usage)
+        content = response.choices[0].message.content
+        if stats is not None:
+            elapsed = time.perf_counter() - start_time
+            # Nothing is shown before the whole completion arrives, so the first token is the last
+            stats.update(
+                mode="blocking",
+                ttft=elapsed,
+                total_time=elapsed,
+                completion_tokens=response.usage.completion_tokens if response.usage else count_tokens(content)
+            )
+        return content
+    except Exception as e:
+        print(f"Error getting chat completion: {e}")
+        return None
+
+async def get_chat_completion_async(async_openai_client, messages, temperature=0.7, max_tokens=800):
+    """Async variant of get_chat_completion for use with an AsyncAzureOpenAI client."""
+    if not async_openai_client:
+        return None
+    try:
+        with telemetry.span("completion", mode="async") as span:
+            response = await async_openai_client.chat.completions.create(
+                model=AZURE_OPENAI_DEPLOYMENT_NAME,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens
+            )
+            span.set(completion_tokens=response.usage.completion_tokens if response.usage else None)
+        _record_usage(response.usage)
+        return response.choices[0].message.content
+    except Exception as e:
+        print(f"Error getting chat completion: {e}")
+        return None
+
+def stream_chat_completion(openai_client, messages, temperature=0.7, max_tokens=800, stats=None):
+    """
+    Generates a chat completion with stream=True and yields the text deltas as they arrive.
+    If a stats dict is given, it receives mode, ttft (seconds until the first token),
+    total_time, completion_tokens and error once the stream ends or is closed by the consumer;
+    closing the generator early also stops generation on the server.
+    A stream that fails part-way just stops yielding; its error (None otherwise) tells the
+    consumer that the text it received is incomplete.
+    """
+    if not openai_client:
+        return
+    start_time = time.perf_counter()
+    first_token_time = None
+    parts = []
+    error = None
+    try:
+        stream = openai_client.chat.completions.create(
             model=AZURE_OPENAI_DEPLOYMENT_NAME,
             messages=messages,
             temperature=temperature,
-            max_tokens=max_tokens
+            max_tokens=max_tokens,
+            stream=True
         )
-        return response.choices[0].message.content
+        try:
+            for chunk in stream:
+                # Azure sends chunks without choices (e.g. content filter results); skip them
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if first_token_time is None:
+                        first_token_time = time.perf_counter()
+                    parts.append(delta)
+                    yield delta
+        finally:
+            stream.close()
     except Exception as e:
-        print(f"Error getting chat completion: {e}")
-        return None
+        print(f"Error streaming chat completion: {e}")
+        error = e
+    finally:
+        end_time = time.perf_counter()
+        ttft = (first_token_time or end_time) - start_time
+        if stats is not None or telemetry.is_enabled():
+            completion_tokens = count_tokens("".join(parts))
+            if stats is not None:
+                stats.update(mode="stream", ttft=ttft, total_time=end_time - start_time, completion_tokens=completion_tokens,
+                             error=str(error) if error else None)
+            # A span cannot be held open across yields, so the stream is recorded once it ends
+            telemetry.record("completion", end_time - start_time, mode="stream", ttft=ttft,
+                             completion_tokens=completion_tokens, exc_type=type(error) if error else None)
+            telemetry.observe("rag_llm_ttft_seconds", ttft)
+            telemetry.incr("rag_llm_tokens_total", completion_tokens, kind="completion")
 
 if __name__ == "__main__":
     client = get_openai_client()
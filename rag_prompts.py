@@ -0,0 +1,35 @@
+# rag_prompts.py
+import telemetry
+
+RAG_SYSTEM_MESSAGE = (
+    "You are a helpful assistant that answers questions based ONLY on the provided context. "
+    "If the answer is not found in the context, state that you don't know or that the information is not available."
+    "Do not make up information."
+)
+
+def format_context(retrieved_chunks):
+    """Formats retrieved chunks into the context block of the RAG prompt."""
+    return "\n\n".join([f"Content: {chunk}" for chunk in retrieved_chunks])
+
+@telemetry.traced("prompt")
+def build_rag_messages(user_query, retrieved_chunks):
+    """
+    Builds the chat messages for a question. With retrieved chunks the model is asked to
+    answer only from that context; without any it answers from general knowledge.
+    """
+    if not retrieved_chunks:
+        return [
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": user_query}
+        ]
+
+    context_str = format_context(retrieved_chunks)
+    user_message = (
+        f"Context:\n{context_str}\n\n"
+        f"Question: {user_query}\n\n"
+        "Answer:"
+    )
+    return [
+        {"role": "system", "content": RAG_SYSTEM_MESSAGE},
+        {"role": "user", "content": user_message}
+    ]
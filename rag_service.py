@@ -0,0 +1,224 @@
+# rag_service.py
+"""
+Asynchronous HTTP service around the RAG pipeline.
+
+    POST /ask     {"question": "...", "n_results": 3}  -> {"answer": ..., "sources": [...], ...}
+                  (optional "where" metadata filter, "max_distance" cutoff and, with
+                  context packing, "token_budget"; n_results is then the minimum candidates)
+    POST /ingest                                       -> incrementally re-indexes LOCAL_DOCS_PATH
+    GET  /health                                       -> status, document counts, cache and watcher stats
+    GET  /metrics                                      -> Prometheus metrics (TELEMETRY_ENABLED=true)
+
+One AsyncAzureOpenAI client (with its pooled HTTP connections) and one opened ChromaDB
+collection are shared by all requests. ChromaDB calls are blocking, so they run on a
+thread pool; a semaphore bounds the number of in-flight LLM calls. With WATCH_DOCUMENTS
+(the default), changes to LOCAL_DOCS_PATH are indexed in the background while requests are served.
+Run with:  python rag_service.py --port 8080
+For local end-to-end testing, point AZURE_OPENAI_ENDPOINT at fake_azure_server.py.
+"""
+import os
+import time
+import asyncio
+import argparse
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from openai_utils import get_async_openai_client, get_chat_completion_async
+from chromadb_utils import get_chroma_collection, embed_query, get_bm25_index, query_chroma, get_index_generation
+from embedding_cache import get_embedding_cache
+from indexer import LOCAL_DOCS_PATH, prepare_and_index_documents
+from document_watcher import DocumentWatcher, WATCH_DOCUMENTS
+from semantic_cache import SemanticAnswerCache, SEMANTIC_CACHE_ENABLED
+from rag_prompts import build_rag_messages
+from context_packer import pack_context, CONTEXT_PACKING_ENABLED, CONTEXT_TOKEN_BUDGET, CONTEXT_CANDIDATES
+import telemetry
+
+SERVICE_HOST = os.getenv("RAG_SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("RAG_SERVICE_PORT", "8080"))
+MAX_INFLIGHT_LLM_CALLS = int(os.getenv("MAX_INFLIGHT_LLM_CALLS", "8"))
+RETRIEVAL_THREADS = int(os.getenv("RETRIEVAL_THREADS", "8"))
+DEFAULT_N_RESULTS = 3
+
+# Keys under which shared resources are stored on the aiohttp application
+OPENAI_CLIENT = web.AppKey("openai_client", object)
+COLLECTION = web.AppKey("collection", object)
+EXECUTOR = web.AppKey("executor", ThreadPoolExecutor)
+LLM_SEMAPHORE = web.AppKey("llm_semaphore", asyncio.Semaphore)
+INGEST_LOCK = web.AppKey("ingest_lock", asyncio.Lock)
+ANSWER_CACHE = web.AppKey("answer_cache", object)
+WATCHER = web.AppKey("watcher", object)
+STATS = web.AppKey("stats", dict)
+
+async def run_blocking(app, fn, *args):
+    """Runs a blocking call (ChromaDB, embeddings, indexing) on the shared thread pool."""
+    # The call runs in a copy of this task's context, so its spans join the request's trace
+    call = functools.partial(contextvars.copy_context().run, fn, *args)
+    return await asyncio.get_running_loop().run_in_executor(app[EXECUTOR], call)
+
+def positive_int_field(body, key, default):
+    """Reads an optional positive integer field of a request body, or rejects the request."""
+    value = body.get(key, default)
+    try:
+        if isinstance(value, bool):
+            raise ValueError
+        value = int(value)
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(text=f"'{key}' must be an integer.")
+    if value < 1:
+        raise web.HTTPBadRequest(text=f"'{key}' must be at least 1.")
+    return value
+
+@telemetry.traced("ask")
+async def handle_ask(request):
+    app = request.app
+    try:
+        body = await request.json()
+    except Exception:
+        raise web.HTTPBadRequest(text="Request body must be JSON.")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text="Request body must be a JSON object.")
+    question = str(body.get("question", "")).strip()
+    if not question:
+        raise web.HTTPBadRequest(text="Missing 'question'.")
+    n_results = positive_int_field(body, "n_results", DEFAULT_N_RESULTS)
+    token_budget = positive_int_field(body, "token_budget", CONTEXT_TOKEN_BUDGET)
+    # Optional ChromaDB metadata filter (e.g. {"source": "policy.pdf"}) and distance cutoff
+    where = body.get("where") or None
+    if where is not None and not isinstance(where, dict):
+        raise web.HTTPBadRequest(text="'where' must be a JSON object.")
+    max_distance = body.get("max_distance")
+    if max_distance is not None and (isinstance(max_distance, bool) or not isinstance(max_distance, (int, float))):
+        raise web.HTTPBadRequest(text="'max_distance' must be a number.")
+
+    start_time = time.perf_counter()
+    if CONTEXT_PACKING_ENABLED:
+        retrieved_chunks, retrieved_ids, query_embedding = await run_blocking(
+            app, functools.partial(pack_context, include_query_embedding=True),
+            app[COLLECTION], question, token_budget, max(n_results, CONTEXT_CANDIDATES), where, max_distance
+        )
+    else:
+        retrieved_chunks, retrieved_ids, query_embedding = await run_blocking(
+            app, functools.partial(query_chroma, include_query_embedding=True),
+            app[COLLECTION], [question], n_results, True, None, where, max_distance
+        )
+    retrieval_time = time.perf_counter() - start_time
+
+    answer_cache = app[ANSWER_CACHE]
+    # The answer cache reuses the retrieval's question embedding; a question answered by the
+    # BM25 fast path was not embedded, so that costs one embedding call here
+    if answer_cache is None:
+        query_embedding = None
+    elif query_embedding is None:
+        query_embedding = await run_blocking(app, embed_query, question)
+    if query_embedding is not None:
+        cached_answer = answer_cache.lookup(query_embedding, retrieved_ids, get_index_generation())
+        if cached_answer is not None:
+            app[STATS]["cached_answers"] += 1
+            return web.json_response({
+                "answer": cached_answer,
+                "sources": retrieved_ids,
+                "cached": True,
+                "timings": {"retrieval": retrieval_time, "total": time.perf_counter() - start_time},
+            })
+
+    messages = build_rag_messages(question, retrieved_chunks)
+    llm_start = time.perf_counter()
+    async with app[LLM_SEMAPHORE]:
+        app[STATS]["inflight_llm_calls"] += 1
+        try:
+            answer = await get_chat_completion_async(app[OPENAI_CLIENT], messages)
+        finally:
+            app[STATS]["inflight_llm_calls"] -= 1
+    llm_time = time.perf_counter() - llm_start
+    if answer is None:
+        raise web.HTTPBadGateway(text="The language model did not return an answer.")
+
+    if query_embedding is not None:
+        answer_cache.store(query_embedding, retrieved_ids, answer, llm_time, get_index_generation())
+    app[STATS]["answers"] += 1
+    return web.json_response({
+        "answer": answer,
+        "sources": retrieved_ids,
+        "cached": False,
+        "timings": {"retrieval": retrieval_time, "llm": llm_time, "total": time.perf_counter() - start_time},
+    })
+
+async def handle_ingest(request):
+    app = request.app
+    if app[INGEST_LOCK].locked():
+        raise web.HTTPConflict(text="An ingest is already running.")
+    async with app[INGEST_LOCK]:
+        start_time = time.perf_counter()
+        indexed_chunks = await run_blocking(app, prepare_and_index_documents, app[COLLECTION])
+    return web.json_response({
+        "indexed_chunks": indexed_chunks,
+        "duration": time.perf_counter() - start_time,
+        "docs_path": LOCAL_DOCS_PATH,
+    })
+
+async def handle_health(request):
+    app = request.app
+    documents = await run_blocking(app, app[COLLECTION].count)
+    embedding_cache = get_embedding_cache()
+    answer_cache = app[ANSWER_CACHE]
+    return web.json_response({
+        "status": "ok",
+        "documents": documents,
+        "bm25_documents": len(get_bm25_index()),
+        "ingest_running": app[INGEST_LOCK].locked(),
+        "requests": app[STATS],
+        "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+        "answer_cache": answer_cache.stats() if answer_cache else None,
+        "watcher": app[WATCHER].stats() if app[WATCHER] else None,
+    })
+
+async def handle_metrics(request):
+    app = request.app
+    if not telemetry.is_enabled():
+        raise web.HTTPNotFound(text="Telemetry is disabled. Set TELEMETRY_ENABLED=true to collect metrics.")
+    telemetry.set_gauge("rag_inflight_llm_calls", app[STATS]["inflight_llm_calls"])
+    telemetry.set_gauge("rag_bm25_documents", len(get_bm25_index()))
+    return web.Response(text=telemetry.render_prometheus(),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+async def on_startup(app):
+    app[EXECUTOR] = ThreadPoolExecutor(max_workers=RETRIEVAL_THREADS, thread_name_prefix="rag-blocking")
+    app[OPENAI_CLIENT] = get_async_openai_client()
+    app[COLLECTION] = await run_blocking(app, get_chroma_collection)
+    if not all([app[OPENAI_CLIENT], app[COLLECTION]]):
+        raise RuntimeError("Failed to initialize all necessary clients.")
+    app[LLM_SEMAPHORE] = asyncio.Semaphore(MAX_INFLIGHT_LLM_CALLS)
+    app[INGEST_LOCK] = asyncio.Lock()
+    app[ANSWER_CACHE] = SemanticAnswerCache() if SEMANTIC_CACHE_ENABLED else None
+    app[STATS] = {"answers": 0, "cached_answers": 0, "inflight_llm_calls": 0}
+    watcher = DocumentWatcher(app[COLLECTION]) if WATCH_DOCUMENTS else None
+    app[WATCHER] = watcher if watcher and watcher.start() else None
+
+async def on_cleanup(app):
+    if app.get(WATCHER):
+        await run_blocking(app, app[WATCHER].stop, 10)
+    if app.get(OPENAI_CLIENT):
+        await app[OPENAI_CLIENT].close()
+    app[EXECUTOR].shutdown(wait=False)
+
+def create_app():
+    """Builds the aiohttp application; clients are created on startup and shared by all requests."""
+    app = web.Application()
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_post("/ask", handle_ask)
+    app.router.add_post("/ingest", handle_ingest)
+    app.router.add_get("/health", handle_health)
+    app.router.add_get("/metrics", handle_metrics)
+    return app
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the RAG pipeline over HTTP.")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    args = parser.parse_args()
+    os.makedirs(LOCAL_DOCS_PATH, exist_ok=True)
+    web.run_app(create_app(), host=args.host, port=args.port)
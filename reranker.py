@@ -0,0 +1,196 @@
+# reranker.py
+import os
+import math
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+from dotenv import load_dotenv
+
+from bm25_index import tokenize
+import telemetry
+
+load_dotenv()
+
+# Two-stage retrieval: over-retrieve RERANK_CANDIDATES chunks, re-score them and keep only
+# the best few, instead of sending the raw top-n by vector distance to the chat model
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "true").lower() != "false"
+# "lexical": fast feature scorer; "cross-encoder": a local sentence-transformers CrossEncoder
+RERANKER = os.getenv("RERANKER", "lexical").lower()
+# Candidates retrieved by the first stage for every query
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "50"))
+# Queries not re-ranked within this many milliseconds keep the first-stage order
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "250"))
+RERANK_WORKERS = int(os.getenv("RERANK_WORKERS", "4"))
+# (query, chunk) pairs per CrossEncoder call; batches of all queries are scored in parallel
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+CROSS_ENCODER_MODEL = os.getenv("CROSS_ENCODER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+
+# Weights of the lexical scorer's features: IDF-weighted share of the query terms in the
+# chunk, share of the query's term pairs found as a phrase, and the first-stage rank
+LEXICAL_WEIGHTS = {"coverage": 0.5, "phrase": 0.3, "prior": 0.2}
+
+class Reranker:
+    """
+    Interface of the re-rankers. score() maps a query and a list of candidate chunks, in
+    first-stage order, to one score per chunk (higher is better). batch_size is the number
+    of chunks per score() call, or None if a query's candidates must be scored together.
+    """
+    name = None
+    batch_size = None
+
+    def score(self, query, documents):
+        raise NotImplementedError
+
+class LexicalReranker(Reranker):
+    """
+    CPU-only feature scorer, about a millisecond for 50 chunks. Term weights are IDFs
+    within the candidate set, so terms that every candidate shares count for little; a
+    prior from the first-stage rank keeps the semantic order among lexical ties.
+    """
+    name = "lexical"
+    batch_size = None
+
+    def __init__(self, weights=LEXICAL_WEIGHTS):
+        self.weights = weights
+
+    def score(self, query, documents):
+        query_terms = tokenize(query)
+        terms = set(query_terms)
+        pairs = set(zip(query_terms, query_terms[1:]))
+        documents_terms = [tokenize(document) for document in documents]
+        term_sets = [set(document_terms) for document_terms in documents_terms]
+        count = len(documents)
+        idf = {term: math.log(1.0 + (count - df + 0.5) / (df + 0.5))
+               for term, df in ((term, sum(term in term_set for term_set in term_sets)) for term in terms)}
+        total_idf = sum(idf.values())
+        scores = np.zeros(count, dtype=np.float32)
+        for i, (document_terms, term_set) in enumerate(zip(documents_terms, term_sets)):
+            coverage = sum(idf[term] for term in terms & term_set) / total_idf if total_idf else 0.0
+            phrase = len(pairs & set(zip(document_terms, document_terms[1:]))) / len(pairs) if pairs else 0.0
+            prior = 1.0 - i / count
+            scores[i] = (self.weights["coverage"] * coverage + self.weights["phrase"] * phrase
+                         + self.weights["prior"] * prior)
+        return scores
+
+class CrossEncoderReranker(Reranker):
+    """Scores (query, chunk) pairs with a local CrossEncoder (requires the optional sentence-transformers package)."""
+    def __init__(self, model_name=CROSS_ENCODER_MODEL, batch_size=RERANK_BATCH_SIZE):
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name, device="cpu")
+        self.batch_size = batch_size
+        self.name = f"cross-encoder-{os.path.basename(model_name.rstrip('/'))}"
+
+    def score(self, query, documents):
+        return np.asarray(self.model.predict([(query, document) for document in documents],
+                                             batch_size=self.batch_size, show_progress_bar=False), dtype=np.float32)
+
+def _create_cross_encoder():
+    try:
+        return CrossEncoderReranker()
+    except ImportError:
+        print("Error: RERANKER=cross-encoder requires the sentence-transformers package.")
+        return None
+    except Exception as e:
+        print(f"Error loading cross-encoder model '{CROSS_ENCODER_MODEL}': {e}")
+        return None
+
+# Registry of available re-rankers; add new ones here
+RERANKERS = {
+    "lexical": LexicalReranker,
+    "cross-encoder": _create_cross_encoder,
+}
+
+_reranker = None
+_reranker_created = False
+_reranker_lock = threading.Lock()
+_executor = None
+
+def get_reranker(name=RERANKER):
+    """
+    Returns the configured re-ranker, creating it (and loading its model) on first use.
+    Returns None if it is unknown or cannot be created; retrieval then keeps the first-stage order.
+    """
+    global _reranker, _reranker_created
+    with _reranker_lock:
+        if not _reranker_created:
+            factory = RERANKERS.get(name)
+            if factory is None:
+                print(f"Error: Unknown RERANKER '{name}'. Choose one of: {', '.join(RERANKERS)}.")
+            else:
+                _reranker = factory()
+            _reranker_created = True
+    return _reranker
+
+def _get_executor():
+    global _executor
+    with _reranker_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=RERANK_WORKERS, thread_name_prefix="rerank")
+    return _executor
+
+def _select(result, order, n_results, rerank, relevance=None):
+    """A copy of a query_chroma_batch result with its parallel lists reordered by order and cut to n_results."""
+    order = order[:n_results]
+    selected = {key: [value[i] for i in order] if isinstance(value, list) else value for key, value in result.items()}
+    selected["rerank"] = rerank
+    if relevance is not None:
+        selected["relevance"] = [float(relevance[i]) for i in order]
+    return selected
+
+def rerank_batch(query_texts, results, n_results, reranker=None, budget_ms=None):
+    """
+    Re-orders the over-retrieved query_chroma_batch results of a batch of queries by
+    re-ranker score and keeps the best n_results of each. The candidates of all queries
+    are split into batches scored in parallel on a thread pool; a query whose batches are
+    not all scored within budget_ms (default RERANK_BUDGET_MS), or whose scoring failed,
+    keeps its first-stage order.
+    Each result gets "rerank": the re-ranker's name, "fallback" or "off", and re-ranked
+    results a "relevance" list of scores scaled to [0, 1] for the context packer.
+    A batch still running at the deadline finishes in the background and is discarded.
+    """
+    reranker = reranker or get_reranker()
+    if reranker is None:
+        return [_select(result, list(range(len(result["ids"]))), n_results, "off") for result in results]
+    deadline = time.perf_counter() + (RERANK_BUDGET_MS if budget_ms is None else budget_ms) / 1000
+
+    with telemetry.span("rerank", queries=len(results), candidates=sum(len(result["ids"]) for result in results),
+                        reranker=reranker.name) as span:
+        executor = _get_executor()
+        tasks = [] # [(position, offset, future)]
+        for position, (query, result) in enumerate(zip(query_texts, results)):
+            documents = result["documents"]
+            step = reranker.batch_size or max(len(documents), 1)
+            for offset in range(0, len(documents), step):
+                tasks.append((position, offset, executor.submit(reranker.score, query, documents[offset:offset + step])))
+        wait([future for _, _, future in tasks], timeout=max(deadline - time.perf_counter(), 0.0))
+
+        scores = [np.zeros(len(result["ids"]), dtype=np.float32) for result in results]
+        failed = set()
+        for position, offset, future in tasks:
+            if not future.done() or future.cancelled():
+                future.cancel()
+                failed.add(position)
+            elif future.exception() is not None:
+                print(f"Error re-ranking retrieved chunks: {future.exception()}")
+                failed.add(position)
+            else:
+                batch_scores = future.result()
+                scores[position][offset:offset + len(batch_scores)] = batch_scores
+
+        reranked = []
+        for position, result in enumerate(results):
+            if position in failed:
+                reranked.append(_select(result, list(range(len(result["ids"]))), n_results, "fallback"))
+                telemetry.incr("rag_rerank_total", outcome="fallback")
+                continue
+            query_scores = scores[position]
+            order = [int(i) for i in np.argsort(-query_scores, kind="stable")]
+            lowest = float(query_scores.min()) if len(query_scores) else 0.0
+            spread = float(query_scores.max()) - lowest if len(query_scores) else 0.0
+            relevance = (query_scores - lowest) / spread if spread > 0 else np.ones_like(query_scores)
+            reranked.append(_select(result, order, n_results, reranker.name, relevance))
+            telemetry.incr("rag_rerank_total", outcome="reranked")
+        span.set(fallbacks=len(failed))
+    return reranked
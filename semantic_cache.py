@@ -0,0 +1,125 @@
+# semantic_cache.py
+import os
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from dotenv import load_dotenv
+
+import telemetry
+
+load_dotenv()
+
+# A cached answer is reused for a new question whose embedding is at least this similar
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() != "false"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL_SECONDS = float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "3600"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+
+class SemanticAnswerCache:
+    """
+    In-memory cache of LLM answers keyed on question embeddings.
+    A lookup hits when a previous question is above the cosine-similarity threshold AND
+    retrieval returned the same chunk IDs, so the answer is grounded in the same context.
+    Entries expire after a TTL, the least recently used entry is evicted when full, and
+    everything is dropped when the index generation changes.
+    """
+    def __init__(self, threshold=SEMANTIC_CACHE_THRESHOLD, ttl_seconds=SEMANTIC_CACHE_TTL_SECONDS,
+                 max_entries=SEMANTIC_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # key -> entry dict, least recently used first
+        self._matrix = None # Stacked normalized embeddings, rebuilt lazily after changes
+        self._matrix_keys = []
+        self._next_key = 0
+        self._index_generation = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.latency_saved = 0.0
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_generation(self, index_generation):
+        if index_generation != self._index_generation:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._matrix = None
+            self._index_generation = index_generation
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl_seconds
+        expired = [key for key, entry in self._entries.items() if entry["created"] < cutoff]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def lookup(self, query_embedding, chunk_ids, index_generation):
+        """Returns the cached answer for a similar question with the same retrieved chunks, or None."""
+        with self._lock:
+            self._check_generation(index_generation)
+            self._expire()
+            if not self._entries:
+                self.misses += 1
+                telemetry.incr("rag_answer_cache_lookups_total", result="miss")
+                return None
+            if self._matrix is None:
+                self._matrix_keys = list(self._entries)
+                self._matrix = np.vstack([self._entries[key]["embedding"] for key in self._matrix_keys])
+            similarities = self._matrix @ self._normalize(query_embedding)
+            chunk_ids = tuple(chunk_ids)
+            # Check candidates from most to least similar until one also matches the retrieval
+            for i in np.argsort(-similarities):
+                if similarities[i] < self.threshold:
+                    break
+                key = self._matrix_keys[i]
+                entry = self._entries[key]
+                if entry["chunk_ids"] == chunk_ids:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self.latency_saved += entry["latency"]
+                    telemetry.incr("rag_answer_cache_lookups_total", result="hit")
+                    return entry["answer"]
+            self.misses += 1
+            telemetry.incr("rag_answer_cache_lookups_total", result="miss")
+            return None
+
+    def store(self, query_embedding, chunk_ids, answer, latency, index_generation):
+        """Caches an answer with the chunk IDs it was generated from and the time it took."""
+        if answer is None:
+            return
+        with self._lock:
+            self._check_generation(index_generation)
+            self._entries[self._next_key] = {
+                "embedding": self._normalize(query_embedding),
+                "chunk_ids": tuple(chunk_ids),
+                "answer": answer,
+                "latency": latency,
+                "created": time.monotonic(),
+            }
+            self._next_key += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def stats(self):
+        """Returns hit rate, latency saved and size of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "latency_saved_seconds": self.latency_saved,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+            }
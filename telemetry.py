@@ -0,0 +1,339 @@
+# telemetry.py
+"""
+Lightweight tracing and metrics for the RAG pipeline.
+
+    with telemetry.span("embed", texts=len(texts)) as span:
+        ...
+        span.set(tokens=n)
+    telemetry.incr("rag_embedding_cache_hits_total", hits)
+    telemetry.observe("rag_embedding_batch_size", len(batch), buckets=telemetry.SIZE_BUCKETS)
+
+Every span's duration is recorded in the rag_stage_duration_seconds histogram, labelled
+by stage, and (with TELEMETRY_LOG_PATH) written as one JSON line with its attributes,
+trace and parent span, so the stages of one question or ingest run can be correlated.
+Metrics are exposed in the Prometheus text format by render_prometheus(), written to
+TELEMETRY_METRICS_PATH periodically and at exit, and served on /metrics by rag_service.py.
+Disabled (the default), span() returns a shared no-op object and incr()/observe() return
+immediately, so instrumented code pays one flag check per call.
+"""
+import os
+import json
+import time
+import atexit
+import bisect
+import inspect
+import logging
+import functools
+import itertools
+import threading
+import contextvars
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TELEMETRY_ENABLED = os.getenv("TELEMETRY_ENABLED", "false").lower() == "true"
+# JSON-lines span log; empty disables span logging (metrics are still collected)
+TELEMETRY_LOG_PATH = os.getenv("TELEMETRY_LOG_PATH", "")
+# Prometheus text file (e.g. for the node_exporter textfile collector); empty disables it
+TELEMETRY_METRICS_PATH = os.getenv("TELEMETRY_METRICS_PATH", "")
+TELEMETRY_METRICS_INTERVAL = float(os.getenv("TELEMETRY_METRICS_INTERVAL", "15"))
+
+# Histogram buckets for durations (seconds) and for sizes (batch sizes, token counts)
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+STAGE_DURATION_METRIC = "rag_stage_duration_seconds"
+STAGE_ERRORS_METRIC = "rag_stage_errors_total"
+
+# HELP lines of the metrics the pipeline records
+METRIC_HELP = {
+    STAGE_DURATION_METRIC: "Duration of pipeline stages.",
+    STAGE_ERRORS_METRIC: "Pipeline stages that raised an exception.",
+    "rag_embedding_batch_size": "Texts per embedding backend call.",
+    "rag_embedding_tokens_total": "Tokens sent to the embedding backend.",
+    "rag_embedding_cache_hits_total": "Texts served from the embedding cache.",
+    "rag_embedding_cache_misses_total": "Texts not found in the embedding cache.",
+    "rag_chroma_upserted_documents_total": "Chunks upserted into ChromaDB.",
+    "rag_retries_total": "Retried API calls, by error type.",
+    "rag_retrievals_total": "Retrievals, by the retrieval that answered them.",
+    "rag_context_tokens": "Tokens of the packed prompt context.",
+    "rag_codegen_tickets_total": "Tickets of batch code generation, by outcome (generated, cached, failed).",
+    "rag_rerank_total": "Retrieved candidate sets re-ranked, or left in first-stage order (fallback).",
+    "rag_llm_tokens_total": "Chat completion tokens, by kind (prompt or completion).",
+    "rag_llm_ttft_seconds": "Time to the first streamed completion token.",
+    "rag_answer_cache_lookups_total": "Semantic answer cache lookups, by result.",
+    "rag_inflight_llm_calls": "Chat completions in flight in the service.",
+    "rag_bm25_documents": "Chunks in the BM25 index.",
+    "rag_watch_queue_depth": "Changed documents waiting to be indexed by the document watcher.",
+    "rag_watch_change_latency_seconds": "Time from a document change until it is searchable.",
+}
+
+logger = logging.getLogger("rag.telemetry")
+logger.propagate = False
+
+_enabled = TELEMETRY_ENABLED
+_current_span = contextvars.ContextVar("telemetry_span", default=None)
+_span_ids = itertools.count(1)
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+class MetricsRegistry:
+    """Thread-safe counters, gauges and fixed-bucket histograms, rendered in the Prometheus text format."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._types = {} # name -> "counter", "gauge" or "histogram"
+        self._values = {} # (name, labels) -> value, for counters and gauges
+        self._histograms = {} # (name, labels) -> [bucket counts..., sum, count]
+        self._buckets = {} # histogram name -> upper bounds
+
+    def incr(self, name, value, labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._types.setdefault(name, "counter")
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set_gauge(self, name, value, labels):
+        with self._lock:
+            self._types.setdefault(name, "gauge")
+            self._values[(name, _label_key(labels))] = value
+
+    def observe(self, name, value, buckets, labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._types.setdefault(name, "histogram")
+            bounds = self._buckets.setdefault(name, tuple(buckets))
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(bounds) + 2)
+            # Counts are per bucket here and made cumulative when rendered
+            index = bisect.bisect_left(bounds, value)
+            if index < len(bounds):
+                histogram[index] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def reset(self):
+        with self._lock:
+            self._types.clear()
+            self._values.clear()
+            self._histograms.clear()
+            self._buckets.clear()
+
+    def snapshot(self):
+        """Returns {name: {labels: value}} for counters and gauges and {labels: {"sum", "count"}} for histograms."""
+        with self._lock:
+            metrics = {}
+            for (name, labels), value in self._values.items():
+                metrics.setdefault(name, {})[_format_labels(labels)] = value
+            for (name, labels), histogram in self._histograms.items():
+                metrics.setdefault(name, {})[_format_labels(labels)] = {"sum": histogram[-2], "count": histogram[-1]}
+            return metrics
+
+    def render(self):
+        """Renders every metric in the Prometheus text exposition format."""
+        with self._lock:
+            lines = []
+            for name in sorted(self._types):
+                metric_type = self._types[name]
+                if name in METRIC_HELP:
+                    lines.append(f"# HELP {name} {METRIC_HELP[name]}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                if metric_type != "histogram":
+                    for (metric, labels), value in sorted(self._values.items()):
+                        if metric == name:
+                            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+                bounds = self._buckets[name]
+                for (metric, labels), histogram in sorted(self._histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(bounds, histogram):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(labels + (('le', _format_value(bound)),))} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram[-1]}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram[-2])}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram[-1]}")
+            return "\n".join(lines) + "\n"
+
+def _escape_label_value(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in labels) + "}"
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+registry = MetricsRegistry()
+
+class Span:
+    """A timed pipeline stage; use through telemetry.span(). Attributes end up in the span log."""
+    __slots__ = ("name", "attributes", "span_id", "parent_id", "trace_id", "start", "_token")
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        """Adds attributes (token counts, batch sizes, ...) known only once the stage has run."""
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self.span_id = next(_span_ids)
+        self.parent_id = parent.span_id if parent else None
+        self.trace_id = parent.trace_id if parent else os.urandom(8).hex()
+        self._token = _current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        _current_span.reset(self._token)
+        _finish(self.name, duration, self.attributes, exc_type, self.span_id, self.parent_id, self.trace_id)
+        return False
+
+class _NoopSpan:
+    """Stands in for Span while telemetry is disabled."""
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NOOP_SPAN = _NoopSpan()
+
+def _finish(name, duration, attributes, exc_type, span_id, parent_id, trace_id):
+    labels = {"stage": name}
+    registry.observe(STAGE_DURATION_METRIC, duration, DURATION_BUCKETS, labels)
+    if exc_type is not None:
+        registry.incr(STAGE_ERRORS_METRIC, 1, labels)
+    if logger.handlers and logger.isEnabledFor(logging.INFO):
+        record = {"ts": time.time(), "span": name, "duration_ms": round(duration * 1000, 3),
+                  "trace": trace_id, "id": span_id, "parent": parent_id}
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        record.update(attributes)
+        logger.info(json.dumps(record, default=str))
+
+def is_enabled():
+    return _enabled
+
+def span(name, **attributes):
+    """Times the enclosed block as pipeline stage name; nested spans share their trace."""
+    if not _enabled:
+        return _NOOP_SPAN
+    return Span(name, attributes)
+
+def traced(name):
+    """Decorator running every call of a function (or coroutine function) in a span."""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if not _enabled:
+                    return await fn(*args, **kwargs)
+                with Span(name, {}):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with Span(name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def record(name, duration, exc_type=None, **attributes):
+    """
+    Records an already measured stage, for code that cannot wrap it in a span (e.g. generators,
+    worker processes); exc_type is the type of the exception the stage failed with, if any.
+    """
+    if not _enabled:
+        return
+    parent = _current_span.get()
+    _finish(name, duration, attributes, exc_type, next(_span_ids), parent.span_id if parent else None,
+            parent.trace_id if parent else os.urandom(8).hex())
+
+def incr(name, value=1, **labels):
+    """Adds value to a counter."""
+    if not _enabled:
+        return
+    registry.incr(name, value, labels)
+
+def set_gauge(name, value, **labels):
+    """Sets a gauge to value."""
+    if not _enabled:
+        return
+    registry.set_gauge(name, value, labels)
+
+def observe(name, value, buckets=DURATION_BUCKETS, **labels):
+    """Records value in a histogram; every series of a metric must use the same buckets."""
+    if not _enabled:
+        return
+    registry.observe(name, value, buckets, labels)
+
+def render_prometheus():
+    """All metrics in the Prometheus text exposition format."""
+    return registry.render()
+
+def write_metrics_file(path=None):
+    """Atomically writes the metrics to path (default TELEMETRY_METRICS_PATH)."""
+    path = path or TELEMETRY_METRICS_PATH
+    if not path:
+        return
+    try:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(render_prometheus())
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"Error writing metrics to {path}: {e}")
+
+_metrics_writer = None
+
+def _write_metrics_periodically(path, interval):
+    while True:
+        time.sleep(interval)
+        write_metrics_file(path)
+
+def configure(enabled=None, log_path=None, metrics_path=None, metrics_interval=TELEMETRY_METRICS_INTERVAL):
+    """
+    Turns telemetry on or off and sets up the span log and metrics file. Called on import
+    with the TELEMETRY_* settings; call it again to enable telemetry programmatically.
+    """
+    global _enabled, _metrics_writer
+    if enabled is not None:
+        _enabled = enabled
+    if log_path:
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+            handler.close()
+        handler = logging.FileHandler(log_path, encoding='utf-8')
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+    if _enabled and metrics_path and _metrics_writer is None:
+        atexit.register(write_metrics_file, metrics_path)
+        if metrics_interval > 0:
+            _metrics_writer = threading.Thread(target=_write_metrics_periodically, args=(metrics_path, metrics_interval),
+                                               name="telemetry-metrics", daemon=True)
+            _metrics_writer.start()
+
+if TELEMETRY_ENABLED:
+    configure(True, TELEMETRY_LOG_PATH, TELEMETRY_METRICS_PATH)
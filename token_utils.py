@@ -0,0 +1,54 @@
+# token_utils.py
+# cl100k_base is the encoding used by the Azure OpenAI embedding and GPT-3.5/4 chat models
+TOKEN_ENCODING_NAME = "cl100k_base"
+
+# Rough characters-per-token ratio for English text, used when the tiktoken encoding is unavailable
+APPROX_CHARS_PER_TOKEN = 4
+
+_encoding = None
+_encoding_unavailable = False
+
+def get_encoding():
+    """
+    Returns the tiktoken encoding, or None when it is not available.
+    tiktoken (optional: exact token counts for OpenAI models) is imported on the first call.
+    It downloads the encoding on first use, so on air-gapped machines without a cached copy
+    loading it fails like a missing package does, and token counts are estimated.
+    """
+    global _encoding, _encoding_unavailable
+    if _encoding is None and not _encoding_unavailable:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TOKEN_ENCODING_NAME)
+        except ImportError:
+            _encoding_unavailable = True
+        except Exception as e:
+            print(f"Could not load the '{TOKEN_ENCODING_NAME}' token encoding ({e}); estimating token counts.")
+            _encoding_unavailable = True
+    return _encoding
+
+def count_tokens(text):
+    """Counts the tokens in a text (approximated from its length without tiktoken)."""
+    if not text:
+        return 0
+    encoding = get_encoding()
+    if encoding is None:
+        return max(1, (len(text) + APPROX_CHARS_PER_TOKEN - 1) // APPROX_CHARS_PER_TOKEN)
+    return len(encoding.encode_ordinary(text))
+
+def count_tokens_batch(texts):
+    """Counts the tokens of many texts at once; tiktoken encodes the batch in parallel."""
+    encoding = get_encoding()
+    if encoding is None:
+        return [count_tokens(text) for text in texts]
+    return [len(tokens) for tokens in encoding.encode_ordinary_batch(list(texts))]
+
+def truncate_to_tokens(text, max_tokens):
+    """Returns the longest prefix of text that has at most max_tokens tokens."""
+    if max_tokens <= 0:
+        return ""
+    encoding = get_encoding()
+    if encoding is None:
+        return text[:max_tokens * APPROX_CHARS_PER_TOKEN]
+    tokens = encoding.encode_ordinary(text)
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
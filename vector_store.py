@@ -0,0 +1,608 @@
+# vector_store.py
+import os
+import json
+import shutil
+import threading
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "chroma": ChromaDB with its HNSW index; "quantized": QuantizedVectorStore below
+VECTOR_STORE = os.getenv("VECTOR_STORE", "chroma").lower()
+# Storage type of the quantized vectors: "int8" (4x smaller than float32) or "float16" (2x)
+VECTOR_STORE_DTYPE = os.getenv("VECTOR_STORE_DTYPE", "int8").lower()
+# "exact" scans every vector; "ivf" probes only the clusters nearest to the query;
+# "auto" uses IVF once the store is large enough to have trained its clusters
+VECTOR_STORE_SEARCH = os.getenv("VECTOR_STORE_SEARCH", "auto").lower()
+# Float32 copies of the vectors can be kept on disk (never loaded whole) to re-rank the quantized
+# candidates exactly. They cost 4x the int8 vectors on disk, which undoes the size saving of
+# quantization, for about 2% of recall@10; without them, candidates are re-ranked dequantized
+VECTOR_STORE_KEEP_FLOAT = os.getenv("VECTOR_STORE_KEEP_FLOAT", "false").lower() == "true"
+# Candidates re-ranked per requested result
+VECTOR_STORE_RERANK_FACTOR = int(os.getenv("VECTOR_STORE_RERANK_FACTOR", "4"))
+# IVF clusters are trained once the store holds this many vectors; queries probe the nearest NPROBE clusters
+# (exact search converts every quantized vector to float32 per query, which is slower than
+# ChromaDB's HNSW index beyond a few thousand vectors)
+VECTOR_STORE_IVF_MIN_ROWS = int(os.getenv("VECTOR_STORE_IVF_MIN_ROWS", "4096"))
+VECTOR_STORE_NPROBE = int(os.getenv("VECTOR_STORE_NPROBE", "16"))
+
+VECTOR_STORE_VERSION = 1
+# Rows converted to float32 at a time by the exact search, which bounds its temporary memory
+SEARCH_BLOCK_ROWS = 16384
+# Dead (deleted or replaced) rows are compacted away once they outnumber the live ones
+COMPACT_MIN_DEAD_ROWS = 1024
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLES_PER_CLUSTER = 64
+
+_STORAGE_DTYPES = {"int8": np.int8, "float16": np.float16}
+
+def _compare(op, value, operand):
+    try:
+        if op == "$eq":
+            return value == operand
+        if op == "$ne":
+            return value != operand
+        if op == "$in":
+            return value in operand
+        if op == "$nin":
+            return value not in operand
+        if value is None:
+            return False
+        if op == "$gt":
+            return value > operand
+        if op == "$gte":
+            return value >= operand
+        if op == "$lt":
+            return value < operand
+        if op == "$lte":
+            return value <= operand
+    except TypeError:
+        return False
+    raise ValueError(f"Unsupported where operator '{op}'.")
+
+def matches_where(metadata, where):
+    """Evaluates a ChromaDB metadata filter, e.g. {"source": "a.pdf"}, {"page": {"$gte": 3}} or {"$and": [...]}."""
+    metadata = metadata or {}
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            if not all(_compare(op, metadata.get(key), operand) for op, operand in condition.items()):
+                return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+def kmeans(vectors, num_clusters, iterations=KMEANS_ITERATIONS, seed=0):
+    """Lloyd's k-means on float32 vectors; returns the (num_clusters, dim) centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), num_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = nearest_centroids(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=num_clusters)
+        # Empty clusters keep their previous centroid
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+def nearest_centroids(vectors, centroids, count=1):
+    """Index of the nearest centroid (L2) of every vector, or the count nearest ones as a (n, count) array."""
+    distances = np.sum(centroids * centroids, axis=1) - 2.0 * (vectors @ centroids.T)
+    if count == 1:
+        return np.argmin(distances, axis=1)
+    count = min(count, len(centroids))
+    nearest = np.argpartition(distances, count - 1, axis=1)[:, :count]
+    return nearest
+
+class QuantizedVectorStore:
+    """
+    Compact vector store with the interface of a ChromaDB collection (upsert, query, get,
+    update, delete, count), so the rest of the pipeline can use either.
+    Vectors are stored quantized (int8 with a per-vector scale, or float16) in flat
+    memory-mapped files; metadata and document offsets go to an append-only JSON-lines
+    log that is replayed on open, and document texts to a separate blob file, so opening
+    the store reads no vectors at all. Queries scan the quantized vectors block by block
+    (or, once trained, only the nearest IVF clusters) and re-rank the best candidates with
+    the dequantized vectors (or float32 copies, if kept on disk). Distances are squared L2, like ChromaDB's default.
+    Deleted and replaced rows are dropped by compact(), which writes a new generation of
+    files and switches to it atomically.
+    """
+    def __init__(self, name, store_dir, embedding_function=None, dtype=VECTOR_STORE_DTYPE,
+                 keep_float=VECTOR_STORE_KEEP_FLOAT, search=VECTOR_STORE_SEARCH):
+        if dtype not in _STORAGE_DTYPES:
+            raise ValueError(f"Unsupported vector store dtype '{dtype}'. Choose one of: {', '.join(_STORAGE_DTYPES)}.")
+        self.name = name
+        self.path = os.path.join(store_dir, name)
+        self.search = search
+        self._embedding_function = embedding_function
+        self._default_config = {"version": VECTOR_STORE_VERSION, "dtype": dtype, "keep_float": keep_float, "dim": None}
+        self._lock = threading.RLock()
+        os.makedirs(self.path, exist_ok=True)
+        self._open()
+
+    # --- Files ---
+
+    def _file(self, name, generation=None):
+        return os.path.join(self.path, generation or self._generation, name)
+
+    def _open(self):
+        """Loads the current generation: config, IVF centroids and the replayed metadata log."""
+        current_path = os.path.join(self.path, "CURRENT")
+        if os.path.exists(current_path):
+            with open(current_path, 'r', encoding='utf-8') as f:
+                self._generation = f.read().strip()
+        else:
+            self._generation = "gen-000000"
+            os.makedirs(os.path.join(self.path, self._generation), exist_ok=True)
+            self._write_current()
+
+        self.config = dict(self._default_config)
+        if os.path.exists(self._file("store.json")):
+            with open(self._file("store.json"), 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+            if stored.get("version") != VECTOR_STORE_VERSION:
+                raise ValueError(f"Vector store '{self.path}' has version {stored.get('version')}, "
+                                 f"expected {VECTOR_STORE_VERSION}. Delete it to re-index.")
+            # The files decide how they are read, whatever the current settings say
+            self.config.update(stored)
+        self.dim = self.config["dim"]
+        self._storage_dtype = _STORAGE_DTYPES[self.config["dtype"]]
+        self._centroids = np.load(self._file("centroids.npy")) if os.path.exists(self._file("centroids.npy")) else None
+
+        self._ids = [] # row -> id, None once deleted or replaced
+        self._rows = {} # id -> row
+        self._metadatas = []
+        self._documents = [] # row -> (offset, length) in documents.bin, or None
+        self._lists = [] # row -> IVF cluster, -1 if unassigned
+        self._live = np.zeros(0, dtype=bool)
+        self._documents_end = 0
+        self._maps = None
+        self._ivf = None # (rows ordered by cluster, cluster bounds), rebuilt after changes
+        self._replay_log()
+
+    def _write_current(self):
+        tmp_path = os.path.join(self.path, "CURRENT.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self._generation)
+        os.replace(tmp_path, os.path.join(self.path, "CURRENT"))
+
+    def _write_config(self, generation=None):
+        with open(self._file("store.json", generation), 'w', encoding='utf-8') as f:
+            json.dump(self.config, f)
+
+    def _replay_log(self):
+        log_path = self._file("log.jsonl")
+        if not os.path.exists(log_path):
+            return
+        live = []
+        valid_bytes = 0
+        with open(log_path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break # Torn write at the end of the log
+                valid_bytes += len(line)
+                op = record["op"]
+                if op == "add":
+                    previous = self._rows.get(record["id"])
+                    if previous is not None:
+                        self._ids[previous] = None
+                        live[previous] = False
+                    row = record["row"]
+                    while len(self._ids) <= row:
+                        self._ids.append(None)
+                        self._metadatas.append(None)
+                        self._documents.append(None)
+                        self._lists.append(-1)
+                        live.append(False)
+                    self._ids[row] = record["id"]
+                    self._rows[record["id"]] = row
+                    self._metadatas[row] = record.get("meta")
+                    self._documents[row] = tuple(record["doc"]) if record.get("doc") else None
+                    self._lists[row] = record.get("list", -1)
+                    live[row] = True
+                    if record.get("doc"):
+                        self._documents_end = max(self._documents_end, record["doc"][0] + record["doc"][1])
+                elif op == "del":
+                    row = self._rows.pop(record["id"], None)
+                    if row is not None:
+                        self._ids[row] = None
+                        live[row] = False
+                elif op == "meta":
+                    row = self._rows.get(record["id"])
+                    if row is not None:
+                        self._metadatas[row] = record["meta"]
+        if valid_bytes < os.path.getsize(log_path):
+            with open(log_path, 'r+b') as f:
+                f.truncate(valid_bytes)
+        self._live = np.asarray(live, dtype=bool)
+
+    def _append_log(self, records):
+        with open(self._file("log.jsonl"), 'ab') as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records).encode('utf-8'))
+
+    def _write_rows(self, name, start_row, array, generation=None):
+        path = self._file(name, generation)
+        with open(path, 'r+b' if os.path.exists(path) else 'w+b') as f:
+            f.seek(start_row * array.shape[1] * array.itemsize)
+            f.write(np.ascontiguousarray(array).tobytes())
+
+    def _mapped(self):
+        """(quantized vectors, [scale, norm] per row, float32 vectors or None), mapped up to the last row."""
+        num_rows = len(self._ids)
+        if self._maps is None or self._maps[0].shape[0] != num_rows:
+            if num_rows == 0:
+                self._maps = (np.zeros((0, self.dim or 0), dtype=self._storage_dtype),
+                              np.zeros((0, 2), dtype=np.float32), None)
+            else:
+                vectors = np.memmap(self._file("vectors.bin"), dtype=self._storage_dtype, mode='r', shape=(num_rows, self.dim))
+                row_info = np.memmap(self._file("rows.f32"), dtype=np.float32, mode='r', shape=(num_rows, 2))
+                full = (np.memmap(self._file("full.f32"), dtype=np.float32, mode='r', shape=(num_rows, self.dim))
+                        if self.config["keep_float"] else None)
+                self._maps = (vectors, row_info, full)
+        return self._maps
+
+    # --- Vectors ---
+
+    def _quantize(self, vectors):
+        norms = np.linalg.norm(vectors, axis=1)
+        if self._storage_dtype is np.int8:
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        else:
+            scales = np.ones(len(vectors), dtype=np.float32)
+            quantized = vectors.astype(np.float16)
+        return quantized, np.stack([scales, norms], axis=1).astype(np.float32)
+
+    def _dequantize(self, rows):
+        vectors, row_info, _ = self._mapped()
+        return vectors[rows].astype(np.float32) * row_info[rows, 0:1]
+
+    def _float_vectors(self, rows):
+        """The most precise stored vectors of the given rows (float32 copies, or dequantized)."""
+        full = self._mapped()[2]
+        return np.asarray(full[rows]) if full is not None else self._dequantize(rows)
+
+    # --- Collection interface ---
+
+    def count(self):
+        with self._lock:
+            return len(self._rows)
+
+    def upsert(self, ids, embeddings=None, documents=None, metadatas=None):
+        """Adds documents, replacing those with the same IDs; embeds the documents if no embeddings are given."""
+        ids = list(ids)
+        if not ids:
+            return
+        if len(set(ids)) != len(ids):
+            raise ValueError("Expected IDs to be unique within one upsert.")
+        if embeddings is None:
+            if self._embedding_function is None:
+                raise ValueError("Embeddings are required when the store has no embedding function.")
+            embeddings = self._embedding_function(documents)
+        vectors = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+        documents = documents if documents is not None else [None] * len(ids)
+        metadatas = metadatas if metadatas is not None else [None] * len(ids)
+        with self._lock:
+            if self.dim is None:
+                self.dim = self.config["dim"] = vectors.shape[1]
+                self._write_config()
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the store's dimension {self.dim}.")
+
+            # Vectors and documents are written first; rows only exist once their log record is written
+            start = len(self._ids)
+            quantized, row_info = self._quantize(vectors)
+            self._write_rows("vectors.bin", start, quantized)
+            self._write_rows("rows.f32", start, row_info)
+            if self.config["keep_float"]:
+                self._write_rows("full.f32", start, vectors)
+            lists = nearest_centroids(vectors, self._centroids) if self._centroids is not None else [-1] * len(ids)
+
+            spans = []
+            blob = bytearray()
+            for document in documents:
+                if document is None:
+                    spans.append(None)
+                    continue
+                data = document.encode('utf-8')
+                spans.append((self._documents_end + len(blob), len(data)))
+                blob += data
+            if blob:
+                with open(self._file("documents.bin"), 'r+b' if os.path.exists(self._file("documents.bin")) else 'w+b') as f:
+                    f.seek(self._documents_end)
+                    f.write(blob)
+
+            records = [{"op": "add", "id": chunk_id, "row": start + i, "doc": spans[i], "meta": metadatas[i],
+                        "list": int(lists[i])} for i, chunk_id in enumerate(ids)]
+            self._append_log(records)
+
+            live = np.ones(len(ids), dtype=bool)
+            self._live = np.concatenate([self._live, live])
+            for i, chunk_id in enumerate(ids):
+                previous = self._rows.get(chunk_id)
+                if previous is not None:
+                    self._ids[previous] = None
+                    self._live[previous] = False
+                self._rows[chunk_id] = start + i
+            self._ids.extend(ids)
+            self._metadatas.extend(metadatas)
+            self._documents.extend(spans)
+            self._lists.extend(int(cluster) for cluster in lists)
+            self._documents_end += len(blob)
+            self._ivf = None
+            self._maintain()
+
+    def add(self, ids, embeddings=None, documents=None, metadatas=None):
+        self.upsert(ids, embeddings, documents, metadatas)
+
+    def _matching_rows(self, ids=None, where=None):
+        if ids is not None:
+            rows = [self._rows[chunk_id] for chunk_id in ids if chunk_id in self._rows]
+        else:
+            rows = np.flatnonzero(self._live).tolist()
+        if where:
+            rows = [row for row in rows if matches_where(self._metadatas[row], where)]
+        return rows
+
+    def delete(self, ids=None, where=None):
+        """Deletes the documents with the given IDs and/or matching the metadata filter."""
+        if ids is None and not where:
+            return
+        with self._lock:
+            rows = self._matching_rows(ids, where)
+            if not rows:
+                return
+            self._append_log([{"op": "del", "id": self._ids[row]} for row in rows])
+            for row in rows:
+                del self._rows[self._ids[row]]
+                self._ids[row] = None
+                self._live[row] = False
+            self._ivf = None
+            self._maintain()
+
+    def update(self, ids, embeddings=None, documents=None, metadatas=None):
+        """Updates existing documents; metadata-only updates don't touch the vectors."""
+        with self._lock:
+            ids = [chunk_id for chunk_id in ids if chunk_id in self._rows]
+            if embeddings is not None or documents is not None:
+                existing = self.get(ids=ids, include=["documents", "metadatas", "embeddings"])
+                by_id = {chunk_id: i for i, chunk_id in enumerate(existing["ids"])}
+                self.upsert(
+                    ids,
+                    embeddings if embeddings is not None else [existing["embeddings"][by_id[i]] for i in ids],
+                    documents if documents is not None else [existing["documents"][by_id[i]] for i in ids],
+                    metadatas if metadatas is not None else [existing["metadatas"][by_id[i]] for i in ids]
+                )
+                return
+            if metadatas is None or not ids:
+                return
+            records = []
+            for chunk_id, metadata in zip(ids, metadatas):
+                row = self._rows[chunk_id]
+                merged = dict(self._metadatas[row] or {}, **(metadata or {}))
+                self._metadatas[row] = merged
+                records.append({"op": "meta", "id": chunk_id, "meta": merged})
+            self._append_log(records)
+
+    def _read_documents(self, rows):
+        path = self._file("documents.bin")
+        if not os.path.exists(path):
+            return [None] * len(rows)
+        documents = []
+        with open(path, 'rb') as f:
+            for row in rows:
+                span = self._documents[row]
+                if span is None:
+                    documents.append(None)
+                    continue
+                f.seek(span[0])
+                documents.append(f.read(span[1]).decode('utf-8'))
+        return documents
+
+    def _result_columns(self, rows, include):
+        columns = {"documents": None, "metadatas": None, "embeddings": None}
+        if "documents" in include:
+            columns["documents"] = self._read_documents(rows)
+        if "metadatas" in include:
+            columns["metadatas"] = [self._metadatas[row] for row in rows]
+        if "embeddings" in include:
+            columns["embeddings"] = self._float_vectors(np.asarray(rows, dtype=np.int64)) if rows else np.zeros((0, self.dim or 0), dtype=np.float32)
+        return columns
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=("documents", "metadatas")):
+        """Returns the stored documents by ID and/or metadata filter, in insertion order when no IDs are given."""
+        with self._lock:
+            rows = self._matching_rows(ids, where)
+            rows = rows[offset or 0:]
+            if limit is not None:
+                rows = rows[:limit]
+            result = {"ids": [self._ids[row] for row in rows]}
+            result.update(self._result_columns(rows, include))
+            return result
+
+    def query(self, query_embeddings=None, query_texts=None, n_results=10, where=None,
+              include=("documents", "metadatas", "distances")):
+        """Returns the n_results nearest documents of every query, as lists of lists like ChromaDB."""
+        if query_embeddings is None:
+            if self._embedding_function is None:
+                raise ValueError("query_embeddings are required when the store has no embedding function.")
+            query_embeddings = self._embedding_function(query_texts)
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        queries = queries.reshape(len(queries), -1)
+        result = {"ids": [], "distances": [], "documents": [], "metadatas": [], "embeddings": []}
+        with self._lock:
+            if self.dim is not None and queries.shape[1] != self.dim:
+                raise ValueError(f"Query dimension {queries.shape[1]} does not match the store's dimension {self.dim}.")
+            allowed = self._live
+            if where:
+                allowed = allowed.copy()
+                for row in np.flatnonzero(allowed):
+                    allowed[row] = matches_where(self._metadatas[row], where)
+            num_candidates = max(n_results, n_results * VECTOR_STORE_RERANK_FACTOR)
+            # IVF only pays off unfiltered; a filter may exclude most of the probed clusters
+            if not where and self._use_ivf():
+                candidates = [self._ivf_candidates(query, allowed, num_candidates) for query in queries]
+            else:
+                candidates = self._exact_candidates(queries, allowed, num_candidates)
+            for query, rows in zip(queries, candidates):
+                rows, distances = self._rerank(query, rows, n_results)
+                result["ids"].append([self._ids[row] for row in rows])
+                result["distances"].append(distances)
+                columns = self._result_columns(rows, include)
+                for key in ("documents", "metadatas", "embeddings"):
+                    result[key].append(columns[key])
+        for key in ("distances", "documents", "metadatas", "embeddings"):
+            if key not in include:
+                result[key] = None
+        return result
+
+    # --- Search ---
+
+    def _exact_candidates(self, queries, allowed, num_candidates):
+        """Scans the quantized vectors block by block; returns the best candidate rows of every query."""
+        vectors, row_info, _ = self._mapped()
+        best_rows = [np.zeros(0, dtype=np.int64) for _ in queries]
+        best_distances = [np.zeros(0, dtype=np.float32) for _ in queries]
+        for start in range(0, len(vectors), SEARCH_BLOCK_ROWS):
+            end = min(start + SEARCH_BLOCK_ROWS, len(vectors))
+            mask = allowed[start:end]
+            if not mask.any():
+                continue
+            block_rows = np.flatnonzero(mask)
+            # Skip the gather when every row of the block is allowed (the common, unfiltered case)
+            block = np.asarray(vectors[start:end])
+            block = (block if len(block_rows) == len(block) else block[block_rows]).astype(np.float32)
+            scales, norms = row_info[start:end, 0][block_rows], row_info[start:end, 1][block_rows]
+            # Squared L2 up to the query norm: |x|^2 - 2 q.x, with q.x computed on the quantized values
+            distances = (norms * norms)[:, None] - 2.0 * (block @ queries.T) * scales[:, None]
+            keep = min(num_candidates, len(block_rows))
+            top = np.argpartition(distances, keep - 1, axis=0)[:keep] if keep < len(block_rows) else \
+                np.broadcast_to(np.arange(len(block_rows))[:, None], (keep, len(queries)))
+            for i in range(len(queries)):
+                best_rows[i] = np.concatenate([best_rows[i], block_rows[top[:, i]] + start])
+                best_distances[i] = np.concatenate([best_distances[i], distances[top[:, i], i]])
+                if len(best_rows[i]) > num_candidates:
+                    order = np.argpartition(best_distances[i], num_candidates - 1)[:num_candidates]
+                    best_rows[i], best_distances[i] = best_rows[i][order], best_distances[i][order]
+        return best_rows
+
+    def _use_ivf(self):
+        return self._centroids is not None and self.search in ("auto", "ivf")
+
+    def _ivf_candidates(self, query, allowed, num_candidates):
+        if self._ivf is None:
+            lists = np.asarray(self._lists, dtype=np.int64)
+            order = np.argsort(lists, kind="stable")
+            bounds = np.searchsorted(lists[order], np.arange(len(self._centroids) + 1))
+            self._ivf = (order, bounds)
+        order, bounds = self._ivf
+        probes = nearest_centroids(query[None, :], self._centroids, VECTOR_STORE_NPROBE)[0]
+        rows = np.concatenate([order[bounds[cluster]:bounds[cluster + 1]] for cluster in probes])
+        rows = rows[allowed[rows]]
+        if len(rows) < num_candidates:
+            # Too few vectors in the probed clusters; scan everything instead
+            return self._exact_candidates(query[None, :], allowed, num_candidates)[0]
+        vectors, row_info, _ = self._mapped()
+        rows.sort() # Sequential access to the memory map
+        distances = row_info[rows, 1] ** 2 - 2.0 * (vectors[rows].astype(np.float32) @ query) * row_info[rows, 0]
+        return rows[np.argpartition(distances, num_candidates - 1)[:num_candidates]]
+
+    def _rerank(self, query, rows, n_results):
+        """Orders candidate rows by their exact squared L2 distance to the query; returns the best n_results."""
+        if len(rows) == 0:
+            return [], []
+        rows = np.sort(rows)
+        vectors = self._float_vectors(rows)
+        distances = np.sum((vectors - query) ** 2, axis=1)
+        best = np.argsort(distances, kind="stable")[:n_results]
+        return rows[best].tolist(), distances[best].astype(float).tolist()
+
+    # --- Maintenance ---
+
+    def _maintain(self):
+        live = len(self._rows)
+        dead = len(self._ids) - live
+        trainable = self.search != "exact" and live >= VECTOR_STORE_IVF_MIN_ROWS
+        needs_training = trainable and (self._centroids is None or live >= 4 * self.config.get("trained_rows", live))
+        if (dead >= COMPACT_MIN_DEAD_ROWS and dead > live) or needs_training:
+            self.compact()
+
+    def compact(self):
+        """
+        Rewrites the live rows into a new generation of files (re-training the IVF clusters
+        when the store is large enough) and atomically switches to it.
+        """
+        with self._lock:
+            rows = np.flatnonzero(self._live)
+            number = int(self._generation.rsplit("-", 1)[1]) + 1
+            generation = f"gen-{number:06d}"
+            os.makedirs(os.path.join(self.path, generation), exist_ok=True)
+            config = dict(self.config)
+            centroids = None
+            if self.search != "exact" and len(rows) >= VECTOR_STORE_IVF_MIN_ROWS:
+                num_clusters = int(np.sqrt(len(rows)))
+                sample_size = min(len(rows), num_clusters * KMEANS_SAMPLES_PER_CLUSTER)
+                sample = np.sort(np.random.default_rng(0).choice(rows, sample_size, replace=False))
+                centroids = kmeans(self._float_vectors(sample), num_clusters).astype(np.float32)
+                np.save(os.path.join(self.path, generation, "centroids.npy"), centroids)
+                config["trained_rows"] = len(rows)
+
+            records = []
+            blob_offset = 0
+            with open(os.path.join(self.path, generation, "documents.bin"), 'wb') as blob:
+                for start in range(0, len(rows), SEARCH_BLOCK_ROWS):
+                    block = rows[start:start + SEARCH_BLOCK_ROWS]
+                    vectors, row_info, full = self._mapped()
+                    self._write_rows("vectors.bin", start, np.asarray(vectors[block]), generation)
+                    self._write_rows("rows.f32", start, np.asarray(row_info[block]), generation)
+                    if full is not None:
+                        self._write_rows("full.f32", start, np.asarray(full[block]), generation)
+                    lists = (nearest_centroids(self._float_vectors(block), centroids) if centroids is not None
+                             else [-1] * len(block))
+                    for i, (row, document) in enumerate(zip(block, self._read_documents(block))):
+                        span = None
+                        if document is not None:
+                            data = document.encode('utf-8')
+                            blob.write(data)
+                            span = (blob_offset, len(data))
+                            blob_offset += len(data)
+                        records.append({"op": "add", "id": self._ids[row], "row": start + i, "doc": span,
+                                        "meta": self._metadatas[row], "list": int(lists[i])})
+            with open(os.path.join(self.path, generation, "log.jsonl"), 'w', encoding='utf-8') as f:
+                f.write("".join(json.dumps(record) + "\n" for record in records))
+            self.config = config
+            self._write_config(generation)
+
+            previous = self._generation
+            self._generation = generation
+            self._write_current()
+            self._maps = None
+            shutil.rmtree(os.path.join(self.path, previous), ignore_errors=True)
+            self._open()
+            print(f"Compacted vector store '{self.name}' to {len(rows)} vectors"
+                  f"{f' in {len(centroids)} IVF clusters' if centroids is not None else ''}.")
+
+    def stats(self):
+        """Row counts and file sizes of the store."""
+        with self._lock:
+            directory = os.path.join(self.path, self._generation)
+            files = {name: os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)}
+            return {
+                "vectors": len(self._rows),
+                "dead_rows": len(self._ids) - len(self._rows),
+                "dtype": self.config["dtype"],
+                "dimension": self.dim,
+                "ivf_clusters": len(self._centroids) if self._centroids is not None else 0,
+                "bytes": files,
+            }